@@ -0,0 +1,75 @@
+'''
+Micro-benchmark for serializing list responses: compares the previous
+approach (inspect() the mapper for every row, then json.dumps with
+default=str) with the cached RowSerializer used by the resources.
+
+No database is needed, rows are built as (transient) ORM objects.
+
+Run from the root folder of the project:
+    $ python3 potion-shop/benchmarks/serializer_benchmark.py [rows]
+'''
+import json
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import inspect
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from potion_shop.database.logging.models import Log
+from potion_shop.database.models import PotionInventory
+from potion_shop.database.serializer import dumps, serializer_for
+
+def inspect_to_dict(obj):
+    # Base.to_dict before the RowSerializer
+    return {c.key: getattr(obj, c.key)
+            for c in inspect(obj).mapper.column_attrs}
+
+def encode_inspect(rows):
+    return json.dumps({'results': [inspect_to_dict(r) for r in rows]}, default=str).encode('utf-8')
+
+def encode_serializer(rows):
+    serializer = serializer_for(type(rows[0]))
+    return dumps({'results': [serializer.to_json_dict(r) for r in rows]})
+
+def make_inventory(total):
+    rows = []
+    for i in range(total):
+        row = PotionInventory(potion_id=i % 9 + 1, price=15, amount=i % 40, on_sale=i % 2 == 0)
+        row.id = i + 1
+        rows.append(row)
+    return rows
+
+def make_logs(total):
+    rows = []
+    for i in range(total):
+        row = Log(level='ERROR', msg='Request Error', request_route='GET : /v1/potions/999',
+                  request_headers={'HOST': 'localhost'}, response_status='404 Not Found')
+        row.log_id = i + 1
+        rows.append(row)
+    return rows
+
+def best_of(fn, rows, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(total):
+    for name, rows in [('PotionInventory', make_inventory(total)), ('Log', make_logs(total))]:
+        # both approaches must produce the same response
+        assert encode_inspect(rows) == encode_serializer(rows)
+
+        old = best_of(encode_inspect, rows)
+        new = best_of(encode_serializer, rows)
+        print(f'{name} ({total:,} rows):')
+        print(f'    inspect + json.dumps(default=str): {total / old:>12,.0f} rows/sec')
+        print(f'    RowSerializer:                     {total / new:>12,.0f} rows/sec')
+        print(f'    speedup:                           {old / new:>12.1f}x')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -1,21 +1,76 @@
+import argparse
+import sys
+
+from potion_shop.utils.startup import StartupTimer
+startup = StartupTimer()
+
 import aumbry
-from gunicorn.app.base import BaseApplication
-from gunicorn.workers.sync import SyncWorker
 
-from potion_shop.application import PotionApplication
 from potion_shop.configuration import PotionConfig
 
-class CustomWorker(SyncWorker):
+# gunicorn worker models that can be set as 'worker_class' in the config:
+#   sync:    one request at a time per worker
+#   gthread: up to 'threads' requests at a time per worker (threads)
+#   gevent:  up to 'worker_connections' requests at a time per worker
+#            (greenlets, see utils/cooperative.py)
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+parser = argparse.ArgumentParser(prog='python -m potion_shop')
+parser.add_argument('--no-schema-check', action='store_true',
+                    help='don\'t create missing tables & indexes (the schema is up to date)')
+parser.add_argument('--migrate', action='store_true',
+                    help='create missing tables & indexes, then exit without serving')
+args = parser.parse_args()
+
+cfg = aumbry.load(
+    aumbry.FILE,
+    PotionConfig,
+    {
+        'CONFIG_FILE_PATH': './config/config.yml'
+    }
+)
+startup.lap('config')
+
+# migrate-once: the schema is checked by this command only, and the
+# servers are started with --no-schema-check (see database/migrations.py)
+if args.migrate:
+    from potion_shop.application import PotionApplication
+    cfg.database['schema_check'] = True
+    PotionApplication(cfg).stop()
+    sys.exit(0)
+if args.no_schema_check:
+    cfg.database['schema_check'] = False
+
+worker_class = cfg.gunicorn.get('worker_class') or 'sync'
+if worker_class not in WORKER_CLASSES:
+    sys.exit(f'[ERROR] Unsupported worker_class: {worker_class}. Must be one of: {", ".join(WORKER_CLASSES)}')
 
-    def handle_quit(self, sig, frame):
-        self.app.application.stop(sig)
-        super().handle_quit(sig, frame)
+# the gevent worker serves many requests at a time per worker. the standard
+# library & psycopg2 must be made cooperative before the application (and
+# anything that uses sockets or threads) is imported
+if worker_class == 'gevent':
+    from potion_shop.utils.cooperative import patch
+    patch()
 
-    def run(self):
-        self.app.application.start()
-        super().run()
+from gunicorn.app.base import BaseApplication
+
+from potion_shop.application import PotionApplication
+startup.lap('imports')
 
+'''
+Runs the application with gunicorn, using the options in the 'gunicorn'
+config. The application is created once, in the master process, and
+each worker is forked from it:
+    - pre_fork: the master closes its DB connections, so the worker
+      doesn't share them (see PotionApplication.before_fork)
+    - post_fork: the worker opens its DB connections and warms up
+      (see PotionApplication.start)
+    - worker_exit: the worker writes pending changes & closes its DB
+      connections (see PotionApplication.stop)
 
+On shutdown (SIGTERM), workers stop accepting requests and finish the
+ones in flight, for up to 'graceful_timeout' seconds, before exiting.
+'''
 class GunicornApplication(BaseApplication):
     def __init__(self, app, options=None):
         self.options = options or {}
@@ -26,18 +81,24 @@ class GunicornApplication(BaseApplication):
         for key, value in self.options.items():
             self.cfg.set(key.lower(), value)
 
+        # gunicorn checks the number of arguments of the hooks
+        def pre_fork(server, worker):
+            self.application.before_fork()
+
+        def post_fork(server, worker):
+            self.application.start()
+
+        def worker_exit(server, worker):
+            self.application.stop()
+
+        self.cfg.set('pre_fork', pre_fork)
+        self.cfg.set('post_fork', post_fork)
+        self.cfg.set('worker_exit', worker_exit)
+
     def load(self):
         return self.application
 
 
-cfg = aumbry.load(
-    aumbry.FILE,
-    PotionConfig,
-    {
-        'CONFIG_FILE_PATH': './config/config.yml'
-    }
-)
-
-app = PotionApplication(cfg)
+app = PotionApplication(cfg, startup)
 guinicorn_app = GunicornApplication(app, cfg.gunicorn)
 guinicorn_app.run()
@@ -1,51 +1,132 @@
 from pathlib import Path
 
+import time
+
 import falcon
-from falcon_swagger_ui import register_swaggerui_app
+from sqlalchemy.exc import OperationalError
 
 from potion_shop.database.db_utils import DatabaseManager
-from potion_shop.database.flavors import PostgresServer
+from potion_shop.database.write_behind import StockAdjuster
+from potion_shop.database.flavors import PostgresServer, SqliteServer
+from potion_shop.database.idempotency import DatabaseIdempotencyStore
+from potion_shop.database.query_cache import query_cache
+from potion_shop.database.replicas import ReplicaSet
+from potion_shop.database.statement_timeout import is_statement_timeout
 from potion_shop.database.models import Potions
 from potion_shop.database.models import PotionTypes
 from potion_shop.database.models import PotionPotency
 from potion_shop.database.models import PotionInventory
+from potion_shop.database.operators import DBOperator
 from potion_shop.resources.database import BasicResource
+from potion_shop.resources.importer import ImportResource
+from potion_shop.resources.inventory import PurchaseResource
+from potion_shop.resources.inventory import StockAdjustmentResource
+from potion_shop.resources.metrics import MetricsResource
 from potion_shop.resources.potion_resource import PotionResource
+from potion_shop.resources.swagger import SwaggerUI
+from potion_shop.utils.cache import ResponseCache
+from potion_shop.utils.idempotency import IdempotencyStore
+from potion_shop.utils.log_sampling import LogSampler
 from potion_shop.utils.exceptions import DatabaseConnectionError
+from potion_shop.utils.exceptions import InvalidConfiguration
+from potion_shop.utils.exceptions import ItemNotFound
+from potion_shop.utils.startup import StartupTimer
 
 # logging
-from potion_shop.database.logging.manager import setup_logging
+from potion_shop.database.logging.manager import flush_logs, get_logger, setup_logging
 
 # middleware
+from potion_shop.middleware.db_session import DBSessionMiddleware
 from potion_shop.middleware.log_error import LogHTTPErrors
 from potion_shop.middleware.stream_handler import StreamHandler
+from potion_shop.middleware.etag import ETagMiddleware
+from potion_shop.middleware.idempotency import IdempotencyMiddleware
 from potion_shop.middleware.oauth2 import OAuth2Middleware
+from potion_shop.middleware.read_routing import ReadRoutingMiddleware
+from potion_shop.middleware.response_cache import ResponseCacheMiddleware
+
+# bulk import routes: read the request body as it's imported
+IMPORT_ROUTES = {
+    '/v1/potions/import': Potions,
+    '/v1/potions/types/import': PotionTypes,
+    '/v1/potions/potency/import': PotionPotency,
+    '/v1/inventory/import': PotionInventory
+}
 
 class PotionApplication(falcon.API):
-    def __init__(self, configuration):
+    def __init__(self, configuration, startup:StartupTimer = None):
         self.config = configuration
+        # time taken by each phase of the startup (see utils/startup.py)
+        self.startup = startup or StartupTimer()
+        # name -> function returning counters, reported at /v1/metrics
+        self.metrics = {'startup': self.startup.stats}
 
         # set up db connection & logging
         self._setup_db()
+        self.startup.lap('database')
 
         # setup logging - default is 'WARNING' if not set
         logger, self.logging_level = setup_logging(self.config, self.manager)
         logger.info('STARTUP: Logging configured successfully')
+        self.metrics['logging'] = logger.handlers[0].stats
+        self.startup.lap('logging')
 
         # configure middleware & initialize falcon.API object
         middleware = [
-            StreamHandler(),
-            LogHTTPErrors(),
+            DBSessionMiddleware(
+                self.manager,
+                route_timeouts=self.config.database.get('route_statement_timeouts_ms')
+            ),
+            StreamHandler(exempt_routes=list(IMPORT_ROUTES)),
+            LogHTTPErrors(sampler=self._log_sampler()),
             OAuth2Middleware(
                 self.config.authentication,
                 exempt_routes=[
                     '/swagger', '/static', '/static/v1', '/static/v1/swagger.yml'
                 ],
                 exempt_methods=['HEAD', 'OPTIONS', 'GET']
-            )
+            ),
+            ETagMiddleware()
         ]
 
+        # keep read-your-writes requests off the read replicas
+        if self.manager.replicas:
+            middleware.append(ReadRoutingMiddleware(
+                window_seconds=float(self.config.database.get('read_your_writes_seconds', 5))
+            ))
+
+        # replay responses to retried requests (disabled if not set in the config)
+        if self.config.idempotency.get('enabled'):
+            self.idempotency = self._idempotency_store()
+            middleware.append(IdempotencyMiddleware(
+                self.idempotency,
+                methods=self.config.idempotency.get('methods', ['POST'])
+            ))
+            self.metrics['idempotency'] = self.idempotency.stats
+
+        # cache GET responses (disabled if not set in the config)
+        if self.config.cache.get('enabled'):
+            self.cache = ResponseCache(
+                max_entries=int(self.config.cache.get('max_entries', 1024)),
+                ttl=float(self.config.cache.get('ttl', 30))
+            )
+            middleware.append(ResponseCacheMiddleware(self.cache))
+            self.metrics['response_cache'] = self.cache.stats
+
+        # coalesce stock adjustments in memory (disabled if not set in the config)
+        self.stock_adjuster = None
+        if self.config.write_behind.get('enabled'):
+            self.stock_adjuster = StockAdjuster(
+                self.manager,
+                interval_ms=int(self.config.write_behind.get('interval_ms') or 200),
+                max_deltas=int(self.config.write_behind.get('max_deltas') or 1000),
+                max_pending=int(self.config.write_behind.get('max_pending') or 0) or None
+            )
+            self.metrics['write_behind'] = self.stock_adjuster.stats
+
         super().__init__(middleware=middleware)
+        self.add_error_handler(OperationalError, self._handle_operational_error)
+        self.startup.lap('middleware')
 
         # set up Swagger UI
         self._register_swagger()
@@ -59,44 +140,152 @@ class PotionApplication(falcon.API):
         # ----------------------
         #    CRUD operations
         # ----------------------
+        resource_options = {
+            'engine': self.manager,
+            'pagination': self.config.pagination
+        }
+
         self.add_route('/v1/potions',
-            BasicResource(engine=self.manager, data_object=Potions))
+            BasicResource(data_object=Potions, **resource_options))
         self.add_route('/v1/potions/{obj_id:int}',
-            BasicResource(engine=self.manager, data_object=Potions),
+            BasicResource(data_object=Potions, **resource_options),
             suffix='id')
 
         self.add_route('/v1/potions/types',
-            BasicResource(engine=self.manager, data_object=PotionTypes))
+            BasicResource(data_object=PotionTypes, **resource_options))
         self.add_route('/v1/potions/types/{obj_id:int}',
-            BasicResource(engine=self.manager, data_object=PotionTypes),
+            BasicResource(data_object=PotionTypes, **resource_options),
             suffix='id')
 
         self.add_route('/v1/potions/potency',
-            BasicResource(engine=self.manager, data_object=PotionPotency))
+            BasicResource(data_object=PotionPotency, **resource_options))
         self.add_route('/v1/potions/potency/{obj_id:int}',
-            BasicResource(engine=self.manager, data_object=PotionPotency),
+            BasicResource(data_object=PotionPotency, **resource_options),
             suffix='id')
 
         self.add_route('/v1/inventory',
-            BasicResource(engine=self.manager, data_object=PotionInventory))
+            BasicResource(data_object=PotionInventory, **resource_options))
         self.add_route('/v1/inventory/{obj_id:int}',
-            BasicResource(engine=self.manager, data_object=PotionInventory),
+            BasicResource(data_object=PotionInventory, **resource_options),
             suffix='id')
 
+        # ----------------------
+        #    Bulk import
+        # ----------------------
+        for route, data_object in IMPORT_ROUTES.items():
+            self.add_route(route,
+                ImportResource(self.manager, data_object, self.config.imports))
+
         # ----------------------
         #    More operations
         # ----------------------
+        self.add_route('/v1/inventory/purchase',
+            PurchaseResource(engine=self.manager))
+        self.add_route('/v1/inventory/adjust',
+            StockAdjustmentResource(engine=self.manager, adjuster=self.stock_adjuster))
+
         self.add_route('/v1/potions/describe',
             PotionResource(engine=self.manager))
         self.add_route('/v1/potions/describe/{obj_id:int}',
             PotionResource(engine=self.manager),
             suffix='id')
 
+        self.add_route('/v1/metrics', MetricsResource(self.metrics))
+        self.startup.lap('routes')
+        print(f'Ready in {self.startup.report()}')
+
+    # ------------------------
+    #    Worker lifecycle
+    # ------------------------
+    # the application is created in the gunicorn master process, and
+    # each worker is forked from it (see __main__.py)
+    def before_fork(self):
+        '''
+        closes the DB connections of the master process before a worker
+        is forked from it. the worker discards (without closing) any it
+        still inherits, e.g. opened by the log writer in the meantime
+        '''
+        self.manager.dispose()
+
+    def start(self):
+        '''
+        prepares a newly forked worker: opens new DB connections and
+        compiles the most common queries before the first request
+        '''
+        start = time.perf_counter()
+        try:
+            self.manager.warm(int(self.config.database.get('pool_warm_connections') or 1))
+
+            page_size = int(self.config.pagination.get('default_page_size') or 100)
+            for data_object in (Potions, PotionTypes, PotionPotency, PotionInventory):
+                table = DBOperator(self.manager.session, data_object)
+                table.get_page_by({}, page_size)
+                try:
+                    table.get_by_id(0)
+                except ItemNotFound:
+                    pass # the query is compiled all the same
+        except Exception:
+            # the worker can still serve requests once the DB is back
+            get_logger().exception('STARTUP: Unable to warm up the worker')
+        finally:
+            self.manager.release()
+        self.startup.record('worker_warm_up', time.perf_counter() - start)
+
+    def stop(self):
+        ''' writes any pending changes & logs, and closes the DB connections of an exiting worker '''
+        if self.stock_adjuster is not None:
+            self.stock_adjuster.close()
+        flush_logs()
+        self.manager.dispose()
+
+    @staticmethod
+    def _handle_operational_error(req, resp, ex, params):
+        # queries canceled by the route's statement timeout
+        if is_statement_timeout(ex):
+            raise falcon.HTTPServiceUnavailable(title='Query Timeout',
+                description='The query took too long and was canceled')
+        raise ex
+
+    def _idempotency_store(self):
+        # shared by the workers in the database, unless set to 'memory'
+        # (per worker: retries answered by another worker would run again)
+        store = str(self.config.idempotency.get('store') or 'database').lower()
+        ttl = float(self.config.idempotency.get('ttl', 86400))
+        wait_timeout = float(self.config.idempotency.get('wait_timeout', 30))
+        if store == 'database':
+            return DatabaseIdempotencyStore(self.manager, ttl=ttl, wait_timeout=wait_timeout)
+        if store != 'memory':
+            raise InvalidConfiguration(f'[ERROR] Unsupported idempotency store: {store}. Must be database or memory')
+
+        workers = int(self.config.gunicorn.get('workers') or 1)
+        if workers > 1:
+            raise InvalidConfiguration(
+                f'[ERROR] The memory idempotency store is per worker, and can\'t be used with {workers} workers')
+        return IdempotencyStore(
+            max_entries=int(self.config.idempotency.get('max_entries', 10000)),
+            ttl=ttl,
+            wait_timeout=wait_timeout
+        )
+
+    def _log_sampler(self) -> LogSampler or None:
+        # failed requests to log (all of them if not set in the config)
+        sampling = self.config.logging.get('sampling')
+        if not sampling:
+            return None
+        sampler = LogSampler(
+            rates=sampling.get('rates'),
+            routes=sampling.get('routes'),
+            window_seconds=float(sampling.get('window_seconds') or 60)
+        )
+        self.metrics['log_sampling'] = sampler.stats
+        return sampler
+
     def _register_swagger(self):
         STATIC_PATH = Path(self.config.swagger.get('directory')).resolve()
         self.add_static_route('/static', str(STATIC_PATH))
-        register_swaggerui_app(
-            self, '/swagger', '/static/v1/swagger.yml',
+        # the UI is loaded on its first request (see resources/swagger.py)
+        SwaggerUI(
+            '/swagger', '/static/v1/swagger.yml',
             # To restrict which operations are allowed on
             # the Swagger UI, use the config setting.
             # Note: Any commands run in the Swagger UI will
@@ -104,10 +293,10 @@ class PotionApplication(falcon.API):
             # config={
             #     'supportedSubmitMethods': ['GET']
             # }
-        )
+        ).register(self)
 
     # use the db credentials in the config file to connect
-    # to the provided database. must be postgres.
+    # to the provided database: postgres, or sqlite (see database/flavors.py).
     #
     # sets the 'self.manager' attribute to the connected DatabaseManager
     # if any part fails, will end program with DatabaseConnectionError
@@ -126,10 +315,45 @@ class PotionApplication(falcon.API):
                 password=self.config.database['password']
             )
             self.connection_string = connection.connection_string
+            pool = self.config.database
+        elif db_flavor == 'sqlite':
+            connection = SqliteServer(path=self.config.database.get('path'))
+            self.connection_string = connection.connection_string
+            pool = connection.pool(self.config.database)
         else:
             raise DatabaseConnectionError(f'[ERROR] Unsupported DB Flavor: {db_flavor}')
 
-        self.manager = DatabaseManager(connection=self.connection_string)
-        self.manager.setup()
+        # default statement timeout of every query (0: none)
+        statement_timeout_ms = int(self.config.database.get('statement_timeout_ms') or 0)
+        self.manager = DatabaseManager(connection=self.connection_string, pool=pool,
+                                       statement_timeout_ms=statement_timeout_ms)
+        # the schema can be checked once, instead of by every server (see __main__.py)
+        self.manager.setup(check_schema=self.config.database.get('schema_check', True))
+        self.metrics['pool'] = self.manager.pool_monitor.stats
+        self.metrics['fork_guard'] = self.manager.fork_guard.stats
+        self.metrics['query_cache'] = query_cache.stats
+
+        # read replicas: each one may override the primary's settings
+        replicas = self.config.database.get('replicas') or []
+        if replicas and db_flavor != 'postgres':
+            raise DatabaseConnectionError(f'[ERROR] Read replicas are not supported by {db_flavor}')
+        if replicas:
+            connections = []
+            for replica in replicas:
+                replica = dict(self.config.database, **replica)
+                connections.append(PostgresServer(
+                    host=replica['server'],
+                    database_name=replica['database'],
+                    username=replica['username'],
+                    password=replica['password'],
+                    port=replica.get('port')
+                ).connection_string)
+            self.manager.replicas = ReplicaSet(
+                connections,
+                pool=self.config.database,
+                eject_seconds=float(self.config.database.get('replica_eject_seconds', 30)),
+                statement_timeout_ms=statement_timeout_ms
+            )
+            self.metrics['replicas'] = self.manager.replicas.stats
 
         print('DB Configured successfully')
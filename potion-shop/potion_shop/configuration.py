@@ -6,7 +6,12 @@ class PotionConfig(YamlConfig):
         'swagger' : Attr('swagger', dict),
         'database': Attr('database', dict),
         'authentication': Attr('authentication', dict),
-        'logging': Attr('logging', dict)
+        'logging': Attr('logging', dict),
+        'pagination': Attr('pagination', dict),
+        'cache': Attr('cache', dict),
+        'imports': Attr('imports', dict),
+        'write_behind': Attr('write_behind', dict),
+        'idempotency': Attr('idempotency', dict)
     }
 
     def __init__(self):
@@ -15,3 +20,8 @@ class PotionConfig(YamlConfig):
         self.database = {}
         self.authentication = {}
         self.logging = {}
+        self.pagination = {}
+        self.cache = {}
+        self.imports = {}
+        self.write_behind = {}
+        self.idempotency = {}
@@ -1,27 +1,11 @@
-from sqlalchemy import inspect
+from potion_shop.database.serializer import serializer_for
 
 class Base:
     '''
     This class is the base class for all of the data models.
-    It contains functions for saving, updating, removing, and
-    transforming into a dictionary from an ORM object.
+    It contains functions for removing, and transforming into
+    a dictionary from an ORM object.
     '''
-    def save(self, session):
-        '''
-        A method to save the ORM object to the database.
-        '''
-        session.add(self)
-        return self.to_dict()
-
-    def update(self, session, data_obj, to_update):
-        '''
-        A method to update the ORM object in the database.
-        '''
-        pk = inspect(data_obj).primary_key[0].name
-        session.query(data_obj).filter(
-            getattr(data_obj,pk)==self.to_dict()[pk]).update(to_update)
-        return self.to_dict()
-
     def remove(self, session):
         '''
         A method to delete the ORM object from the database.
@@ -33,5 +17,4 @@ class Base:
         '''
         A method to transform the ORM object to a dictionary.
         '''
-        return {c.key: getattr(self, c.key)
-                for c in inspect(self).mapper.column_attrs}
+        return serializer_for(type(self)).to_dict(self)
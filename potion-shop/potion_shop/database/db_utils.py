@@ -1,20 +1,38 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
-from potion_shop.database.models import DataModel
+from potion_shop.database.flavors import engine_options, in_memory, setup_connections
+from potion_shop.database.migrations import create_schema
+from potion_shop.database.pool import ForkGuard, PoolMonitor, pool_options
+from potion_shop.database.statement_timeout import StatementTimeout
 from potion_shop.utils.exceptions import DatabaseConnectionError
 
 class DatabaseManager:
-    def __init__(self, connection=None):
+    def __init__(self, connection=None, pool:dict = None, statement_timeout_ms:int = 0):
         self.connection = connection
+        # pool settings from the 'database' config (see database/pool.py)
+        self.pool_monitor = PoolMonitor()
         # create_engine will not recreate an existing table
-        self.engine = create_engine(self.connection)
+        self.engine = create_engine(self.connection, **pool_options(pool, self.pool_monitor),
+                                    **engine_options(self.connection))
+        setup_connections(self.engine)
+        self.pool_monitor.attach(self.engine)
+        # a forked worker doesn't use (or close) the master's connections. an
+        # in-memory (SQLite) database only exists in its one connection, which
+        # the worker keeps
+        self.fork_guard = ForkGuard()
+        if not in_memory(self.engine):
+            self.fork_guard.attach(self.engine)
+        # default timeout, unless the request sets one (see database/statement_timeout.py)
+        StatementTimeout(statement_timeout_ms).attach(self.engine)
         self.session = scoped_session(
             sessionmaker(
                 bind=self.engine,
                 autocommit=True
             )
         )
+        # read replicas for GET requests (see database/replicas.py)
+        self.replicas = None
 
     @property
     def session(self):
@@ -24,10 +42,68 @@ class DatabaseManager:
     def session(self, session):
         self._session = session
 
-    def setup(self):
+    def read(self, read, primary:bool = False, context=None):
+        '''
+        returns read(session), run on a read replica if any are set up.
+        with primary=True (ex: the client must see its own recent writes)
+        it's always run on this (primary) database
+
+        if a (request) context is given, context.read_replica is set to
+        whether the result was read from a replica, which may lag behind
+        the primary (see ETagMiddleware & ResponseCacheMiddleware)
+        '''
+        if primary or not self.replicas:
+            return read(self.session)
+
+        def read_on(session):
+            if context is not None:
+                context.read_replica = session is not self.session
+            return read(session)
+        return self.replicas.read(read_on, fallback=self.session)
+
+    def release(self):
+        '''
+        closes this thread's sessions (& the replicas' sessions), which
+        returns their connections to the pool and drops their identity maps
+        '''
+        self.session.remove()
+        if self.replicas:
+            self.replicas.release()
+
+    def dispose(self):
+        '''
+        closes every pooled connection (& the replicas'). the gunicorn
+        master calls this before forking a worker, so the worker doesn't
+        inherit the connections (see ForkGuard in database/pool.py)
+        '''
+        self.session.remove()
+        # an in-memory (SQLite) database only exists in its one
+        # connection, which the worker keeps
+        if not in_memory(self.engine):
+            self.engine.dispose()
+        if self.replicas:
+            self.replicas.dispose()
+
+    def warm(self, connections:int = 1):
+        ''' opens connections to the DB ahead of the first requests '''
+        opened = [self.engine.connect() for _ in range(connections)]
+        for connection in opened:
+            connection.close() # back into the pool, still open
+
+    def setup(self, check_schema:bool = True):
+        '''
+        creates the missing tables & indexes (see database/migrations.py).
+        with check_schema=False the schema is expected to be up to date,
+        and the DB isn't contacted until the first query
+        '''
+        if not check_schema:
+            print('Skipping the schema check')
+            return
         try:
             print('Connecting to DB...')
-            DataModel.metadata.create_all(self.engine, checkfirst=True)
+            new_indexes = create_schema(self.engine)
             print('Connected!')
+            for index in new_indexes:
+                print(f'Created index {index}')
         except Exception as e:
             raise DatabaseConnectionError(f'Could not connect to DB: {e}')
@@ -1,3 +1,7 @@
+from sqlalchemy import event
+
+from potion_shop.database.pool import SIZE_OPTIONS
+
 '''
 This is a class to store and create the appropriate connection string. It
 takes in the various parameters required by connection string.
@@ -27,3 +31,88 @@ class PostgresServer:
     def connection_string(self, connection_string):
         parsed = f'postgres+psycopg2://{connection_string}'
         self._connection_string = parsed
+
+'''
+The connection string & connection settings for a SQLite database,
+used to run the API without a PostgreSQL server (ex: for local load
+tests & benchmarks).
+
+Args:
+    path:           [optional] path of the database file. ':memory:'
+                    (the default) keeps the database in memory, for as
+                    long as the process runs
+
+File databases use write-ahead logging (WAL), so reads aren't blocked
+by writes. An in-memory database only exists on one connection, which
+every thread of the process shares (a serialized static pool, see
+database/pool.py): requests handled at the same time (gthread or gevent
+workers) take turns using it. Since each gunicorn worker is its own
+process, use a file with more than one worker.
+
+Foreign keys are enforced on every connection (SQLite doesn't by default).
+'''
+class SqliteServer:
+    MEMORY = ':memory:'
+
+    # run on every new connection
+    PRAGMAS = (
+        'PRAGMA foreign_keys = ON',
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL'
+    )
+
+    def __init__(self, path=MEMORY):
+        self.path = path or self.MEMORY
+        self.connection_string = self.path
+
+    @property
+    def connection_string(self):
+        return self._connection_string
+
+    @connection_string.setter
+    def connection_string(self, path):
+        self._connection_string = 'sqlite://' if path == self.MEMORY else f'sqlite:///{path}'
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path == self.MEMORY
+
+    def pool(self, database:dict) -> dict:
+        '''
+        the pool settings (see database/pool.py) for the 'database'
+        config: an in-memory database always uses a single (static)
+        connection, used by one thread at a time, which must never be
+        replaced (recycled), so the pool size & recycle settings don't
+        apply to it
+        '''
+        if not self.in_memory:
+            return database
+        ignored = set(SIZE_OPTIONS) | {'pool_recycle'}
+        pool = {key: value for key, value in database.items() if key not in ignored}
+        pool['pool_class'] = 'serialized'
+        return pool
+
+def engine_options(connection_string:str) -> dict:
+    ''' create_engine() arguments needed by the database of the connection string '''
+    if connection_string.startswith('sqlite'):
+        # connections are shared by threads (pooled, or the static pool)
+        return {'connect_args': {'check_same_thread': False}}
+    return {}
+
+def in_memory(engine) -> bool:
+    ''' True if the engine's (SQLite) database only exists in memory '''
+    return engine.dialect.name == 'sqlite' and engine.url.database in (None, '', SqliteServer.MEMORY)
+
+def setup_connections(engine):
+    ''' applies the flavor's settings to every new connection of the engine '''
+    if engine.dialect.name != 'sqlite':
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in SqliteServer.PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+    event.listen(engine, 'connect', on_connect)
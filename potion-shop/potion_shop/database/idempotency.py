@@ -0,0 +1,192 @@
+'''
+A store of the responses to requests sent with an Idempotency-Key header
+(see middleware/idempotency.py), kept in the 'idempotency_keys' table so
+every gunicorn worker (and every server using the same database) shares
+it. A retry answered by another worker still gets the stored response,
+instead of running the request again.
+
+Each key is claimed by the first request that uses it, by inserting its
+row (the key is the primary key, so only one insert can succeed). Until
+that request finishes, the row has no status ("in flight"): requests
+with the same key poll the row until the response is stored, and then
+get the stored response.
+
+Completed rows expire after a TTL. Claims of requests that don't finish
+within 'lease' seconds (ex: their worker died) expire too, so the key
+can be claimed again. Expired rows are deleted every PURGE_EVERY stored
+responses.
+
+The row also keeps a fingerprint of the request (ex: a hash of its
+body) so that a key can't be reused for a different request.
+'''
+import datetime
+import json
+import threading
+import time
+
+from sqlalchemy import Column, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import DATETIME, LargeBinary, VARCHAR
+
+from potion_shop.database.base import Base
+from potion_shop.utils.idempotency import IdempotencyConflict
+
+IdempotencyModel = declarative_base(cls=Base)
+
+# a row per Idempotency-Key: the claim of the request, then its response
+class IdempotencyKey(IdempotencyModel):
+    __tablename__ = 'idempotency_keys'
+    key = Column(VARCHAR, primary_key=True)     # client, method, route & Idempotency-Key
+    fingerprint = Column(VARCHAR, nullable=False)
+    status = Column(VARCHAR)                    # None while the request is in flight
+    content_type = Column(VARCHAR)
+    data = Column(LargeBinary)
+    expires_at = Column(DATETIME().with_variant(TIMESTAMP, 'postgresql'), nullable=False, index=True)
+
+# defaults
+CLAIM_LEASE_SECONDS = 300
+POLL_INTERVAL = 0.05
+PURGE_EVERY = 1000
+
+def _now() -> datetime.datetime:
+    # shared by servers in other time zones
+    return datetime.datetime.utcnow()
+
+class DatabaseIdempotencyStore:
+    def __init__(self, manager, ttl:float = 86400, wait_timeout:float = 30,
+                 lease:float = CLAIM_LEASE_SECONDS, poll_interval:float = POLL_INTERVAL):
+        self._db = manager
+        self._ttl = datetime.timedelta(seconds=ttl)
+        self._wait_timeout = wait_timeout
+        self._lease = datetime.timedelta(seconds=max(lease, wait_timeout))
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._finished = 0
+
+        self.replays = 0
+        self.waits = 0
+        self.purged = 0
+
+    @staticmethod
+    def _key(key) -> str:
+        # the middleware's keys are (subject, method, path, Idempotency-Key)
+        return json.dumps(list(key)) if isinstance(key, tuple) else str(key)
+
+    def _insert(self, connection, row:dict) -> bool:
+        table = IdempotencyKey.__table__
+        if connection.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).on_conflict_do_nothing()
+        else:
+            statement = table.insert().prefix_with('OR IGNORE')
+        return connection.execute(statement, row).rowcount == 1
+
+    def _try_claim(self, key:str, fingerprint:str):
+        '''
+        returns None if the key was claimed, otherwise the key's row
+        (or False if the row changed meanwhile, and the claim should be tried again)
+        '''
+        table = IdempotencyKey.__table__
+        now = _now()
+        claim = {'key': key, 'fingerprint': fingerprint, 'status': None,
+                 'content_type': None, 'data': None, 'expires_at': now + self._lease}
+        with self._db.engine.begin() as connection:
+            if self._insert(connection, claim):
+                return None
+            row = connection.execute(select([table]).where(table.c.key == key)).first()
+            if row is None:
+                return False # deleted (released or purged) meanwhile
+            if row.expires_at > now:
+                return row
+
+            # expired: take it over, unless another request just did
+            taken = connection.execute(
+                table.update() \
+                    .where(table.c.key == key) \
+                    .where(table.c.expires_at == row.expires_at) \
+                    .values(**claim)
+            ).rowcount
+            return None if taken else False
+
+    def claim(self, key, fingerprint) -> tuple or None:
+        '''
+        returns the stored (status, content_type, data) for the key, or
+        None if the key was claimed for this request (which must then call
+        finish() or release()). waits if a request with the key is in flight.
+
+        raises IdempotencyConflict if the key was used with a different
+        request, or if the request with the key is still in flight after
+        waiting wait_timeout seconds.
+        '''
+        key = self._key(key)
+        deadline = None
+        while True:
+            row = self._try_claim(key, fingerprint)
+            if row is None:
+                return None
+            if row is False:
+                continue
+
+            if row.fingerprint != fingerprint:
+                raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+
+            if row.status is not None:
+                with self._lock:
+                    self.replays += 1
+                return row.status, row.content_type, bytes(row.data or b'')
+
+            # in flight (maybe in another worker): poll until it's done
+            if deadline is None:
+                with self._lock:
+                    self.waits += 1
+                deadline = time.monotonic() + self._wait_timeout
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict('A request with this Idempotency-Key is still in progress')
+            time.sleep(self._poll_interval)
+
+    def finish(self, key, status:str, content_type:str, data:bytes):
+        ''' stores the response of the request that claimed the key '''
+        table = IdempotencyKey.__table__
+        with self._db.engine.begin() as connection:
+            connection.execute(
+                table.update() \
+                    .where(table.c.key == self._key(key)) \
+                    .where(table.c.status.is_(None)) \
+                    .values(status=status, content_type=content_type, data=data,
+                            expires_at=_now() + self._ttl)
+            )
+
+        with self._lock:
+            self._finished += 1
+            purge = self._finished % PURGE_EVERY == 0
+        if purge:
+            self.purge()
+
+    def release(self, key):
+        ''' forgets a claimed key (the request failed and may be retried) '''
+        table = IdempotencyKey.__table__
+        with self._db.engine.begin() as connection:
+            connection.execute(
+                table.delete() \
+                    .where(table.c.key == self._key(key)) \
+                    .where(table.c.status.is_(None))
+            )
+
+    def purge(self) -> int:
+        ''' deletes the expired rows. returns the number deleted '''
+        table = IdempotencyKey.__table__
+        with self._db.engine.begin() as connection:
+            purged = connection.execute(table.delete().where(table.c.expires_at <= _now())).rowcount
+        with self._lock:
+            self.purged += purged
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            'store': 'database',
+            'ttl': self._ttl.total_seconds(),
+            'replays': self.replays,
+            'waits': self.waits,
+            'purged': self.purged
+        }
@@ -0,0 +1,363 @@
+'''
+Bulk imports rows into a table from a CSV or NDJSON (one JSON object
+per line) stream, using PostgreSQL's COPY (or batched INSERTs on SQLite).
+
+The stream is read one line at a time and imported in batches of
+batch_size rows, so the request body is never held in memory. For
+each batch:
+    1. every row is parsed and checked against the table's columns
+       (types & required values). invalid rows are rejected.
+    2. the valid rows are loaded with COPY ... FROM STDIN into a
+       temporary staging table (one per table & DB connection).
+       in cooperative mode (see utils/cooperative.py) COPY isn't
+       available, and a multi-row INSERT is used instead. on SQLite
+       the rows are staged with an executemany INSERT
+    3. staged rows whose foreign keys don't exist, or whose unique
+       values are already in the table, are rejected
+    4. the remaining rows are copied from the staging table into
+       the table with a single INSERT ... SELECT (ON CONFLICT DO
+       NOTHING on PostgreSQL, OR IGNORE on SQLite)
+
+Each batch is committed on its own, so rows from earlier batches stay
+imported if a later batch fails. Rejected rows are reported by their
+line number in the stream (the first max_errors of them).
+'''
+import csv
+import io
+import json
+
+from sqlalchemy import BIGINT, Column, MetaData, Table
+from sqlalchemy import and_, case, exists, literal, not_, or_, select, true
+from sqlalchemy.dialects import postgresql
+
+from potion_shop.database.logging.manager import get_logger
+from potion_shop.database.operators import VALID_TYPES
+from potion_shop.utils.cooperative import is_patched
+from potion_shop.database.serializer import python_type
+from potion_shop.database.versions import table_versions
+from potion_shop.utils.exceptions import ContentFormatException
+from potion_shop.utils.exceptions import InvalidDatabaseOperation
+
+# number of rows loaded & committed at a time
+IMPORT_BATCH_SIZE = 10000
+# max number of rejected rows listed in the import summary
+MAX_REPORTED_ERRORS = 100
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+# CSV values accepted for BOOLEAN columns
+_TRUE = {'true', 't', 'yes', 'y', '1'}
+_FALSE = {'false', 'f', 'no', 'n', '0'}
+
+class RejectedRow(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+def _parse_bool(value:str) -> bool:
+    value = value.strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+# converts a (non-empty) CSV value to the column's python type
+_CSV_PARSERS = {
+    int: int,
+    float: float,
+    bool: _parse_bool,
+    str: str
+}
+
+class TableImporter:
+    def __init__(self, engine, data_object, batch_size:int = IMPORT_BATCH_SIZE,
+                 max_errors:int = MAX_REPORTED_ERRORS):
+        self._engine = engine
+        self._table = data_object.__table__
+        self._batch_size = batch_size
+        self._max_errors = max_errors
+        self._logger = get_logger()
+
+        # ids are generated by the table, so they can't be imported
+        self._columns = [col for col in self._table.columns if not col.primary_key]
+        self._types = {col.key: python_type(col.type) for col in self._columns}
+
+        # the staging table has the same columns (without constraints)
+        # plus the line number of each row in the stream
+        self._staging = Table(
+            f'import_{self._table.name}', MetaData(),
+            Column('import_line', BIGINT),
+            *[Column(col.key, col.type) for col in self._columns]
+        )
+
+    # --------------------
+    #    parsing
+    # --------------------
+    def _check_required(self, row:dict):
+        for column in self._columns:
+            if row.get(column.key) is None and not column.nullable:
+                raise RejectedRow(f'{column.key} is required')
+
+    def _csv_rows(self, lines):
+        reader = csv.reader(lines)
+        try:
+            header = [key.strip().lower() for key in next(reader)]
+        except StopIteration:
+            return
+
+        unknown = set(header) - set(self._types)
+        if unknown or len(set(header)) != len(header):
+            raise ContentFormatException(f'Invalid CSV header. Unsupported or repeated columns: {unknown or header}')
+
+        for values in reader:
+            line = reader.line_num
+            if not values:
+                continue # blank line
+            try:
+                if len(values) != len(header):
+                    raise RejectedRow(f'Expected {len(header)} values, got {len(values)}')
+
+                row = {}
+                for key, value in zip(header, values):
+                    # empty values are NULL
+                    if value == '':
+                        row[key] = None
+                        continue
+                    try:
+                        row[key] = _CSV_PARSERS[self._types[key]](value)
+                    except ValueError:
+                        raise RejectedRow(f'{key} must be of type {self._types[key].__name__}')
+
+                self._check_required(row)
+                yield line, row, None
+            except RejectedRow as rejected:
+                yield line, None, rejected.message
+
+    def _ndjson_rows(self, lines):
+        for line, text in enumerate(lines, start=1):
+            if not text.strip():
+                continue # blank line
+            try:
+                try:
+                    row = json.loads(text)
+                except json.JSONDecodeError:
+                    raise RejectedRow('Invalid JSON')
+                if not isinstance(row, dict):
+                    raise RejectedRow('Row must be a JSON object')
+
+                unknown = set(row) - set(self._types)
+                if unknown:
+                    raise RejectedRow(f'Unsupported columns: {unknown}')
+
+                for key, value in row.items():
+                    valid_types = VALID_TYPES.get(self._types[key])
+                    if value is not None and valid_types and type(value) not in valid_types:
+                        raise RejectedRow(f'{key} must be of type {self._types[key].__name__}')
+
+                self._check_required(row)
+                yield line, row, None
+            except RejectedRow as rejected:
+                yield line, None, rejected.message
+
+    # --------------------
+    #    loading
+    # --------------------
+    @property
+    def _postgres(self) -> bool:
+        return self._engine.dialect.name == 'postgresql'
+
+    def _create_staging(self, connection):
+        # rows are removed from the staging table when each batch commits
+        # (see _clear_staging) and the table is dropped when the DB
+        # connection is closed
+        table = self._engine.dialect.identifier_preparer.format_table(self._table)
+        staging = self._engine.dialect.identifier_preparer.format_table(self._staging)
+        columns = ', '.join(f'"{col.key}"' for col in self._columns)
+        if self._postgres:
+            connection.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS AS '
+                f'SELECT NULL::BIGINT AS import_line, {columns} FROM {table} WITH NO DATA'
+            )
+        else:
+            connection.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} AS '
+                f'SELECT NULL AS import_line, {columns} FROM {table} WHERE 1 = 0'
+            )
+
+    def _clear_staging(self, connection):
+        # (postgres) ON COMMIT DELETE ROWS
+        if not self._postgres:
+            connection.execute(self._staging.delete())
+
+    def _copy(self, connection, rows:list):
+        if not self._postgres:
+            # no COPY: one prepared INSERT, executed for every row
+            connection.execute(self._staging.insert(), [
+                dict({col.key: row.get(col.key) for col in self._columns}, import_line=line)
+                for line, row in rows
+            ])
+            return
+
+        if is_patched():
+            # cooperative (gevent) psycopg2 connections can't COPY,
+            # so the batch is staged with one multi-row INSERT instead
+            connection.execute(self._staging.insert().values([
+                dict({col.key: row.get(col.key) for col in self._columns}, import_line=line)
+                for line, row in rows
+            ]))
+            return
+
+        # the rows are already parsed & checked, so they're written as
+        # CSV that COPY can't fail to read. strings are always quoted
+        # and NULLs never are, so '' and NULL stay apart.
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for line, row in rows:
+            writer.writerow([line] + [row.get(col.key) for col in self._columns])
+        buffer.seek(0)
+
+        columns = ', '.join(f'"{col.name}"' for col in self._staging.columns)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY "{self._staging.name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+
+    def _checks(self) -> list:
+        '''
+        (condition, error message) for each check a staged row must pass
+        before it's inserted into the table
+        '''
+        staged = self._staging.c
+        checks = []
+        for column in self._columns:
+            for fk in column.foreign_keys:
+                checks.append((
+                    or_(staged[column.key].is_(None),
+                        exists().where(fk.column == staged[column.key])),
+                    f'{column.key} does not exist in {fk.column.table.name}'
+                ))
+            if column.unique:
+                checks.append((
+                    or_(staged[column.key].is_(None),
+                        not_(exists().where(column == staged[column.key]))),
+                    f'{column.key} already exists'
+                ))
+                # only the first row of the batch with the value is inserted
+                earlier = self._staging.alias('earlier')
+                checks.append((
+                    or_(staged[column.key].is_(None),
+                        not_(exists().where(and_(
+                            earlier.c[column.key] == staged[column.key],
+                            earlier.c.import_line < staged.import_line)))),
+                    f'{column.key} is repeated in the import'
+                ))
+        return checks
+
+    def _load_batch(self, connection, rows:list) -> (int, list, int):
+        '''
+        stages the rows & inserts every row that passes the checks in
+        one transaction. returns the number of rows inserted, the
+        (line, error) of the staged rows that were rejected, and the
+        number of rows skipped because of a conflict while inserting
+        '''
+        checks = self._checks()
+        valid = and_(*[condition for condition, _ in checks]) if checks else true()
+        staged = self._staging.c
+
+        with connection.begin():
+            self._create_staging(connection)
+            self._copy(connection, rows)
+
+            rejected = []
+            if checks:
+                error = case([(not_(condition), literal(message)) for condition, message in checks])
+                rejected = connection.execute(
+                    select([staged.import_line, error]) \
+                        .where(not_(valid)) \
+                        .order_by(staged.import_line)
+                ).fetchall()
+
+            columns = [col.key for col in self._columns]
+            if self._postgres:
+                statement = postgresql.insert(self._table).on_conflict_do_nothing()
+            else:
+                statement = self._table.insert().prefix_with('OR IGNORE')
+            result = connection.execute(
+                statement.from_select(columns,
+                    select([staged[key] for key in columns]) \
+                        .where(valid) \
+                        .order_by(staged.import_line))
+            )
+            self._clear_staging(connection)
+
+        # rows that passed the checks but were still not inserted
+        # (ex: another request inserted the same unique value first)
+        conflicts = len(rows) - len(rejected) - result.rowcount
+        return result.rowcount, [tuple(row) for row in rejected], conflicts
+
+    # --------------------
+    #    import
+    # --------------------
+    def run(self, lines, data_format:str) -> dict:
+        '''
+        imports the rows in lines (an iterable of text lines, in
+        data_format: CSV or NDJSON). returns a summary of the import:
+            {'rows', 'inserted', 'rejected', 'batches': [...], 'errors': [...]}
+        '''
+        parsed = self._csv_rows(lines) if data_format == CSV else self._ndjson_rows(lines)
+
+        summary = {'rows': 0, 'inserted': 0, 'rejected': 0, 'batches': [], 'errors': []}
+        batch, batch_rejected = [], []
+
+        def reject(line, message):
+            summary['rejected'] += 1
+            if len(summary['errors']) < self._max_errors:
+                summary['errors'].append({'line': line, 'error': message})
+
+        def load():
+            inserted, rejected, conflicts = 0, [], 0
+            if batch:
+                try:
+                    inserted, rejected, conflicts = self._load_batch(connection, batch)
+                except Exception as e:
+                    raise InvalidDatabaseOperation(
+                        f'Error occurred while importing batch {len(summary["batches"]) + 1}. '
+                        f'{summary["inserted"]} rows were imported before the error.') from e
+
+            for line, message in sorted(batch_rejected + rejected):
+                reject(line, message)
+            for _ in range(conflicts):
+                reject(None, 'Conflicts with an existing row')
+
+            stats = {
+                'batch': len(summary['batches']) + 1,
+                'rows': len(batch) + len(batch_rejected),
+                'inserted': inserted,
+                'rejected': len(batch_rejected) + len(rejected) + conflicts
+            }
+            summary['rows'] += stats['rows']
+            summary['inserted'] += inserted
+            summary['batches'].append(stats)
+            if inserted:
+                table_versions.bump(self._table.name)
+
+            self._logger.info(f'IMPORT: {self._table.name} batch {stats["batch"]}: '
+                              f'{stats["inserted"]} of {stats["rows"]} rows inserted')
+            batch.clear()
+            batch_rejected.clear()
+
+        with self._engine.connect() as connection:
+            for line, row, error in parsed:
+                if error:
+                    batch_rejected.append((line, error))
+                else:
+                    batch.append((line, row))
+                if len(batch) + len(batch_rejected) >= self._batch_size:
+                    load()
+            if batch or batch_rejected:
+                load()
+
+        return summary
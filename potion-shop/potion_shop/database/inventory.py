@@ -0,0 +1,194 @@
+'''
+Operations on the PotionInventory table that need more than the
+generic DBOperator functions.
+
+Purchases decrement each item's amount with a conditional
+    UPDATE potion_inventory SET amount = amount - :qty
+    WHERE id = :id AND amount >= :qty
+so the stock check and the decrement are a single atomic statement.
+Concurrent purchases of the same item only wait for that item's row
+lock (held until their transaction commits), and then re-check the
+amount against the updated row, so no purchase can oversell or lose
+another's update. Items of an order are updated in order of their
+ids, so two orders with the same items can't deadlock.
+
+Stock adjustments (restocks, corrections) add a delta to the amount of
+many items at once, with a single UPDATE ... FROM (VALUES ...). They
+don't check the stock, so the amount can go below 0.
+'''
+from sqlalchemy import bindparam, select, text
+
+from potion_shop.database.models import PotionInventory
+from potion_shop.database.operators import DBOperator, RETURNING_DIALECTS, UPDATE_BATCH_SIZE
+from potion_shop.utils.exceptions import ContentFormatException
+from potion_shop.utils.exceptions import InvalidDatabaseOperation
+from potion_shop.utils.exceptions import ItemNotFound
+from potion_shop.utils.exceptions import OutOfStock
+
+# ranges of the id (BIGINT) & amount (INTEGER) columns
+ID_RANGE = (-2**63, 2**63 - 1)
+AMOUNT_RANGE = (-2**31, 2**31 - 1)
+
+def _in_range(value:int, value_range:tuple) -> bool:
+    return value_range[0] <= value <= value_range[1]
+
+class InventoryOperator(DBOperator):
+    def __init__(self, session):
+        super().__init__(session, PotionInventory)
+
+    def _get_quantities(self, order:list) -> dict:
+        '''
+        checks an order (a list of {'id': inventory id, 'quantity': n})
+        and returns {inventory id: total quantity} sorted by id
+        '''
+        if not isinstance(order, list) or not order:
+            raise ContentFormatException('Order must be a list of items to purchase')
+
+        quantities = {}
+        for i, line in enumerate(order):
+            if not isinstance(line, dict) or set(line) != {'id', 'quantity'}:
+                raise ContentFormatException(f"Item {i}: must be in the format {{'id': ..., 'quantity': ...}}")
+            if type(line['id']) != int:
+                raise ContentFormatException(f'Item {i}: id must be of type int')
+            if type(line['quantity']) != int or line['quantity'] < 1:
+                raise ContentFormatException(f'Item {i}: quantity must be a positive int')
+            # the same item may be listed more than once
+            quantities[line['id']] = quantities.get(line['id'], 0) + line['quantity']
+
+        return dict(sorted(quantities.items()))
+
+    def _check_failed(self, id:int, quantity:int):
+        # the conditional update didn't match: find out why
+        amount = self._session.execute(
+            select([PotionInventory.amount]).where(PotionInventory.id == id)
+        ).scalar()
+        if amount is None:
+            raise ItemNotFound(message=f'Unable to find inventory item: {id}')
+        raise OutOfStock(f'Out of stock: inventory item {id} has {amount} left, {quantity} requested')
+
+    def purchase(self, order:list) -> [dict]:
+        '''
+        removes the quantity of every item of the order from the inventory
+        in one transaction. if any item doesn't exist (ItemNotFound) or
+        doesn't have enough left (OutOfStock), nothing is purchased.
+        returns the updated inventory rows (in order of their ids)
+        '''
+        quantities = self._get_quantities(order)
+
+        table = PotionInventory.__table__
+        statement = table.update() \
+                        .where(table.c.id == bindparam('_id')) \
+                        .where(table.c.amount >= bindparam('quantity')) \
+                        .values(amount=table.c.amount - bindparam('quantity'))
+        returning = self._session.get_bind().dialect.name in RETURNING_DIALECTS
+        if returning:
+            statement = statement.returning(*table.columns)
+
+        purchased = []
+        try:
+            with self._session.begin():
+                for id, quantity in quantities.items():
+                    result = self._session.execute(statement, {'_id': id, 'quantity': quantity})
+                    if returning:
+                        row = result.first()
+                    else:
+                        row = self._session.execute(
+                            select(list(table.columns)).where(table.c.id == id)
+                        ).first() if result.rowcount else None
+
+                    if row is None:
+                        self._check_failed(id, quantity)
+                    purchased.append(dict(row))
+        except (ItemNotFound, OutOfStock):
+            raise
+        except Exception:
+            raise InvalidDatabaseOperation('Error occurred while updating database')
+
+        self._changed()
+        return purchased
+
+    def get_deltas(self, adjustments:list) -> dict:
+        '''
+        checks a list of stock adjustments ({'id': inventory id, 'delta': n})
+        and returns {inventory id: total delta}
+        '''
+        if not isinstance(adjustments, list) or not adjustments:
+            raise ContentFormatException('Content must be a list of stock adjustments')
+
+        deltas = {}
+        for i, adjustment in enumerate(adjustments):
+            if not isinstance(adjustment, dict) or set(adjustment) != {'id', 'delta'}:
+                raise ContentFormatException(f"Item {i}: must be in the format {{'id': ..., 'delta': ...}}")
+            if type(adjustment['id']) != int or not _in_range(adjustment['id'], ID_RANGE):
+                raise ContentFormatException(f'Item {i}: id must be a 64-bit int')
+            if type(adjustment['delta']) != int:
+                raise ContentFormatException(f'Item {i}: delta must be of type int')
+            # the total of an item must fit in its amount (an INTEGER), or it
+            # fails the whole UPDATE (ex: a write-behind flush of every item)
+            total = deltas.get(adjustment['id'], 0) + adjustment['delta']
+            if not _in_range(total, AMOUNT_RANGE):
+                raise ContentFormatException(f'Item {i}: delta must be between {AMOUNT_RANGE[0]} and {AMOUNT_RANGE[1]}')
+            deltas[adjustment['id']] = total
+        return deltas
+
+    def _adjust_values(self, deltas:list) -> list:
+        # UPDATE ... FROM (VALUES (id, delta), ...) ... RETURNING id
+        # the join doesn't lock the rows in any particular order, so they
+        # are locked in order of their ids first (to avoid deadlocks with
+        # other adjustments & purchases)
+        table = PotionInventory.__table__
+        self._session.execute(
+            select([table.c.id]) \
+                .where(table.c.id.in_([id for id, _ in deltas])) \
+                .order_by(table.c.id) \
+                .with_for_update()
+        ).fetchall()
+
+        params = {}
+        values = []
+        for i, (id, delta) in enumerate(deltas):
+            params[f'id{i}'], params[f'delta{i}'] = id, delta
+            values.append(f'(:id{i}, :delta{i})')
+
+        return [row[0] for row in self._session.execute(text(
+            'UPDATE potion_inventory '
+            'SET amount = potion_inventory.amount + CAST(v.delta AS INTEGER) '
+            f'FROM (VALUES {", ".join(values)}) AS v (id, delta) '
+            'WHERE potion_inventory.id = CAST(v.id AS BIGINT) '
+            'RETURNING potion_inventory.id'
+        ), params)]
+
+    def _adjust_rows(self, deltas:list) -> list:
+        # no UPDATE ... FROM & RETURNING support: update one row at a time
+        table = PotionInventory.__table__
+        statement = table.update() \
+                        .where(table.c.id == bindparam('_id')) \
+                        .values(amount=table.c.amount + bindparam('delta'))
+        return [id for id, delta in deltas
+                if self._session.execute(statement, {'_id': id, 'delta': delta}).rowcount]
+
+    def adjust(self, deltas:dict) -> list:
+        '''
+        adds each delta ({inventory id: delta}) to the item's amount in one
+        transaction (in order of the ids, UPDATE_BATCH_SIZE items per
+        statement). returns the ids of the items that were updated
+        '''
+        deltas = sorted((id, delta) for id, delta in deltas.items() if delta)
+        if not deltas:
+            return []
+
+        adjust_rows = self._adjust_values \
+                        if self._session.get_bind().dialect.name in RETURNING_DIALECTS \
+                        else self._adjust_rows
+        updated = []
+        try:
+            with self._session.begin():
+                for start in range(0, len(deltas), UPDATE_BATCH_SIZE):
+                    updated.extend(adjust_rows(deltas[start:start + UPDATE_BATCH_SIZE]))
+        except Exception as e:
+            # the cause tells a bad delta apart from an unavailable DB (see StockAdjuster.flush)
+            raise InvalidDatabaseOperation('Error occurred while updating database') from e
+
+        if updated:
+            self._changed()
+        return updated
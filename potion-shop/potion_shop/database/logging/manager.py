@@ -1,17 +1,34 @@
+import atexit
+import datetime
 import logging
+import os
+import queue
+import threading
+import time
 import traceback
 
-from potion_shop.database.logging.models import Log, LoggingModel
-from potion_shop.utils.exceptions import DatabaseConnectionError
+from potion_shop.database.flavors import in_memory
+from potion_shop.database.logging.models import Log
+
+# defaults if not set in the 'logging' config
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL_MS = 200
 
 def get_logger():
     return logging.getLogger('potion_shop_logger')
 
-# sets up logging with postgres & standard stderr log,
+def flush_logs():
+    ''' writes the logs queued by this process (see SQLAlchemyHandler) '''
+    for handler in get_logger().handlers:
+        handler.flush()
+
+# sets up logging with the database & standard stderr log,
 # returns logging level (config.logging['level'] or 'WARNING' (default))
 #
-# Must call AFTER db_manager's .setup() method run (db session established)
-# logs should be stored in postgres (using JSON value type)
+# Must call AFTER db_manager's .setup() method run (which creates the
+# logging table, see database/migrations.py)
+# logs are stored in the 'runtime_logs' table (see models.py)
 def setup_logging(config, db_manager) -> (logging.Logger, str):
     # set up the logging DB table
     # default logging level is WARNING
@@ -22,49 +39,174 @@ def setup_logging(config, db_manager) -> (logging.Logger, str):
 
     # sanity check to clear existing loggers
     if (logger.hasHandlers()): # pragma: no cover
+        for handler in logger.handlers:
+            handler.close()
         logger.handlers.clear()
 
     logger.setLevel(logging_level)
-    logger.addHandler(SQLAlchemyHandler(db_manager))
+    logger.addHandler(SQLAlchemyHandler(
+        db_manager,
+        queue_size=int(config.logging.get('queue_size') or QUEUE_SIZE),
+        batch_size=int(config.logging.get('batch_size') or BATCH_SIZE),
+        interval_ms=int(config.logging.get('interval_ms') or FLUSH_INTERVAL_MS)
+    ))
 
     return logger, logging_level
 
+'''
+A logging handler that stores each LogRecord as a row of the
+'runtime_logs' table, without making the request that logged it wait
+for the database.
+
+emit() only turns the record into a row and adds it to a bounded queue.
+A background thread writes the queued rows every 'interval_ms', or as
+soon as 'batch_size' rows are queued, with one INSERT per batch. When
+the queue is full (ex: an error storm while the DB is slow), new records
+are dropped and counted instead of piling up in memory.
+
+Queued rows are written when the worker shuts down (flush() is called
+by PotionApplication.stop, and close() at exit). A batch that fails to
+be written is dropped, and counted as failed.
+
+An in-memory (SQLite) database has a single connection, shared with the
+requests, so its rows are written by emit() instead of a thread (the
+pool makes the write wait while a request uses the connection).
+'''
 class SQLAlchemyHandler(logging.Handler):
-    # A very basic logger that commits a LogRecord to a SQL DB
-    def __init__(self, manager):
+    def __init__(self, manager, queue_size:int = QUEUE_SIZE, batch_size:int = BATCH_SIZE,
+                 interval_ms:int = FLUSH_INTERVAL_MS):
         super().__init__()
         self._db = manager
-        try:
-            LoggingModel.metadata.create_all(self._db.engine, checkfirst=True)
-            print('Initialized Logging Table')
-        except Exception as e: # pragma: no cover
-            # should never get here since intiializing logging happens
-            # AFTER initializing the DB to create all other tables
-            raise DatabaseConnectionError(message=f'Could not initialize Logging Table: {e}')
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._interval = interval_ms / 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._background = not in_memory(manager.engine)
+        # only one batch is written at a time
+        self._write_lock = threading.Lock()
 
-    def emit(self, record):
+        # the writer thread is started by the first record, since
+        # threads don't survive the fork into the gunicorn workers
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_ms = 0
+
+    def _start(self):
+        with self.lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # forked: the parent process writes the rows it queued
+                self._queue = queue.Queue(maxsize=self._queue_size)
+                self._write_lock = threading.Lock()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self.flush()
+
+    def _row(self, record) -> dict:
         trace = traceback.format_exc() if record.__dict__.get('exc_info') else None
 
         # any key not in record.__dict__ will return None
-        log = Log(
-            level = record.__dict__.get('levelname'),
-            trace = trace,
-            msg = record.__dict__.get('msg'),
-            request_route = record.__dict__.get('request_route'),
-            request_headers = record.__dict__.get('request_headers'),
-            request_body = record.__dict__.get('request_body'),
-            response_status = record.__dict__.get('response_status'),
-            response_body = record.__dict__.get('response_body')
-        )
-
-        # comment this to stop printing every time a log is saved to the DB
-        print(log)
+        return {
+            'created_at': datetime.datetime.fromtimestamp(record.created),
+            'level': record.__dict__.get('levelname'),
+            'trace': trace,
+            'msg': record.__dict__.get('msg'),
+            'request_route': record.__dict__.get('request_route'),
+            'request_headers': record.__dict__.get('request_headers'),
+            'request_body': record.__dict__.get('request_body'),
+            'response_status': record.__dict__.get('response_status'),
+            'response_body': record.__dict__.get('response_body')
+        }
+
+    def emit(self, record):
+        if self._closed:
+            self.dropped += 1
+            return
+        if not self._background:
+            self.queued += 1
+            with self._write_lock:
+                self._write([self._row(record)])
+            return
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
 
         try:
-            session = self._db.session
-            with session.begin():
-                log.save(session)
-            session.refresh(log)
-        except Exception as e: # pragma: no cover
-            # this should never happen (hopefully)
-            print(f'Error saving log: {e}')
+            self._queue.put_nowait(self._row(record))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.queued += 1
+        if self._queue.qsize() >= self._batch_size:
+            self._wake.set()
+
+    def _write(self, rows:list):
+        table = Log.__table__
+        start = time.perf_counter()
+        try:
+            with self._db.engine.begin() as connection:
+                if connection.dialect.name == 'postgresql':
+                    # one multi-row INSERT
+                    connection.execute(table.insert().values(rows))
+                else:
+                    connection.execute(table.insert(), rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print(f'Error saving {len(rows)} logs: {e}')
+            return
+        self.batches += 1
+        self.written += len(rows)
+        self.last_batch_ms = round((time.perf_counter() - start) * 1000, 3)
+
+    def flush(self):
+        ''' writes every queued row, batch_size rows per INSERT '''
+        with self._write_lock:
+            while True:
+                rows = []
+                try:
+                    while len(rows) < self._batch_size:
+                        rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if not rows:
+                    return
+                self._write(rows)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'pending': self._queue.qsize(),
+            'queue_size': self._queue_size,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_batch_ms': self.last_batch_ms
+        }
+
+    def close(self):
+        ''' stops the writer thread and writes the queued rows '''
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive() \
+                and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        # (the handler & its DB manager can then be garbage collected)
+        atexit.unregister(self.close)
+        super().close()
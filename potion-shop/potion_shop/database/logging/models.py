@@ -1,8 +1,8 @@
 import datetime
 
 from sqlalchemy import Column
-from sqlalchemy.types import DATETIME, BIGINT, VARCHAR, INTEGER
-from sqlalchemy.dialects.postgresql import JSON, TIMESTAMP
+from sqlalchemy.types import DATETIME, BIGINT, VARCHAR, INTEGER, JSON
+from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.ext.declarative import declarative_base
 
 from potion_shop.database.base import Base
@@ -10,8 +10,8 @@ from potion_shop.database.base import Base
 LoggingModel = declarative_base(cls=Base)
 
 # a table for capturing runtime logs
-# since it uses the postgres JSON type, must be connected to a
-# PostgreSQL database or else will raise type errors
+# the JSON columns are stored as JSON on PostgreSQL & as (JSON) text
+# on SQLite
 class Log(LoggingModel):
     __tablename__ = 'runtime_logs'
     log_id = Column(BIGINT().with_variant(INTEGER, 'sqlite'), primary_key=True)
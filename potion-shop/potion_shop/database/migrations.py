@@ -0,0 +1,62 @@
+'''
+Creates the tables of the models, and applies schema changes to existing
+databases.
+
+create_all only creates the tables that don't exist yet, with their
+indexes. Indexes added to the models later (ex: on
+the foreign keys, or the lower() search indexes in models.py) would never
+reach a database created before them, so every index of the models is
+created here if it's missing.
+
+Each step is idempotent (CREATE INDEX IF NOT EXISTS), so by default it
+runs on every start (see DatabaseManager.setup). Since that costs a few
+round trips to the database, deployments that start many servers can
+run it once instead (python -m potion_shop --migrate) and start the
+servers with --no-schema-check.
+
+Creating an index on a large existing table blocks writes to it until
+the index is built, which only happens on the first start after the
+upgrade.
+'''
+from sqlalchemy.schema import CreateIndex
+
+from potion_shop.database.idempotency import IdempotencyModel
+from potion_shop.database.logging.models import LoggingModel
+from potion_shop.database.models import DataModel
+
+# the names of the indexes in the database, per dialect
+INDEX_NAMES = {
+    'postgresql': 'SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()',
+    'sqlite': "SELECT name FROM sqlite_master WHERE type = 'index'"
+}
+
+def _index_names(connection) -> set:
+    query = INDEX_NAMES.get(connection.dialect.name)
+    if query is None:
+        return set() # every index is created IF NOT EXISTS
+    return {row[0] for row in connection.execute(query)}
+
+def _create_index_if_missing(connection, index):
+    ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+    connection.execute(ddl.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+
+def migrate(engine, metadata=DataModel.metadata) -> list:
+    ''' creates the missing indexes of the tables in metadata. returns their names '''
+    created = []
+    with engine.connect() as connection:
+        existing = _index_names(connection)
+        for table in metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name in existing:
+                    continue
+                with connection.begin():
+                    _create_index_if_missing(connection, index)
+                created.append(index.name)
+    return created
+
+def create_schema(engine) -> list:
+    ''' creates the missing tables (& logging & idempotency tables) and indexes. returns the names of the new indexes '''
+    DataModel.metadata.create_all(engine, checkfirst=True)
+    LoggingModel.metadata.create_all(engine, checkfirst=True)
+    IdempotencyModel.metadata.create_all(engine, checkfirst=True)
+    return migrate(engine)
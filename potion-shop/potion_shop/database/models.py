@@ -1,5 +1,8 @@
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import column as column_clause
+from sqlalchemy import func
 from sqlalchemy import BIGINT
 from sqlalchemy import BOOLEAN
 from sqlalchemy import FLOAT
@@ -11,6 +14,13 @@ from potion_shop.database.base import Base
 
 DataModel = declarative_base(cls=Base)
 
+# an index for case-insensitive prefix searches of a VARCHAR column
+# (lower(column) LIKE 'value%', see DBOperator._search_criterion).
+# text_pattern_ops lets PostgreSQL use it for LIKE whatever the collation
+def search_index(table:str, column:str) -> Index:
+    return Index(f'ix_{table}_{column}_lower', func.lower(column_clause(column)).label(column),
+                 postgresql_ops={column: 'text_pattern_ops'})
+
 '''
 Potions:
 Table describing different types of potions
@@ -25,9 +35,9 @@ class Potions(DataModel):
     id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
                 primary_key=True)
     potency_id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
-                ForeignKey('potion_potency.id'))
+                ForeignKey('potion_potency.id'), index=True)
     type_id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
-                ForeignKey('potion_types.id'))
+                ForeignKey('potion_types.id'), index=True)
 
     def __init__(self, potency_id, type_id):
         self.id = None
@@ -48,6 +58,7 @@ Health Potion + Potency(restores=0.5, prefix='High') --> Health High Potion (res
 '''
 class PotionPotency(DataModel):
     __tablename__ = 'potion_potency'
+    __table_args__ = (search_index('potion_potency', 'prefix'),)
     id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
                 primary_key=True)
     restores = Column(FLOAT, unique=True, nullable=False)
@@ -69,6 +80,10 @@ Fields:
 '''
 class PotionTypes(DataModel):
     __tablename__ = 'potion_types'
+    __table_args__ = (
+        search_index('potion_types', 'related_stat'),
+        search_index('potion_types', 'color')
+    )
     id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
             primary_key=True)
     related_stat = Column(VARCHAR, nullable=False)
@@ -95,7 +110,7 @@ class PotionInventory(DataModel):
     id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
                 primary_key=True)
     potion_id = Column(BIGINT().with_variant(INTEGER, 'sqlite'),
-                ForeignKey('potions.id'))
+                ForeignKey('potions.id'), index=True)
     price = Column(INTEGER, nullable=False)
     amount = Column(INTEGER, nullable=False)
     on_sale = Column(BOOLEAN, nullable=False)
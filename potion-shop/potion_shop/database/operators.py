@@ -1,24 +1,44 @@
-from collections.abc import Iterable
-
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import bindparam, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import scoped_session
 from sqlalchemy.sql.sqltypes import VARCHAR, BOOLEAN
 
+from potion_shop.database.query_cache import query_cache
+from potion_shop.database.serializer import python_type
+from potion_shop.database.versions import table_versions
 from potion_shop.utils.exceptions import ContentFormatException
 from potion_shop.utils.exceptions import InvalidDatabaseOperation
 from potion_shop.utils.exceptions import ItemNotFound
 
-'''
-converts query (result of DBOperator.get methods)
-    to dictionary (if 1 result)
-    or list of dictionaries (if multiple results)
-'''
-def query_to_dict(query_obj) -> [dict] or dict:
-    results = [query_obj.to_dict()] \
-            if not isinstance(query_obj, Iterable) \
-            else [result.to_dict() for result in query_obj]
+# max number of rows inserted by one INSERT statement
+INSERT_BATCH_SIZE = 1000
+
+# max number of rows updated by one UPDATE statement (see DBOperator.update_many)
+UPDATE_BATCH_SIZE = 1000
+
+# dialects that support INSERT ... RETURNING (and UPDATE ... FROM ... RETURNING)
+RETURNING_DIALECTS = {'postgresql'}
+
+# modes for rows that conflict with an existing row (see DBOperator.add)
+ON_CONFLICT_UPDATE = 'update'
+ON_CONFLICT_IGNORE = 'ignore'
+
+# how a search value is compared to a column (see DBOperator.get_by_column)
+SEARCH_PREFIX = 'prefix' # case-insensitive 'starts with' (strings)
+SEARCH_EXACT  = 'exact'
+SEARCH_TRUE   = 'true'
+SEARCH_FALSE  = 'false'
+SEARCH_NONE   = 'none'   # matches nothing (ex: an invalid boolean)
 
-    return results[0] if len(results) == 1 else results
+# JSON value types allowed for each column python type (see DBOperator.validate)
+# bool is a subclass of int in python, so it is checked separately
+VALID_TYPES = {
+    int: (int,),
+    float: (int, float),
+    bool: (bool,),
+    str: (str,)
+}
 
 class DBOperator:
     '''
@@ -27,7 +47,12 @@ class DBOperator:
     def __init__(self, session, data_object):
         self._session = session
         self._data_object = data_object
-        self._table = self._session.query(self._data_object)
+        self._primary_key = sqlalchemy.inspect(self._data_object).primary_key[0]
+
+    @property
+    def _table(self):
+        # only built if needed: the busiest lookups use baked queries
+        return self._session.query(self._data_object)
 
     def is_empty(self):
         ''' returns True if table (self._data_object) is empty
@@ -37,8 +62,93 @@ class DBOperator:
     def get_all(self):
         return self._table
 
+    def _columns(self, fields:[str]) -> list:
+        try:
+            return [self._data_object.__table__.columns[field] for field in fields]
+        except KeyError as ke:
+            raise ItemNotFound(message=f'Table does not contain column: {ke.args[0]}')
+
+    def get_page(self, query, page_size:int, after=None, fields:[str] = None) -> (list, 'primary key'):
+        '''
+        returns one page of query results using a keyset seek on the
+        primary key (WHERE id > after ORDER BY id LIMIT page_size)
+        and the primary key of the last row if there are more rows
+        after this page (None if this is the last page)
+
+        if fields is given, only those columns are selected (with a Core
+        statement, so no ORM objects are created) and the page is a list
+        of result rows with the column values in the same order as fields
+        '''
+        if after is not None:
+            query = query.filter(self._primary_key > after)
+
+        if fields:
+            # the primary key is also selected (at the end, if not
+            # already in fields) to find the next page's cursor
+            columns = self._columns(fields)
+            if self._primary_key.key not in fields:
+                columns.append(self._primary_key)
+            pk_index = [column.key for column in columns].index(self._primary_key.key)
+            query = query.with_entities(*columns)
+
+        # fetch one extra row to know whether there is a next page
+        query = query.order_by(self._primary_key).limit(page_size + 1)
+        rows = self._session.execute(query.statement).fetchall() if fields else query.all()
+        if len(rows) <= page_size or page_size == 0:
+            return rows[:page_size], None
+
+        rows = rows[:page_size]
+        last_id = rows[-1][pk_index] if fields else getattr(rows[-1], self._primary_key.key)
+        return rows, last_id
+
+    def stream(self, query, after=None, limit:int = None, fields:[str] = None):
+        '''
+        runs query (ordered by the primary key) on its own connection
+        using a server-side cursor and returns the open result.
+        rows are only read from the DB as they're fetched, and the
+        connection is released once the result is exhausted or closed.
+
+        if fields is given, only those columns are selected
+        '''
+        if after is not None:
+            query = query.filter(self._primary_key > after)
+        if fields:
+            query = query.with_entities(*self._columns(fields))
+        query = query.order_by(self._primary_key)
+        if limit is not None:
+            query = query.limit(limit)
+
+        connection = self._session.get_bind() \
+                        .connect(close_with_result=True) \
+                        .execution_options(stream_results=True)
+        try:
+            return connection.execute(query.statement)
+        except:
+            connection.close()
+            raise
+
+    def _baked(self, shape:tuple, build=None) -> 'BakedQuery':
+        '''
+        returns the cached baked query for this table & the query shape,
+        built on first use from session.query(data_object) by build(query)
+        (see QueryCache)
+        '''
+        data_object = self._data_object
+        key = (data_object,) + shape
+
+        def bake(bakery):
+            baked_query = bakery(lambda session: session.query(data_object), key)
+            if build is not None:
+                baked_query.add_criteria(build, key)
+            return baked_query
+        return query_cache.get(key, bake)
+
+    def _baked_session(self):
+        # baked queries run on the session itself, not the thread-local proxy
+        return self._session() if isinstance(self._session, scoped_session) else self._session
+
     def get_by_id(self, id:int):
-        row = self._table.get(id)
+        row = self._baked(('get',)).for_session(self._baked_session()).get(id)
         if not row:
             raise ItemNotFound(message='Unable to find resource with given ID')
         else:
@@ -55,9 +165,11 @@ class DBOperator:
         except AttributeError:
             raise ItemNotFound(message=f'Table does not contain column: {column_name}')
 
-    def get_by_column(self, column_name:str, search_value, object=None):
-        if not object:
-            object = self._table
+    def _search(self, column_name:str, search_value) -> (str, 'value'):
+        '''
+        returns how search_value is compared to the column (SEARCH_*),
+        and the value to compare it with
+        '''
         try:
             # separating based on search_value type so that
             # searching for string will return partial & case-insensitive matches
@@ -72,69 +184,386 @@ class DBOperator:
                 raise AttributeError
 
             if type(search_type) == VARCHAR:
-                return object.filter(
-                    func.lower(getattr(self._data_object, column_name)).startswith(search_value.lower())
-                )
+                return SEARCH_PREFIX, search_value.lower()
             elif type(search_type) == BOOLEAN:
                 # exact match for boolean comparison is 0/1, but should be
                 # able to search by human-readable True/False (case-insensitive)
                 if search_value.lower() in {'false','f','no','n'}:
-                    return object.filter(
-                        getattr(self._data_object, column_name) == sqlalchemy.sql.false()
-                    )
+                    return SEARCH_FALSE, None
                 elif search_value.lower() in {'true','t','yes','y'}:
-                    return object.filter(
-                        getattr(self._data_object, column_name) == sqlalchemy.sql.true()
-                    )
+                    return SEARCH_TRUE, None
                 else:
                     # bad input, but still need return type for formatting
-                    # empty query (should be fast)
-                    return object.filter(sqlalchemy.sql.false())
+                    return SEARCH_NONE, None
             else:
                 # exact matches only for any other type
                 # (shouldn't match int(15) to searches for int(1))
-                return self.get_by_column_exact(column_name, search_value, object)
+                return SEARCH_EXACT, search_value
 
         except AttributeError:
             raise ItemNotFound(message=f'Table does not contain column: {column_name}')
 
-    def update_by_id(self, id:int, to_save:dict):
-        row = self.get_by_id(id)
+    def _search_criterion(self, column_name:str, search:str, value):
+        ''' the filter for a search of the column (value may be a bindparam) '''
+        column = getattr(self._data_object, column_name)
+        if search == SEARCH_PREFIX:
+            return func.lower(column).startswith(value)
+        elif search == SEARCH_FALSE:
+            return column == sqlalchemy.sql.false()
+        elif search == SEARCH_TRUE:
+            return column == sqlalchemy.sql.true()
+        elif search == SEARCH_NONE:
+            # empty query (should be fast)
+            return sqlalchemy.sql.false()
+        return column == value
+
+    def get_by_column(self, column_name:str, search_value, object=None):
+        if not object:
+            object = self._table
+        search, value = self._search(column_name, search_value)
+        if search == SEARCH_EXACT:
+            return self.get_by_column_exact(column_name, value, object)
+        return object.filter(self._search_criterion(column_name, search, value))
+
+    def get_page_by(self, search_params:dict, page_size:int, after=None, fields:[str] = None) -> (list, 'primary key'):
+        '''
+        the same as get_page() for get_all() filtered with get_by_column()
+        for each of the search_params ({column_name: search_value}), but
+        with a baked query that is only built & compiled once for each
+        combination of searched columns (see QueryCache)
+        '''
+        searches = [(name, *self._search(name, value)) for name, value in sorted(search_params.items())]
+        columns = self._columns(fields) if fields else None
+        if columns and self._primary_key.key not in fields:
+            columns.append(self._primary_key)
 
+        shape = ('page',
+                 tuple((name, search) for name, search, value in searches),
+                 after is not None,
+                 tuple(column.key for column in columns) if columns else None)
+
+        def build(query):
+            for i, (name, search, value) in enumerate(searches):
+                query = query.filter(self._search_criterion(name, search, bindparam(f'search_{i}')))
+            if after is not None:
+                query = query.filter(self._primary_key > bindparam('after'))
+            if columns:
+                query = query.with_entities(*columns)
+            return query.order_by(self._primary_key).limit(bindparam('limit'))
+
+        params = {f'search_{i}': value for i, (name, search, value) in enumerate(searches)
+                  if search in (SEARCH_PREFIX, SEARCH_EXACT)}
+        if after is not None:
+            params['after'] = after
+        # fetch one extra row to know whether there is a next page
+        params['limit'] = page_size + 1
+
+        rows = self._baked(shape, build).for_session(self._baked_session()).params(**params).all()
+        if len(rows) <= page_size or page_size == 0:
+            return rows[:page_size], None
+
+        rows = rows[:page_size]
+        if columns:
+            pk_index = [column.key for column in columns].index(self._primary_key.key)
+            return rows, rows[-1][pk_index]
+        return rows, getattr(rows[-1], self._primary_key.key)
+
+    def _changed(self):
+        # lets cached responses & ETags for the table know it changed
+        table_versions.bump(self._data_object.__tablename__)
+
+    def update_by_id(self, id:int, to_save:dict):
         if not isinstance(to_save, dict):
             raise ContentFormatException('Content must be of type dict')
+        if not to_save:
+            self.get_by_id(id) # nothing to update
+            return
 
+        # a single UPDATE: the row isn't loaded first
+        table = self._data_object.__table__
         try:
             with self._session.begin():
-                row.update(self._session, self._data_object, to_save)
+                result = self._session.execute(
+                    table.update().where(self._primary_key == id).values(to_save))
         except:
             raise InvalidDatabaseOperation('Error occurred while updating database')
 
-    def add(self, obj: list or 'data_object'):
-        if not isinstance(obj, list) and not isinstance(obj, self._data_object):
-            raise ContentFormatException('Attempting to add an invalid object type to table')
+        if result.rowcount == 0:
+            raise ItemNotFound(message='Unable to find resource with given ID')
+        self._changed()
 
+    def _check_changes(self, changes, item:int = None) -> dict:
+        '''
+        checks that changes is a {column: value} dictionary of valid values
+        for the table's (non primary key) columns. raises ContentFormatException
+        describing the first invalid change (prefixed with the item number)
+        '''
+        prefix = f'Item {item}: ' if item is not None else ''
+        if not isinstance(changes, dict) or not changes:
+            raise ContentFormatException(f'{prefix}changes must be a dict of columns to update')
+
+        columns = self._data_object.__table__.columns
+        for key, value in changes.items():
+            if key not in columns or columns[key].primary_key:
+                raise ContentFormatException(f'{prefix}Unable to update column: {key}')
+            error = self._invalid_value(columns[key], value)
+            if error:
+                raise ContentFormatException(f'{prefix}{error}')
+        return changes
+
+    def _update_values(self, keys:tuple, rows:list) -> list:
+        '''
+        updates the columns in keys for every row (a dictionary with the
+        primary key & the new values) with a single
+            UPDATE table SET ... FROM (VALUES ...) AS v WHERE table.id = v.id
+        returns the primary keys of the updated rows
+        '''
+        table = self._data_object.__table__
+        dialect = self._session.get_bind().dialect
+        quote = dialect.identifier_preparer.quote
+        pk = self._primary_key.key
+        columns = (pk,) + keys
+
+        params = {}
+        values = []
+        for i, row in enumerate(rows):
+            names = []
+            for j, key in enumerate(columns):
+                params[f'v{i}_{j}'] = row[key]
+                names.append(f':v{i}_{j}')
+            values.append(f'({", ".join(names)})')
+
+        # VALUES columns have no declared type, so every value is cast
+        # to its column's type (ex: a column of only NULLs would be TEXT)
+        def cast(key):
+            return f'CAST(v.{quote(key)} AS {table.c[key].type.compile(dialect=dialect)})'
+
+        statement = (
+            f'UPDATE {quote(table.name)} '
+            f'SET {", ".join(f"{quote(key)} = {cast(key)}" for key in keys)} '
+            f'FROM (VALUES {", ".join(values)}) AS v ({", ".join(quote(key) for key in columns)}) '
+            f'WHERE {quote(table.name)}.{quote(pk)} = {cast(pk)} '
+            f'RETURNING {quote(table.name)}.{quote(pk)}'
+        )
+        return [row[0] for row in self._session.execute(sqlalchemy.text(statement), params)]
+
+    def _update_rows(self, keys:tuple, rows:list) -> list:
+        # no UPDATE ... FROM & RETURNING support: update one row at a time
+        table = self._data_object.__table__
+        statement = table.update() \
+                        .where(self._primary_key == sqlalchemy.bindparam('_id')) \
+                        .values({key: sqlalchemy.bindparam(key) for key in keys})
+        updated = []
+        for row in rows:
+            params = {key: row[key] for key in keys}
+            params['_id'] = row[self._primary_key.key]
+            if self._session.execute(statement, params).rowcount:
+                updated.append(params['_id'])
+        return updated
+
+    def update_many(self, updates:list) -> dict:
+        '''
+        applies a list of {'id': primary key, 'changes': {column: value}}
+        updates in one transaction. rows that change the same columns are
+        updated together, UPDATE_BATCH_SIZE rows per UPDATE statement.
+        returns {'updated': number of rows updated, 'not_found': [ids]}
+        '''
+        if not isinstance(updates, list):
+            raise ContentFormatException('Content must be a list of updates')
+
+        pk = self._primary_key.key
+        groups = {}
+        seen = set()
+        for i, update in enumerate(updates):
+            if not isinstance(update, dict) or set(update) != {pk, 'changes'}:
+                raise ContentFormatException(f'Item {i}: must be in the format {{\'{pk}\': ..., \'changes\': {{...}}}}')
+            id = update[pk]
+            if type(id) != int:
+                raise ContentFormatException(f'Item {i}: {pk} must be of type int')
+            if id in seen:
+                raise ContentFormatException(f'Item {i}: {pk} {id} is repeated')
+            seen.add(id)
+
+            changes = self._check_changes(update['changes'], i)
+            keys = tuple(sorted(changes))
+            groups.setdefault(keys, []).append(dict(changes, **{pk: id}))
+
+        update_rows = self._update_values \
+                        if self._session.get_bind().dialect.name in RETURNING_DIALECTS \
+                        else self._update_rows
+        updated = set()
         try:
-            if isinstance(obj, list):
-                with self._session.no_autoflush:
-                    self._session.add_all(obj)
-                    self._session.flush()
+            with self._session.begin():
+                for keys, rows in groups.items():
+                    for start in range(0, len(rows), UPDATE_BATCH_SIZE):
+                        updated.update(update_rows(keys, rows[start:start + UPDATE_BATCH_SIZE]))
+        except:
+            raise InvalidDatabaseOperation('Error occurred while updating database')
+
+        if updated:
+            self._changed()
+        return {
+            'updated': len(updated),
+            'not_found': [update[pk] for update in updates if update[pk] not in updated]
+        }
+
+    def update_where(self, filters:dict, changes:dict) -> dict:
+        '''
+        applies the same changes to every row that exactly matches all of
+        the filters ({column: value}) with a single UPDATE statement.
+        returns {'updated': number of rows updated}
+        '''
+        if not isinstance(filters, dict) or not filters:
+            raise ContentFormatException('filter must be a dict of columns to match')
+        self._check_changes(changes)
+
+        columns = self._data_object.__table__.columns
+        conditions = []
+        for key, value in filters.items():
+            if key not in columns:
+                raise ContentFormatException(f'Table does not contain column: {key}')
+            error = self._invalid_value(columns[key], value)
+            if error:
+                raise ContentFormatException(f'filter: {error}')
+            conditions.append(columns[key].is_(None) if value is None else columns[key] == value)
+
+        try:
+            with self._session.begin():
+                result = self._session.execute(
+                    self._data_object.__table__.update() \
+                        .where(sqlalchemy.and_(*conditions)) \
+                        .values(changes))
+        except:
+            raise InvalidDatabaseOperation('Error occurred while updating database')
+
+        if result.rowcount:
+            self._changed()
+        return {'updated': result.rowcount}
+
+    def _invalid_value(self, column, value) -> str or None:
+        ''' returns why value can't be saved in column (None if it can) '''
+        if value is None:
+            return None if column.nullable else f'{column.key} is required'
+
+        valid_types = VALID_TYPES.get(python_type(column.type))
+        if valid_types and (type(value) not in valid_types):
+            return f'{column.key} must be of type {python_type(column.type).__name__}'
+        return None
+
+    def validate(self, objs:list):
+        '''
+        checks the values of every object against the table's columns
+        before anything is written to the DB. raises ContentFormatException
+        describing the first invalid value.
+        '''
+        columns = [col for col in self._data_object.__table__.columns if not col.primary_key]
+        for i, obj in enumerate(objs):
+            for column in columns:
+                error = self._invalid_value(column, getattr(obj, column.key))
+                if error:
+                    raise ContentFormatException(f'Item {i}: {error}')
+
+    def _conflict_column(self):
+        # the unique column that identifies an existing row (ex: PotionTypes.color)
+        unique = [col for col in self._data_object.__table__.columns if col.unique]
+        if len(unique) != 1:
+            raise ContentFormatException(f'{self._data_object.__tablename__} has no unique column to resolve conflicts on')
+        return unique[0]
+
+    def _upsert_statement(self, values:list, on_conflict:str):
+        '''
+        INSERT ... ON CONFLICT (unique column) DO UPDATE SET (every other
+        column) / DO NOTHING. rows that are ignored aren't returned.
+        '''
+        table = self._data_object.__table__
+        conflict_column = self._conflict_column()
+        statement = insert(table).values(values)
+
+        if on_conflict == ON_CONFLICT_IGNORE:
+            return statement.on_conflict_do_nothing(index_elements=[conflict_column])
+
+        return statement.on_conflict_do_update(
+            index_elements=[conflict_column],
+            set_={col.key: statement.excluded[col.key] for col in table.columns
+                    if not col.primary_key and col is not conflict_column}
+        )
+
+    def _insert(self, objs:list, on_conflict:str = None) -> [dict]:
+        '''
+        inserts the objects' values in batches of INSERT_BATCH_SIZE rows,
+        each with one INSERT ... RETURNING statement (so the generated ids
+        don't need to be read back with a SELECT per row).
+        returns the inserted rows as dictionaries.
 
-                    for item in obj:
-                        self._session.refresh(item)
+        with on_conflict ('update' or 'ignore'), rows with the same value
+        in the table's unique column as an existing row update that row
+        (or are skipped) instead of failing the insert
+        '''
+        table = self._data_object.__table__
+        pk = self._primary_key.key
+        values = [{key: value for key, value in obj.to_dict().items()
+                    if key != pk or value is not None}
+                  for obj in objs]
 
-                return [o.to_dict() for o in obj]
+        returning = self._session.get_bind().dialect.name in RETURNING_DIALECTS
+        if on_conflict == ON_CONFLICT_UPDATE:
+            # a statement can't update the same row twice:
+            # only the last row with each unique value is kept
+            key = self._conflict_column().key
+            values = list({row[key]: row for row in values}.values())
 
-            else:  # if isinstance(obj, self._data_object):
-                with self._session.begin():
-                    obj.save(self._session)
-                self._session.refresh(obj)
+        inserted = []
+        with self._session.begin():
+            if returning:
+                for start in range(0, len(values), INSERT_BATCH_SIZE):
+                    batch = values[start:start + INSERT_BATCH_SIZE]
+                    statement = self._upsert_statement(batch, on_conflict) if on_conflict \
+                                    else table.insert().values(batch)
+                    statement = statement.returning(*table.columns)
+                    inserted.extend(dict(row) for row in self._session.execute(statement))
+            else:
+                # no RETURNING support: insert one row at a time
+                for row in values:
+                    result = self._session.execute(table.insert().values(row))
+                    inserted.append(dict(row, **{pk: result.inserted_primary_key[0]}))
+
+        return inserted
+
+    def add(self, obj: list or 'data_object', on_conflict:str = None):
+        '''
+        adds one object or a list of objects to the table. returns the
+        inserted row as a dictionary (or a list of them for a list)
+
+        on_conflict: None (fail), 'update' or 'ignore' existing rows with
+        the same unique value (see _insert). ignored rows aren't returned.
+        '''
+        if not isinstance(obj, list) and not isinstance(obj, self._data_object):
+            raise ContentFormatException('Attempting to add an invalid object type to table')
+        if on_conflict not in (None, ON_CONFLICT_UPDATE, ON_CONFLICT_IGNORE):
+            raise ContentFormatException(f'Invalid on_conflict mode: {on_conflict}')
+
+        objs = obj if isinstance(obj, list) else [obj]
+        if not all(isinstance(o, self._data_object) for o in objs):
+            raise ContentFormatException('Attempting to add an invalid object type to table')
+        if on_conflict:
+            self._conflict_column()
+            if self._session.get_bind().dialect.name not in RETURNING_DIALECTS:
+                raise InvalidDatabaseOperation('on_conflict is not supported by this database')
+        if not objs:
+            return []
 
-                return obj.to_dict()
+        try:
+            inserted = self._insert(objs, on_conflict)
         except:
             self._session.rollback()
             raise InvalidDatabaseOperation('Error occurred while updating database')
 
+        if inserted:
+            self._changed()
+        if isinstance(obj, list):
+            return inserted
+        return inserted[0] if inserted else None
+
     def delete_by_id(self, id:int):
         obj = self.get_by_id(id)
 
@@ -143,3 +572,4 @@ class DBOperator:
                 obj.remove(self._session)
         except:
             raise InvalidDatabaseOperation('Error occurred while updating database')
+        self._changed()
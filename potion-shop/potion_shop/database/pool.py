@@ -0,0 +1,268 @@
+'''
+Connection pool settings & live pool metrics.
+
+pool_options() builds the create_engine() pool arguments from the
+'database' config section:
+    pool_class:     queue (default), null, static or serialized (a
+                    static pool used by one thread at a time)
+    pool_size:      connections kept open by each worker
+    max_overflow:   extra connections opened when all are checked out
+    pool_timeout:   seconds to wait for a connection before failing
+    pool_recycle:   seconds before a connection is reopened (-1 never)
+    pool_pre_ping:  test connections when they're checked out
+
+Each gunicorn worker has its own pool, so a server opens up to
+workers * (pool_size + max_overflow) connections to the database,
+which must stay below Postgres 'max_connections'.
+
+A PoolMonitor counts the pool events of an engine and times every
+checkout (waiting for a free connection, or opening a new one) into
+a histogram, so the pool can be sized from the /v1/metrics counters.
+
+A ForkGuard keeps a forked worker off the connections it inherited from
+the gunicorn master (see ForkGuard).
+'''
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+
+from potion_shop.utils.exceptions import DatabaseConnectionError
+
+class SerializedStaticPool(StaticPool):
+    '''
+    A StaticPool whose single connection is only used by one thread (or
+    greenlet) at a time: a checkout waits until the other threads have
+    returned the connection. A thread that checks it out again (without
+    returning it first, ex: the log writer inside a request) gets the
+    connection it already has, and the connection is only returned (to
+    the other threads) when its outermost checkout is closed. As there's
+    one connection, the checkouts also share its transaction: a nested
+    commit commits the work of the outer checkout so far.
+
+    Used for in-memory SQLite databases, which only exist on their one
+    connection, so the transactions of concurrent requests (gthread or
+    gevent workers) & of the log writer can't interleave on it.
+    '''
+    def __init__(self, *args, **kwargs):
+        # set below, without the deprecation warning (ex: in recreate())
+        kwargs.pop('use_threadlocal', None)
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        # nested checkouts reuse the thread's connection (see Pool.connect()),
+        # so only the outermost checkout gets here, & returns the connection
+        self._use_threadlocal = True
+
+    def unique_connection(self):
+        # used by engine.connect(): there's no other connection to give
+        return self.connect()
+
+    def _do_get(self):
+        self._lock.acquire()
+        try:
+            return super()._do_get()
+        except:
+            self._lock.release()
+            raise
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self._lock.release()
+
+    def status(self):
+        return 'SerializedStaticPool'
+
+POOL_CLASSES = {
+    'queue': QueuePool,
+    'null': NullPool,
+    'static': StaticPool,
+    'serialized': SerializedStaticPool
+}
+
+# config key -> create_engine() argument, and its type
+SIZE_OPTIONS = {
+    'pool_size': int,
+    'max_overflow': int,
+    'pool_timeout': float
+}
+CONNECTION_OPTIONS = {
+    'pool_recycle': int,
+    'pool_pre_ping': bool
+}
+
+# upper bounds (in ms) of the checkout time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+class PoolMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_ms = 0
+        self.max_wait_ms = 0
+        self._buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def pool_class(self, pool_class):
+        '''
+        returns a subclass of pool_class that times its checkouts.
+        a subclass (instead of wrapping the pool) is kept when the
+        engine's pool is recreated, ex: by engine.dispose()
+        '''
+        monitor = self
+
+        class TimedPool(pool_class):
+            def _do_get(self):
+                start = time.perf_counter()
+                try:
+                    return super()._do_get()
+                except PoolTimeout:
+                    monitor.record_timeout()
+                    raise
+                finally:
+                    monitor.record_wait(time.perf_counter() - start)
+
+        TimedPool.__name__ = pool_class.__name__
+        return TimedPool
+
+    def attach(self, engine):
+        ''' counts the pool events of the engine '''
+        self._engine = engine
+        event.listen(engine, 'connect', lambda *args: self._count('connects'))
+        event.listen(engine, 'checkout', lambda *args: self._count('checkouts'))
+        event.listen(engine, 'checkin', lambda *args: self._count('checkins'))
+        event.listen(engine, 'invalidate', lambda *args: self._count('invalidations'))
+
+    def _count(self, counter:str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds:float):
+        wait_ms = seconds * 1000
+        bucket = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if wait_ms <= bound),
+                      len(WAIT_BUCKETS_MS))
+        with self._lock:
+            self._buckets[bucket] += 1
+            self.wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def record_timeout(self):
+        self._count('timeouts')
+
+    def histogram(self) -> dict:
+        ''' number of checkouts by time taken: {'<=1ms': n, ..., '>5000ms': n} '''
+        with self._lock:
+            buckets = list(self._buckets)
+        histogram = {f'<={bound}ms': count for bound, count in zip(WAIT_BUCKETS_MS, buckets)}
+        histogram[f'>{WAIT_BUCKETS_MS[-1]}ms'] = buckets[-1]
+        return histogram
+
+    def stats(self) -> dict:
+        pool = self._engine.pool if self._engine is not None else None
+        stats = {'pool_class': type(pool).__name__ if pool is not None else None}
+
+        # only QueuePools have a size & overflow
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'max_overflow': pool._max_overflow,
+                'max_connections': pool.size() + max(pool._max_overflow, 0),
+                'timeout': pool.timeout()
+            })
+
+        with self._lock:
+            checkouts = self.checkouts
+            stats.update({
+                'connects': self.connects,
+                'checkouts': checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.wait_ms / checkouts, 3) if checkouts else 0,
+                'max_wait_ms': round(self.max_wait_ms, 3)
+            })
+        stats['wait_histogram'] = self.histogram()
+        return stats
+
+def pool_options(database:dict, monitor:PoolMonitor = None) -> dict:
+    '''
+    returns the create_engine() pool arguments for the pool settings in
+    the 'database' config. settings that aren't set keep SQLAlchemy's
+    defaults. raises DatabaseConnectionError for invalid settings.
+    '''
+    database = database or {}
+    pool_name = str(database.get('pool_class') or 'queue').lower()
+    if pool_name not in POOL_CLASSES:
+        raise DatabaseConnectionError(
+            f'[ERROR] Unsupported pool_class: {pool_name}. Must be one of: {", ".join(POOL_CLASSES)}')
+    pool_class = POOL_CLASSES[pool_name]
+
+    # NullPool & StaticPool don't keep a number of connections
+    supported = dict(CONNECTION_OPTIONS)
+    if issubclass(pool_class, QueuePool):
+        supported.update(SIZE_OPTIONS)
+
+    options = {}
+    for key, value in database.items():
+        if key not in SIZE_OPTIONS and key not in CONNECTION_OPTIONS:
+            continue
+        if key not in supported:
+            raise DatabaseConnectionError(f'[ERROR] {key} is not supported by pool_class {pool_name}')
+        if value is None:
+            continue
+        try:
+            options[key] = supported[key](value)
+        except (TypeError, ValueError):
+            raise DatabaseConnectionError(f'[ERROR] Invalid {key}: {value}')
+
+    options['poolclass'] = monitor.pool_class(pool_class) if monitor else pool_class
+    return options
+
+class ForkGuard:
+    '''
+    Discards a pooled connection when it's checked out by another process
+    than the one that opened it (a gunicorn worker, forked from the master
+    with the master's pool), and opens a new one in its place.
+
+    The inherited connection isn't closed: its socket is still used by the
+    master, and closing it (even when it's garbage collected) would end the
+    master's session. It's kept (unused) for as long as the worker runs.
+    The master disposes its pools before forking (see
+    PotionApplication.before_fork), so few connections are inherited.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        # connections of the parent process, never closed by this one
+        self._inherited = []
+
+    def attach(self, engine):
+        event.listen(engine, 'connect', self._connected)
+        event.listen(engine, 'checkout', self._checked_out)
+
+    def _connected(self, dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    def _checked_out(self, dbapi_connection, connection_record, connection_proxy):
+        pid = connection_record.info.get('pid')
+        if pid == os.getpid():
+            return
+        with self._lock:
+            self._inherited.append(dbapi_connection)
+        # the pool opens a new connection, without closing this one
+        connection_record.connection = connection_proxy.connection = None
+        raise DisconnectionError(f'Connection opened by process {pid} checked out by process {os.getpid()}')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'inherited': len(self._inherited)}
@@ -0,0 +1,75 @@
+'''
+A per-process cache of baked (pre-compiled) ORM queries for the common
+query shapes of DBOperator: get by id, and one page of a table filtered
+by any combination of columns (see DBOperator.get_page_by).
+
+Building a Query and compiling it to SQL takes more time than running
+the query itself for small lookups. A baked query is built & compiled
+once for each shape (the model, the filtered columns and how each is
+compared, the selected fields...), and later requests only bind the
+search values as parameters.
+
+The shape is the cache key. At most 'size' shapes are kept (the least
+recently used are dropped). Each shape takes BAKERY_ENTRIES_PER_SHAPE
+entries in the bakery (its compiled query, and its compiled SQL), which
+is sized to match, so a hit on a kept shape also reuses its compiled SQL.
+'''
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.ext import baked
+
+# max number of query shapes kept (least recently used are dropped)
+QUERY_CACHE_SIZE = 1000
+
+# bakery entries used by one shape: the compiled query (ORM context)
+# and the compiled SQL statement (the bakery is also its compiled_cache)
+BAKERY_ENTRIES_PER_SHAPE = 2
+
+class QueryCache:
+    def __init__(self, size:int = QUERY_CACHE_SIZE):
+        self._size = size
+        self._bakery = baked.bakery(size=size * BAKERY_ENTRIES_PER_SHAPE)
+        # query shape -> BakedQuery, least recently used first
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key:tuple, build) -> baked.BakedQuery:
+        '''
+        returns the baked query for the query shape 'key'. on the first
+        use of the shape, it's built with build(bakery): the key must
+        be passed to the bakery as an argument of the initial step.
+        '''
+        with self._lock:
+            query = self._queries.get(key)
+            if query is not None:
+                self._queries.move_to_end(key)
+                self.hits += 1
+                return query
+
+        query = build(self._bakery)
+        with self._lock:
+            self.misses += 1
+            # keep the first one if another thread built it too
+            query = self._queries.setdefault(key, query)
+            self._queries.move_to_end(key)
+            while len(self._queries) > self._size:
+                self._queries.popitem(last=False)
+                self.evictions += 1
+            return query
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'shapes': len(self._queries),
+                'max_shapes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+query_cache = QueryCache()
@@ -0,0 +1,125 @@
+'''
+Read replicas for GET traffic.
+
+A ReplicaSet has one engine (and session) per replica in the 'replicas'
+list of the 'database' config, with the same pool settings as the
+primary. Reads are sent to the replicas in turn (round-robin).
+
+A replica that fails with a connection error is ejected for
+'eject_seconds' (no reads are sent to it), and the read is run again
+on the primary. Once the time is up, the replica gets reads again.
+If every replica is ejected, reads go to the primary.
+
+Replicas apply the primary's changes asynchronously, so reads from a
+replica may lag behind recent writes. Requests that must see their own
+writes are kept on the primary (see middleware/read_routing.py).
+'''
+import itertools
+import threading
+import time
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from potion_shop.database.db_utils import DatabaseManager
+from potion_shop.database.logging.manager import get_logger
+from potion_shop.database.statement_timeout import is_statement_timeout
+
+# default if not set in the 'database' config
+EJECT_SECONDS = 30
+
+class _Replica:
+    def __init__(self, manager:DatabaseManager):
+        self.manager = manager
+        self.ejected_until = 0
+        self.reads = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def healthy(self, now:float) -> bool:
+        return self.ejected_until <= now
+
+class ReplicaSet:
+    def __init__(self, connections:[str], pool:dict = None, eject_seconds:float = EJECT_SECONDS,
+                 statement_timeout_ms:int = 0):
+        # the tables are created on the primary, not on the replicas
+        self._replicas = [
+            _Replica(DatabaseManager(connection=c, pool=pool, statement_timeout_ms=statement_timeout_ms))
+            for c in connections
+        ]
+        self._eject_seconds = eject_seconds
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._replicas)
+
+    def choose(self) -> _Replica or None:
+        ''' the next healthy replica (round-robin), or None if all are ejected '''
+        now = time.monotonic()
+        with self._lock:
+            start = next(self._next)
+        for i in range(len(self._replicas)):
+            replica = self._replicas[(start + i) % len(self._replicas)]
+            if replica.healthy(now):
+                return replica
+        return None
+
+    def eject(self, replica:_Replica):
+        with self._lock:
+            replica.errors += 1
+            replica.ejections += 1
+            replica.ejected_until = time.monotonic() + self._eject_seconds
+        # the replica's connections may be broken
+        replica.manager.session.remove()
+        replica.manager.engine.dispose()
+
+    def read(self, read, fallback):
+        '''
+        returns read(session) run on a replica's session. runs it on the
+        fallback (primary) session if no replica is healthy, or if the
+        replica fails with a connection error (the replica is ejected)
+        '''
+        replica = self.choose()
+        if replica is None:
+            return read(fallback)
+
+        try:
+            result = read(replica.manager.session)
+        except DBAPIError as e:
+            if not isinstance(e, OperationalError) and not e.connection_invalidated:
+                raise # ex: an invalid search value, which fails on the primary too
+            if is_statement_timeout(e):
+                raise # the statement timed out, the replica is fine
+            get_logger().warning(f'Ejecting read replica {replica.manager.engine.url.host}: {e.orig}')
+            self.eject(replica)
+            return read(fallback)
+
+        with self._lock:
+            replica.reads += 1
+        return result
+
+    def release(self):
+        for replica in self._replicas:
+            replica.manager.session.remove()
+
+    def dispose(self):
+        for replica in self._replicas:
+            replica.manager.dispose()
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        stats = []
+        for replica in self._replicas:
+            with self._lock:
+                counters = {
+                    'healthy': replica.healthy(now),
+                    'reads': replica.reads,
+                    'errors': replica.errors,
+                    'ejections': replica.ejections
+                }
+            stats.append(dict(
+                host=replica.manager.engine.url.host,
+                port=replica.manager.engine.url.port,
+                pool=replica.manager.pool_monitor.stats(),
+                **counters))
+        return stats
@@ -0,0 +1,120 @@
+'''
+Converts ORM objects & result rows of a data model to dictionaries
+and encodes responses as JSON bytes.
+
+A RowSerializer is built once per data model (and set of columns) by
+serializer_for() and cached. It precomputes:
+    - a getter that reads every column value of an ORM object at once
+      (instead of inspecting the object's mapper for every row)
+    - a converter for each column whose values json can't encode
+      natively (ex: DATETIME), so that encoding never needs to fall
+      back to a python callback. these values are converted with str()
+      to match the previous `json.dumps(..., default=str)` output
+'''
+import json
+from operator import attrgetter, itemgetter
+
+from sqlalchemy import inspect
+
+# types json encodes natively
+_NATIVE_TYPES = {bool, int, float, str, dict, list, type(None)}
+
+# shared encoder, so the (C-accelerated) encoder is only set up once
+# 'default=str' is only used as a fallback for unexpected value types
+_encoder = json.JSONEncoder(default=str, check_circular=False)
+
+def dumps(obj) -> bytes:
+    ''' encodes obj as JSON bytes (for falcon's resp.data) '''
+    return _encoder.encode(obj).encode('utf-8')
+
+def python_type(sql_type):
+    try:
+        return sql_type.python_type
+    except NotImplementedError:
+        # type variants (ex: BIGINT().with_variant(...))
+        # use the python type of the type they wrap
+        impl = getattr(sql_type, 'impl', None)
+        return python_type(impl) if impl is not None else None
+
+def _to_str(value):
+    return value if value is None else str(value)
+
+def _to_json_value(value):
+    # column type is unknown: only convert if json can't encode it
+    return value if type(value) in _NATIVE_TYPES else str(value)
+
+def _converter(sql_type):
+    py_type = python_type(sql_type)
+    if py_type is None:
+        return _to_json_value
+    if py_type in _NATIVE_TYPES:
+        return None
+    return _to_str
+
+class RowSerializer:
+    def __init__(self, data_object, keys:tuple):
+        columns = {attr.key: attr.columns[0] for attr in inspect(data_object).mapper.column_attrs}
+
+        self.keys = keys
+        # loaded column values are read straight from the object's __dict__,
+        # falling back to the (slower) instrumented attributes if any
+        # are not loaded (ex: expired after a commit)
+        self._dict_getter = itemgetter(*keys)
+        self._attr_getter = attrgetter(*keys)
+        # getters with a single key return the value instead of a tuple
+        self._single_key = len(keys) == 1
+
+        # (position, converter) for each column that needs converting
+        converters = []
+        for i, key in enumerate(keys):
+            converter = _converter(columns[key].type)
+            if converter:
+                converters.append((i, converter))
+        self._converters = tuple(converters)
+
+    def _values(self, obj) -> tuple:
+        try:
+            values = self._dict_getter(obj.__dict__)
+        except KeyError:
+            values = self._attr_getter(obj)
+        return (values,) if self._single_key else values
+
+    def to_dict(self, obj) -> dict:
+        ''' converts an ORM object to a dictionary (unconverted values) '''
+        return dict(zip(self.keys, self._values(obj)))
+
+    def row_to_json_dict(self, row) -> dict:
+        '''
+        converts a result row (column values in the same order as
+        self.keys) to a dictionary that json can encode natively
+        '''
+        if not self._converters:
+            return dict(zip(self.keys, row))
+
+        values = list(row)
+        for i, converter in self._converters:
+            values[i] = converter(values[i])
+        return dict(zip(self.keys, values))
+
+    def to_json_dict(self, obj) -> dict:
+        ''' converts an ORM object to a dictionary that json can encode natively '''
+        return self.row_to_json_dict(self._values(obj))
+
+    def mapping_to_json_dict(self, mapping:dict) -> dict:
+        ''' converts a {column: value} dictionary to one that json can encode natively '''
+        return self.row_to_json_dict([mapping[key] for key in self.keys])
+
+_serializers = {}
+
+def serializer_for(data_object, keys:tuple = None) -> RowSerializer:
+    '''
+    returns the (cached) RowSerializer for data_object. if keys is not
+    given, the serializer uses every column of the data model.
+    '''
+    cache_key = (data_object, keys)
+    serializer = _serializers.get(cache_key)
+    if serializer is None:
+        if keys is None:
+            keys = tuple(attr.key for attr in inspect(data_object).mapper.column_attrs)
+        serializer = _serializers[cache_key] = RowSerializer(data_object, tuple(keys))
+    return serializer
@@ -0,0 +1,61 @@
+'''
+Per-request Postgres statement timeouts.
+
+Sessions are in autocommit mode, so each statement may run on a different
+pooled connection. The timeout is therefore applied whenever a connection
+is checked out of the pool: if the connection's statement_timeout isn't
+already the timeout of the current request, it's changed with
+    SELECT set_config('statement_timeout', <ms>, false)
+(and remembered in the connection's info, so it's only set when it
+changes). Postgres cancels any statement that runs longer, which frees
+the connection for other requests.
+
+The timeout of the current request is kept per thread (see
+DBSessionMiddleware). Anything else (ex: the write-behind flush thread)
+uses the default timeout. A timeout of 0 means no timeout.
+'''
+import threading
+
+from sqlalchemy import event
+
+# SQLSTATE of statements canceled by the statement_timeout
+QUERY_CANCELED = '57014'
+
+_current = threading.local()
+
+def is_statement_timeout(error) -> bool:
+    ''' True if the (SQLAlchemy DBAPIError) error is a canceled statement '''
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == QUERY_CANCELED
+
+def set_statement_timeout(timeout_ms:int = None):
+    ''' the timeout for connections checked out by this thread (None: the default) '''
+    _current.timeout_ms = timeout_ms
+
+def get_statement_timeout() -> int or None:
+    return getattr(_current, 'timeout_ms', None)
+
+class StatementTimeout:
+    def __init__(self, default_ms:int = 0):
+        self._default_ms = default_ms
+
+    def attach(self, engine):
+        # statement_timeout is a Postgres setting
+        if engine.dialect.name != 'postgresql':
+            return
+        event.listen(engine, 'checkout', self._on_checkout)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        timeout_ms = get_statement_timeout()
+        if timeout_ms is None:
+            timeout_ms = self._default_ms
+        if connection_record.info.get('statement_timeout') == timeout_ms:
+            return
+
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT set_config('statement_timeout', %s, false)", (str(timeout_ms),))
+        finally:
+            cursor.close()
+        # the setting would be undone if the connection's transaction is rolled back
+        dbapi_connection.commit()
+        connection_record.info['statement_timeout'] = timeout_ms
@@ -0,0 +1,54 @@
+'''
+A change counter for each table, used to tell whether data read from
+a table (ex: a cached response) is out of date.
+
+The counters are kept in shared memory that is allocated when this
+module is imported. Since the application is created in the gunicorn
+master process before the workers are forked, every worker shares the
+same counters: bumping a table's version in one worker is seen by all
+the others. (Workers on other hosts do not share the counters.)
+
+Changes made with a DBOperator bump the versions. Changes made
+directly in the database are not seen.
+'''
+import multiprocessing
+import os
+import time
+
+from potion_shop.database.logging.models import LoggingModel
+from potion_shop.database.models import DataModel
+
+class TableVersions:
+    def __init__(self, table_names):
+        self._index = {name: i for i, name in enumerate(sorted(table_names))}
+        # the counters start over at 0 when the server restarts, so the
+        # epoch keeps versions from different runs (or hosts) apart
+        self.epoch = f'{int(time.time()):x}{os.getpid():x}'
+        # unsynchronized reads are fine (a 64-bit read is atomic),
+        # updates are done while holding the lock
+        self._versions = multiprocessing.RawArray('Q', len(self._index))
+        self._lock = multiprocessing.Lock()
+
+    def get(self, table_name:str) -> int:
+        return self._versions[self._index[table_name]]
+
+    def get_all(self, table_names) -> tuple:
+        return tuple(self._versions[self._index[name]] for name in table_names)
+
+    def etag(self, table_names) -> str:
+        '''
+        an entity tag for data read from the tables, which
+        changes whenever any of the tables change
+        '''
+        versions = '.'.join(str(v) for v in self.get_all(table_names))
+        return f'{self.epoch}-{versions}'
+
+    def bump(self, table_name:str) -> int:
+        i = self._index[table_name]
+        with self._lock:
+            self._versions[i] += 1
+            return self._versions[i]
+
+table_versions = TableVersions(
+    list(DataModel.metadata.tables.keys()) + list(LoggingModel.metadata.tables.keys())
+)
@@ -0,0 +1,209 @@
+'''
+Write-behind coalescing of inventory stock adjustments.
+
+Instead of updating the inventory for every adjustment, a StockAdjuster
+adds the deltas to a per-item total in memory and applies all of the
+totals at once with InventoryOperator.adjust() (one transaction, one
+UPDATE per UPDATE_BATCH_SIZE items). Many adjustments to the same item
+become a single row update, so far fewer row locks & WAL records are
+needed while the stock is changing quickly.
+
+A background thread flushes the pending deltas every 'interval_ms', or
+as soon as 'max_deltas' adjustments are pending. Pending deltas are only
+kept in the worker's memory, so the amounts read from the DB lag behind
+by up to one interval. Once 'max_pending' adjustments are pending (ex:
+the DB is slow or unavailable), adjust() rejects new adjustments with
+TooManyPending ("503 Service Unavailable") until a flush catches up, so
+the backlog can't grow without limit.
+
+Pending deltas are flushed when the worker shuts down (close() is called
+at exit). If a flush fails because of the DB (ex: it's unavailable), its
+deltas are kept and retried with the next flush. If it fails because of
+the deltas (ex: an amount out of the INTEGER range), each item is applied
+on its own, and only the items that fail are dropped (counted as
+'failed'), so one bad item can't hold back the others.
+'''
+import atexit
+import os
+import threading
+import time
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from potion_shop.database.inventory import InventoryOperator
+from potion_shop.database.logging.manager import get_logger
+from potion_shop.utils.exceptions import InvalidDatabaseOperation
+from potion_shop.utils.exceptions import TooManyPending
+
+# defaults if not set in the 'write_behind' config
+FLUSH_INTERVAL_MS = 200
+MAX_DELTAS = 1000
+
+def _bad_deltas(error:InvalidDatabaseOperation) -> bool:
+    # the DB rejected the deltas themselves, so retrying them can't succeed
+    return isinstance(error.__cause__, (DataError, IntegrityError))
+
+class StockAdjuster:
+    def __init__(self, engine, interval_ms:int = FLUSH_INTERVAL_MS, max_deltas:int = MAX_DELTAS,
+                 max_pending:int = None):
+        self._db = engine
+        self._interval = interval_ms / 1000
+        self._max_deltas = max_deltas
+        self._max_pending = max_pending or 10 * max_deltas
+
+        # inventory id -> total delta, and the number of adjustments in it
+        self._pending = {}
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        # only one flush runs at a time
+        self._flush_lock = threading.Lock()
+
+        # the flush thread is started by the first adjustment, since
+        # threads don't survive the fork into the gunicorn workers
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.flushes = 0
+        self.flushed_deltas = 0
+        self.rows_updated = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_flush_ms = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='stock-adjuster', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self.flush()
+            # the flush thread's session isn't reused between flushes
+            self._db.session.remove()
+
+    def adjust(self, deltas:dict):
+        ''' adds the deltas ({inventory id: delta}) to the pending deltas '''
+        if self._closed:
+            raise InvalidDatabaseOperation('Stock adjustments are shut down')
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+
+        with self._lock:
+            if self._pending_count >= self._max_pending:
+                # the flush thread is falling behind (or the DB is unavailable)
+                self.rejected += 1
+                self._wake.set()
+                raise TooManyPending(f'{self._pending_count} stock adjustments are pending, try again later')
+            self._add(deltas, len(deltas))
+            pending_count = self._pending_count
+
+        if pending_count >= self._max_deltas:
+            self._wake.set()
+
+    def _add(self, deltas:dict, count:int):
+        # call while holding self._lock
+        for id, delta in deltas.items():
+            self._pending[id] = self._pending.get(id, 0) + delta
+        self._pending_count += count
+
+    def flush(self) -> int:
+        '''
+        applies all pending deltas in one transaction.
+        returns the number of inventory rows updated
+        '''
+        with self._flush_lock:
+            with self._lock:
+                pending, count = self._pending, self._pending_count
+                self._pending, self._pending_count = {}, 0
+            if not pending:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                updated = InventoryOperator(self._db.session).adjust(pending)
+                failed, kept = [], {}
+            except InvalidDatabaseOperation as e:
+                if not _bad_deltas(e):
+                    # keep the deltas to retry with the next flush
+                    with self._lock:
+                        self._add(pending, count)
+                    self.errors += 1
+                    get_logger().exception('Stock adjustment flush failed')
+                    return 0
+                updated, failed, kept = self._flush_each(pending)
+
+            self.flushes += 1
+            self.flushed_deltas += count - len(kept)
+            self.rows_updated += len(updated)
+            self.failed += len(failed)
+            # deltas for items that don't exist (anymore) are dropped
+            applied = len([id for id, delta in pending.items() if delta and id not in kept])
+            self.dropped += applied - len(updated) - len(failed)
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 3)
+            return len(updated)
+
+    def _flush_each(self, pending:dict) -> (list, list, dict):
+        '''
+        applies each item's delta on its own, after the deltas failed together.
+        returns the ids updated, the ids whose deltas failed (they're dropped),
+        and the deltas kept for the next flush if the DB failed part way
+        '''
+        updated, failed = [], []
+        items = sorted(pending.items())
+        for i, (id, delta) in enumerate(items):
+            try:
+                updated.extend(InventoryOperator(self._db.session).adjust({id: delta}))
+            except InvalidDatabaseOperation as e:
+                if _bad_deltas(e):
+                    failed.append(id)
+                    get_logger().error(f'Dropped stock adjustment of inventory item {id} ({delta:+}): {e.__cause__}')
+                    continue
+                kept = dict(items[i:])
+                with self._lock:
+                    self._add(kept, len(kept))
+                self.errors += 1
+                get_logger().exception('Stock adjustment flush failed')
+                return updated, failed, kept
+        return updated, failed, {}
+
+    def pending(self) -> dict:
+        ''' the pending deltas: {inventory id: delta} '''
+        with self._lock:
+            return dict(self._pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending_items, pending_deltas = len(self._pending), self._pending_count
+        return {
+            'pending_items': pending_items,
+            'pending_deltas': pending_deltas,
+            'interval_ms': self._interval * 1000,
+            'max_deltas': self._max_deltas,
+            'flushes': self.flushes,
+            'flushed_deltas': self.flushed_deltas,
+            'rows_updated': self.rows_updated,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'last_flush_ms': self.last_flush_ms
+        }
+
+    def close(self):
+        ''' stops the flush thread and flushes the pending deltas '''
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive() \
+                and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,30 @@
+'''
+Scopes the database sessions & statement timeout to each request.
+
+Before the responder runs, the statement timeout of the route is set for
+the thread (see database/statement_timeout.py): the route's timeout in
+'route_timeouts' ({route template: ms}, ex: '/v1/inventory/{obj_id:int}'),
+or the default timeout of the database if the route isn't listed.
+
+Once the response is ready, the thread's sessions are removed (see
+DatabaseManager.release), so no identity map or connection is kept by
+the worker thread between requests, and the timeout is reset.
+
+Streamed responses run their query on their own connection, which is
+released when the stream is closed (see resources/streaming.py).
+
+Must be the first middleware, so that its process_response runs last.
+'''
+from potion_shop.database.statement_timeout import set_statement_timeout
+
+class DBSessionMiddleware:
+    def __init__(self, manager, route_timeouts:dict = None):
+        self._db = manager
+        self._route_timeouts = {route: int(ms) for route, ms in (route_timeouts or {}).items()}
+
+    def process_resource(self, req, resp, resource, params):
+        set_statement_timeout(self._route_timeouts.get(req.uri_template))
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        self._db.release()
+        set_statement_timeout(None)
@@ -0,0 +1,47 @@
+'''
+Adds strong ETags to GET responses and answers conditional requests.
+
+The ETag is built from the versions of the tables the resource reads
+from (see database/versions.py), so it changes whenever one of those
+tables is changed through the API. If the request's If-None-Match
+header matches the current ETag, the request is answered with
+"304 Not Modified" before the responder runs (no rows are queried).
+
+Only resources with a 'cache_tables' attribute (the names of the
+tables their responses are read from) get ETags.
+
+The versions are those of the primary database, so responses read from
+a read replica (req.context.read_replica, see DatabaseManager.read) get
+no ETag: the replica may not have the latest changes yet, and the stale
+body would be tagged (and later confirmed by 304s) as up to date.
+'''
+import falcon
+
+from potion_shop.database.versions import table_versions
+
+class ETagMiddleware:
+    def __init__(self, versions=table_versions):
+        self._versions = versions
+
+    def process_resource(self, req, resp, resource, params):
+        tables = getattr(resource, 'cache_tables', None)
+        if not tables or req.method not in ('GET', 'HEAD'):
+            return
+
+        # read before the responder queries the tables, so a change made
+        # during the query can never be sent with an up-to-date ETag
+        etag = self._versions.etag(tables)
+        req.context.etag = etag
+
+        if_none_match = req.if_none_match
+        if if_none_match and ('*' in if_none_match or etag in if_none_match):
+            resp.etag = etag
+            resp.status = falcon.HTTP_NOT_MODIFIED
+            resp.complete = True # skip the responder
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        etag = req.context.get('etag')
+        if req.context.get('read_replica'):
+            return
+        if etag and req_succeeded and resp.status == falcon.HTTP_200:
+            resp.etag = etag
@@ -0,0 +1,105 @@
+'''
+Replays the stored response for requests that repeat an Idempotency-Key
+header, instead of running them again (see utils/idempotency.py).
+
+The key is scoped to the client (the subject of its token), the method
+& the route, and the request body must be the same as the first request
+with the key (or the request is answered with "422 Unprocessable
+Entity"). A request with a key that is still in flight waits for the
+first request to finish.
+
+Bodies that StreamHandler doesn't read (ex: bulk imports) are hashed
+while they're copied to a temporary file (spilled to disk past
+SPOOL_SIZE bytes), and the resource reads the copy.
+
+Responses to failed requests (other than 4xx errors) and streamed
+responses are not stored, so the request can be retried. Replayed
+responses have the header "Idempotent-Replayed: true".
+
+Must run after the StreamHandler middleware (to hash the request body)
+and after authentication (so unauthorized requests can't replay).
+'''
+import hashlib
+import tempfile
+
+import falcon
+
+from potion_shop.utils.idempotency import IdempotencyConflict
+
+MAX_KEY_LENGTH = 255
+
+# bytes of a streamed body kept in memory before it's spilled to disk
+SPOOL_SIZE = 1024 * 1024
+# bytes of a streamed body read at a time
+READ_SIZE = 64 * 1024
+
+class IdempotencyMiddleware:
+    def __init__(self, store, methods:[str] = ['POST']):
+        self._store = store
+        self._methods = {m.upper() for m in methods}
+
+    def process_resource(self, req, resp, resource, params):
+        key = req.get_header('Idempotency-Key')
+        if not key or resource is None or req.method not in self._methods:
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            raise falcon.HTTPBadRequest(
+                description=f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters')
+
+        key = (req.context.get('auth_subject') or '', req.method, req.path, key)
+        fingerprint = self._fingerprint(req)
+        try:
+            stored = self._store.claim(key, fingerprint)
+        except IdempotencyConflict as ic:
+            raise falcon.HTTPUnprocessableEntity(description=ic.message)
+
+        if stored is None:
+            # this request runs, and its response is stored
+            req.context.idempotency_key = key
+            return
+
+        resp.status, resp.content_type, resp.data = stored
+        resp.set_header('Idempotent-Replayed', 'true')
+        resp.complete = True # skip the responder
+
+    def _fingerprint(self, req) -> str:
+        body = req.context.get('body')
+        if body is not None or not req.content_length:
+            return hashlib.sha256(body or b'').hexdigest()
+
+        # not read by StreamHandler: hash the body as it's copied, and
+        # give the copy to the resource in place of the request stream
+        digest = hashlib.sha256()
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        remaining = req.content_length
+        while remaining > 0:
+            chunk = req.stream.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            spooled.write(chunk)
+            remaining -= len(chunk)
+        spooled.seek(0)
+        req.env['wsgi.input'] = req.stream = spooled
+        req.context.spooled_body = spooled
+        return digest.hexdigest()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        spooled = req.context.get('spooled_body')
+        if spooled is not None:
+            spooled.close()
+
+        key = req.context.get('idempotency_key')
+        if key is None:
+            return
+
+        # error responses are serialized into resp.body
+        data = resp.data if resp.data is not None \
+                else resp.body.encode('utf-8') if resp.body is not None \
+                else b''
+        # unhandled errors leave the status as it was (ex: 200)
+        stored = req_succeeded or resp.status.startswith('4')
+        if not stored or resp.stream is not None:
+            self._store.release(key)
+        else:
+            self._store.finish(key, resp.status, resp.content_type, data)
@@ -1,5 +1,8 @@
 '''
 middleware to log any failed request (error code >= 400)
+
+if a LogSampler is given, only the failures it samples are logged
+(see utils/log_sampling.py)
 '''
 import json
 import logging
@@ -9,9 +12,10 @@ import sqlalchemy
 from potion_shop.database.logging.manager import get_logger
 
 class LogHTTPErrors:
-    def __init__(self):
+    def __init__(self, sampler=None):
         # need to getLogger AFTER it has been configured
         self.logger = get_logger()
+        self._sampler = sampler
 
     def _get_json(self, body):
         if not body:
@@ -33,10 +37,21 @@ class LogHTTPErrors:
 
     def process_response(self, req, resp, resource, req_succeeded):
         if not req_succeeded:
-            req_body = self._get_json(req.context.body) if req.content_length else None
+            status = int(resp.status[:3])
+            skipped = 0
+            if self._sampler is not None:
+                skipped = self._sampler.sample(req.method, req.uri_template, status)
+                if skipped is None:
+                    return
+
+            # bodies of routes exempt from the StreamHandler aren't stored
+            req_body = self._get_json(req.context.get('body')) if req.content_length else None
             resp_body = self._get_json(resp.body)
 
-            self.logger.exception('Request Error', extra={
+            message = f'Request Error ({skipped} similar errors not logged)' if skipped else 'Request Error'
+            # only server errors keep the traceback
+            log = self.logger.exception if status >= 500 else self.logger.error
+            log(message, extra={
                 'request_route':f'{req.method} : {req.relative_uri}',
                 'request_headers':req.headers,
                 'request_body':req_body,
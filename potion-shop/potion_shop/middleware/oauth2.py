@@ -1,7 +1,6 @@
 from pathlib import Path
 
 import falcon
-import jwt
 
 '''
 A Falcon Middleware to validate OAuth2/JWT tokens passed in header
@@ -50,11 +49,17 @@ class OAuth2Middleware:
         token = self._decode_token(token)
         if not self._token_is_valid(token):
             raise falcon.HTTPUnauthorized(description='Invalid JWT Credentials')
+        # who sent the request (ex: to scope Idempotency-Keys per client)
+        req.context.auth_subject = token['sub']
 
     def _decode_token(self, token):
         '''
         Decodes token using RS256 and self._public_key
         '''
+        # jwt loads the crypto backend (cryptography) when it's imported,
+        # which slows down startup: it's only imported for the first token
+        import jwt
+
         options = {f'verify_{claim}': True for claim in self._verify_claims}
         options.update(
             {f'require_{claim}':True for claim in self._required_claims}
@@ -0,0 +1,52 @@
+'''
+Keeps read-your-writes requests on the primary database when read
+replicas are set up (see database/replicas.py).
+
+Every successful write (any method other than GET, HEAD or OPTIONS)
+sets a short-lived cookie with the time of the write. GET requests sent
+with that cookie, within 'window_seconds' of the write, are read from
+the primary instead of a replica that may not have the write yet.
+Clients that don't keep cookies can send the header
+"X-Read-Primary: true" instead.
+
+Resources read the decision from req.context.read_primary.
+'''
+import time
+
+import falcon
+
+# default if not set in the 'database' config
+READ_YOUR_WRITES_SECONDS = 5
+
+WRITE_COOKIE = 'potion_last_write'
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+class ReadRoutingMiddleware:
+    def __init__(self, window_seconds:float = READ_YOUR_WRITES_SECONDS):
+        self._window = window_seconds
+
+    def _recent_write(self, req) -> bool:
+        values = req.cookies.get(WRITE_COOKIE)
+        if not values:
+            return False
+        # falcon returns a list if the cookie is repeated
+        value = values[-1] if isinstance(values, list) else values
+        try:
+            return time.time() - float(value) <= self._window
+        except ValueError:
+            return False
+
+    def process_request(self, req, resp):
+        if req.method not in ('GET', 'HEAD'):
+            return
+        header = (req.get_header(READ_PRIMARY_HEADER) or '').lower()
+        req.context.read_primary = header in {'true', 't', 'yes', 'y', '1'} \
+                                   or self._recent_write(req)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        if req.method in ('GET', 'HEAD', 'OPTIONS') or not req_succeeded or resource is None:
+            return
+        # not a secret, and the API may be served over plain HTTP
+        resp.set_cookie(WRITE_COOKIE, f'{time.time():.3f}',
+                        max_age=max(int(self._window), 1), path='/',
+                        secure=False, http_only=True)
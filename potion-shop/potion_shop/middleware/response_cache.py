@@ -0,0 +1,66 @@
+'''
+Serves GET requests from a ResponseCache (see utils/cache.py), and
+invalidates the cache when a request changes a table.
+
+Only resources with a 'cache_tables' attribute are cached. It is the
+names of the tables the resource's responses are read from (and the
+tables that its POST/PUT/PATCH/DELETE requests change).
+
+The cache key is the route plus the (sorted) query parameters. Only
+successful (200) responses with a body in resp.data are stored, so
+streamed responses are never cached.
+
+Responses read from a read replica (req.context.read_replica, see
+DatabaseManager.read) are not stored: the versions are those of the
+primary, and a lagging replica's body would be served as up to date
+until it expires. Requests that must read their own writes from the
+primary database (req.context.read_primary, see ReadRoutingMiddleware)
+skip the cache.
+'''
+import falcon
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+class ResponseCacheMiddleware:
+    def __init__(self, cache):
+        self._cache = cache
+
+    def _get_key(self, req) -> tuple:
+        # falcon parses repeated/comma-separated values into lists
+        params = tuple(sorted(
+            (key, value if isinstance(value, str) else ','.join(value))
+            for key, value in req.params.items()
+        ))
+        return req.path, params
+
+    def process_resource(self, req, resp, resource, params):
+        tables = getattr(resource, 'cache_tables', None)
+        if not tables or req.method != 'GET' or req.context.get('read_primary'):
+            return
+
+        key = self._get_key(req)
+        cached = self._cache.get(key)
+        if cached:
+            resp.content_type, resp.data = cached
+            resp.set_header('X-Cache', 'HIT')
+            resp.complete = True # skip the responder
+        else:
+            # versions must be read before the responder queries the tables
+            req.context.cache_entry = (key, tables, self._cache.versions(tables))
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        if not req_succeeded or resource is None:
+            return
+
+        if req.method in WRITE_METHODS:
+            for table in getattr(resource, 'cache_tables', ()):
+                self._cache.invalidate(table)
+            return
+
+        entry = req.context.get('cache_entry')
+        if req.context.get('read_replica'):
+            return
+        if entry and resp.status == falcon.HTTP_200 and resp.data is not None:
+            key, tables, versions = entry
+            self._cache.set(key, tables, versions, resp.content_type, resp.data)
+            resp.set_header('X-Cache', 'MISS')
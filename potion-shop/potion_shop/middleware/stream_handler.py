@@ -3,8 +3,17 @@ Reads the body of all requests. Stores body into req.context.body
 Necessary for logging, so that request body can be duplicated to log.
 If it was just processed in the request, wouldn't be able to read again
 for the log because the stream.read operation had already run once.
+
+Any routes included in the optional 'exempt_routes' value in the
+constructor are not read, so that their resources can read large
+bodies from req.bounded_stream as they're processed.
 '''
 class StreamHandler:
+    def __init__(self, exempt_routes:[str] = []):
+        self._exempt_routes = {e.lower() for e in exempt_routes} # force all to lowercase
+
     def process_request(self, req, resp):
+        if req.path.lower() in self._exempt_routes:
+            return
         if req.content_length:
             req.context.body = req.stream.read(req.content_length)
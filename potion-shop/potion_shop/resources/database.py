@@ -1,107 +1,223 @@
+import base64
+import binascii
 import json
+from collections.abc import Iterable
 
 import falcon
 from sqlalchemy.exc import IntegrityError, DataError
 
-from potion_shop.database.operators import DBOperator, query_to_dict
+from potion_shop.database.operators import DBOperator
+from potion_shop.database.operators import ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE
+from potion_shop.database.serializer import dumps, serializer_for
+from potion_shop.resources.streaming import JSONResultStream
 from potion_shop.utils.exceptions import ContentFormatException
 from potion_shop.utils.exceptions import InvalidDatabaseOperation
 from potion_shop.utils.exceptions import ItemNotFound
 
+# page sizes used if not set in the 'pagination' config
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+ON_CONFLICT_MODES = {ON_CONFLICT_UPDATE, ON_CONFLICT_IGNORE}
+
 '''
 A resource for a SQLAlchemy table
 that only supports GET operations
+
+Lists are returned one page at a time. The 'next' value in the
+response is an opaque cursor: pass it back as '?cursor=' (with the
+same search parameters) to get the following page.
+
+With '?stream=true' the whole (filtered) list is sent instead, encoded
+in chunks while rows are read from a server-side cursor.
+
+With '?fields=id,amount' only the given columns are selected and
+returned (no ORM objects are created for the results).
 '''
 class ReadOnlyResource:
-    def __init__(self, engine, data_object):
+    def __init__(self, engine, data_object, pagination:dict = None):
         self._db = engine
         self._data_object = data_object
+        # tables the responses are read from (see ResponseCacheMiddleware)
+        self.cache_tables = (self._data_object.__tablename__,)
+
+        pagination = pagination or {}
+        self._max_page_size = int(pagination.get('max_page_size') or MAX_PAGE_SIZE)
+        self._default_page_size = min(
+            int(pagination.get('default_page_size') or DEFAULT_PAGE_SIZE),
+            self._max_page_size)
+        self._stream_batch_size = int(pagination.get('stream_batch_size') or STREAM_BATCH_SIZE)
 
         # supported query parameters (search table criteria):
-        # - limit (limits total number of results)
+        # - limit (number of results per page, capped at max_page_size)
+        # - cursor (the 'next' value returned with the previous page)
+        # - stream (true to stream all results instead of one page)
+        # - fields (comma-separated columns to return, default all)
         # - any table column name (partial search for all matches)
-        self._allowed_keys = {'limit'}
-        self._allowed_keys.update([ col.name.lower() for col in self._data_object.__table__.columns])
+        self._columns = [ col.name.lower() for col in self._data_object.__table__.columns]
+        self._allowed_keys = {'limit', 'cursor', 'stream', 'fields'}
+        self._allowed_keys.update(self._columns)
 
     def _get_table(self):
         # call this at the start of each request transaction
         # to create a session for the DB
         return DBOperator(self._db.session, self._data_object)
 
-    def _format_response(self, query_obj) -> str:
+    def _read(self, req, read):
+        '''
+        returns read(table), run on a read replica (if any are set up)
+        unless the request must read its own writes from the primary
+        (see ReadRoutingMiddleware)
+        '''
+        return self._db.read(lambda session: read(DBOperator(session, self._data_object)),
+                             primary=req.context.get('read_primary', False),
+                             context=req.context)
+
+    def _format_response(self, query_obj, fields:tuple = None, **extra) -> bytes:
         '''
         converts query result to JSON in the format
-            {'results:' [ query_results ]}
-        if no results found, returns: {'results': []}
+            {'results:' [ query_results ], **extra}
+        if no results found, returns: {'results': [], **extra}
+
+        if fields is given, query_obj is a list of result rows
+        with only those columns (see DBOperator.get_page)
         '''
         # uncomment this if you want no results to return "404 Not Found"
         # if query_obj is None:
         #     raise falcon.HTTPNotFound(description='No results found for given resource')
 
-        as_dict = query_to_dict(query_obj)
-        response = {'results': [as_dict] \
-                            if not isinstance(as_dict, list) \
-                            else as_dict}
+        if fields:
+            serializer = serializer_for(self._data_object, fields)
+            response = {'results': [serializer.row_to_json_dict(row) for row in query_obj]}
+        else:
+            serializer = serializer_for(self._data_object)
+            # a single ORM object or {column: value} dictionary
+            single = isinstance(query_obj, dict) or not isinstance(query_obj, Iterable)
+            rows = [query_obj] if single else query_obj
+            response = {'results': [serializer.mapping_to_json_dict(row) if isinstance(row, dict) \
+                                        else serializer.to_json_dict(row)
+                                    for row in rows]}
+        response.update(extra)
 
-        return json.dumps(response, default=str)
+        return dumps(response)
 
     def _send_response(self, resp, obj=None, status=falcon.HTTP_200):
         if obj:
-            resp.body = self._format_response(obj)
+            resp.data = self._format_response(obj)
         resp.status = status
 
+    def _send_page(self, resp, rows, next_id, fields:tuple = None):
+        next_cursor = self._encode_cursor(next_id) if next_id is not None else None
+        resp.data = self._format_response(rows, fields, next=next_cursor)
+        resp.status = falcon.HTTP_200
+
+    def _send_stream(self, resp, result):
+        serializer = serializer_for(self._data_object, tuple(result.keys()))
+        resp.content_type = falcon.MEDIA_JSON
+        resp.stream = JSONResultStream(result, serializer, self._stream_batch_size)
+        resp.status = falcon.HTTP_200
+
+    def _encode_cursor(self, last_id) -> str:
+        # the cursor is tied to the table so that a token from
+        # one route can't be replayed against another
+        raw = json.dumps([self._data_object.__tablename__, last_id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def _decode_cursor(self, cursor:str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+            table_name, last_id = json.loads(raw)
+        except (binascii.Error, UnicodeError, ValueError, TypeError):
+            raise falcon.HTTPBadRequest(description="Invalid value for 'cursor' parameter.")
+
+        if table_name != self._data_object.__tablename__ or not isinstance(last_id, int):
+            raise falcon.HTTPBadRequest(description="Invalid value for 'cursor' parameter.")
+        return last_id
+
+    def _get_page_size(self, limit_param, stream=False) -> int or None:
+        if limit_param is None:
+            # streams send every row unless a limit is given
+            return None if stream else self._default_page_size
+
+        # will raise ValueError if invalid limit_param
+        limit = int(limit_param)
+        if limit < 0:
+            raise ValueError(f'Invalid limit: {limit}')
+
+        # streamed results are not held in memory,
+        # so they are not capped at the max page size
+        return limit if stream else min(limit, self._max_page_size)
+
+    def _get_fields(self, fields_param) -> tuple or None:
+        if fields_param is None:
+            return None
+
+        # falcon splits comma-separated values into a list
+        # unless auto_parse_csv is turned off
+        if isinstance(fields_param, str):
+            fields_param = fields_param.split(',')
+
+        fields = []
+        for field in fields_param:
+            field = field.strip().lower()
+            if field and field not in fields:
+                fields.append(field)
+
+        unknown = set(fields) - set(self._columns)
+        if not fields or unknown:
+            raise falcon.HTTPBadRequest(description=f'Unsupported fields: {unknown or fields_param}')
+        return tuple(fields)
 
     # search the table for all matches to the search_params
     # search_params should be in the format of 'req.params'
-    #   (a dictionary of {column_name: search_value, limit: integer})
+    #   (a dictionary of {column_name: search_value})
     def _search_by(self, table:DBOperator, search_params:dict) -> 'query':
-        # important: order of operations
-        # - all filters
-        # - then limit results
-
-        # separate limit param to apply at the end
-        limit_param = search_params.pop('limit', None)
-
         # apply all filters (search column for value)
         obj = table.get_all()
         for param,value in search_params.items():
             obj = table.get_by_column(param, value, obj)
 
-        # apply limit if specified
-        if limit_param:
-            # will raise ValueError if invalid limit_param
-            obj = obj.limit(limit_param)
-
         return obj
 
     def on_get(self, req, resp):
-        table = self._get_table()
-        if req.params:
-            # allow search by query string (ex: /potions?type_id=2)
-            query_keys = set(req.params.keys())
-            if query_keys <= self._allowed_keys: # query_keys is subset of _allowed_keys
-                # we're good. only allowed keys in query parameters
-                try:
-                    obj = self._search_by(table, req.params)
-                    self._send_response(resp, obj)
-                # ItemNotFound only raised if column doesn't exist in database,
-                # which we already check for here with self._allowed_keys
-                # except ItemNotFound as inf:
-                #     raise falcon.HTTPNotFound(description=inf.message)
-                except (ValueError, DataError):
-                    raise falcon.HTTPBadRequest(description="Invalid value for 'limit' parameter.")
-            else:
-                raise falcon.HTTPBadRequest(description=f'Unsupported search parameters: {query_keys - self._allowed_keys}')
+        # allow search by query string (ex: /potions?type_id=2)
+        search_params = dict(req.params)
+        query_keys = set(search_params.keys())
+        if not query_keys <= self._allowed_keys: # query_keys must be subset of _allowed_keys
+            raise falcon.HTTPBadRequest(description=f'Unsupported search parameters: {query_keys - self._allowed_keys}')
 
-        # if no query parameters provided, return all
+        # separate paging params from the column filters
+        cursor = search_params.pop('cursor', None)
+        after = self._decode_cursor(cursor) if cursor else None
+        stream = search_params.pop('stream', 'false').lower() in {'true','t','yes','y','1'}
+        fields = self._get_fields(search_params.pop('fields', None))
+        try:
+            page_size = self._get_page_size(search_params.pop('limit', None), stream)
+        except ValueError:
+            raise falcon.HTTPBadRequest(description="Invalid value for 'limit' parameter.")
+
+        def search(table):
+            if stream:
+                obj = self._search_by(table, search_params)
+                return table.stream(obj, after, page_size, fields)
+            return table.get_page_by(search_params, page_size, after, fields)
+
+        try:
+            result = self._read(req, search)
+        except DataError:
+            # search value can't be compared to the column type
+            raise falcon.HTTPBadRequest(description='Invalid value for search parameters.')
+
+        if stream:
+            self._send_stream(resp, result)
         else:
-            self._send_response(resp, table.get_all())
+            rows, next_id = result
+            self._send_page(resp, rows, next_id, fields)
 
     def on_get_id(self, req, resp, obj_id):
-        table = self._get_table()
-
         try:
-            obj = table.get_by_id(obj_id)
+            obj = self._read(req, lambda table: table.get_by_id(obj_id))
             self._send_response(resp, obj)
         except ItemNotFound as inf:
             raise falcon.HTTPNotFound(description=inf.message)
@@ -112,13 +228,14 @@ A Basic resource for a SQLAlchemy table
 that extends ReadOnlyResource to support
 CRUD (Create Read Update Delete) operations:
     * GET and POST to the table
+    * PATCH to update many rows of the table at once
     * GET, PUT, DELETE by ID
     * GET by value in column
         - can search either for exact or partial matches
 '''
 class BasicResource(ReadOnlyResource):
-    def __init__(self, engine, data_object):
-        super().__init__(engine, data_object)
+    def __init__(self, engine, data_object, pagination:dict = None):
+        super().__init__(engine, data_object, pagination)
 
     def _load_req_stream(self, req) -> dict:
         try:
@@ -143,11 +260,46 @@ class BasicResource(ReadOnlyResource):
             raise falcon.HTTPBadRequest(title='Invalid Content',
                 description=cfe.message)
 
+    def on_patch(self, req, resp):
+        '''
+        updates many rows in one transaction. the body is either
+            - a list of updates: [{'id': 1, 'changes': {'price': 20}}, ...]
+            - changes for every row matching a filter (exact matches):
+                {'filter': {'potion_id': 3}, 'changes': {'price': 20}}
+        responds with the number of rows updated (and the ids not found)
+        '''
+        table = self._get_table()
+        raw = self._load_req_stream(req)
+
+        try:
+            if isinstance(raw, dict) and set(raw) == {'filter', 'changes'}:
+                result = table.update_where(raw['filter'], raw['changes'])
+            elif isinstance(raw, list):
+                result = table.update_many(raw)
+            else:
+                raise ContentFormatException(
+                    "Content must be a list of updates or a dict with 'filter' and 'changes'")
+        except ContentFormatException as cfe:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                description=cfe.message)
+        except InvalidDatabaseOperation as e:
+            raise falcon.HTTPBadRequest(title='Database Error',
+                description=e.message)
+
+        resp.data = dumps(result)
+        resp.status = falcon.HTTP_200
+
     def on_post(self, req, resp):
         table = self._get_table()
         raw = self._load_req_stream(req)
 
+        # '?on_conflict=update' or 'ignore' upserts rows on the table's unique column
+        on_conflict = req.get_param('on_conflict')
+        if on_conflict is not None and on_conflict not in ON_CONFLICT_MODES:
+            raise falcon.HTTPBadRequest(description="Invalid value for 'on_conflict' parameter.")
+
         # check for correct content format
+        # the whole batch is checked before anything is written to the DB
         try:
             if isinstance(raw, dict):
                 body = self._data_object(**raw)
@@ -156,18 +308,28 @@ class BasicResource(ReadOnlyResource):
             else:
                 raise falcon.HTTPBadRequest(title='Invalid Content',
                     description='Content must be of type dict or list')
+            table.validate(body if isinstance(body, list) else [body])
         except TypeError: # invalid number of args to data object constructor
             raise falcon.HTTPBadRequest(title='Invalid Content',
                     description='Content must match table layout')
+        except ContentFormatException as cfe:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                    description=cfe.message)
 
         # update the table
         try:
-            table.add(body)
-            self._send_response(resp, body, falcon.HTTP_201) # created
+            created = table.add(body, on_conflict=on_conflict)
         except (InvalidDatabaseOperation, ContentFormatException) as e:
             raise falcon.HTTPBadRequest(title='Database Error',
                 description=e.message)
 
+        if created or not on_conflict:
+            self._send_response(resp, created, falcon.HTTP_201) # created
+        else:
+            # every row was ignored
+            resp.data = self._format_response([])
+            resp.status = falcon.HTTP_200
+
     def on_delete_id(self, req, resp, obj_id):
         table = self._get_table()
         try:
@@ -0,0 +1,90 @@
+import codecs
+
+import falcon
+
+from potion_shop.database.importer import CSV, NDJSON
+from potion_shop.database.importer import IMPORT_BATCH_SIZE, MAX_REPORTED_ERRORS
+from potion_shop.database.importer import TableImporter
+from potion_shop.database.serializer import dumps
+from potion_shop.utils.exceptions import ContentFormatException
+from potion_shop.utils.exceptions import InvalidDatabaseOperation
+
+# number of bytes read from the request body at a time
+READ_SIZE = 64 * 1024
+
+# request content types for each supported import format
+CONTENT_TYPES = {
+    'text/csv': CSV,
+    'application/x-ndjson': NDJSON,
+    'application/jsonl': NDJSON
+}
+
+'''
+A resource to bulk import rows into a SQLAlchemy table
+(see database/importer.py)
+
+POST a CSV (with a header row of column names) or NDJSON
+(one JSON object per line) body, with the matching Content-Type.
+The body is read from the request as it's imported, so this route
+must be exempt from the StreamHandler middleware.
+
+Responds with a summary of the import, ex:
+    {
+        'rows': 3, 'inserted': 2, 'rejected': 1,
+        'batches': [{'batch': 1, 'rows': 3, 'inserted': 2, 'rejected': 1}],
+        'errors': [{'line': 3, 'error': 'potion_id does not exist in potions'}]
+    }
+'''
+class ImportResource:
+    def __init__(self, engine, data_object, imports:dict = None):
+        self._db = engine
+        self._data_object = data_object
+        # tables the import changes (see ResponseCacheMiddleware)
+        self.cache_tables = (self._data_object.__tablename__,)
+
+        imports = imports or {}
+        self._batch_size = int(imports.get('batch_size') or IMPORT_BATCH_SIZE)
+        self._max_errors = int(imports.get('max_errors') or MAX_REPORTED_ERRORS)
+
+    def _get_format(self, req) -> str:
+        content_type = (req.content_type or '').split(';')[0].strip().lower()
+        if content_type not in CONTENT_TYPES:
+            raise falcon.HTTPUnsupportedMediaType(
+                description=f'Content-Type must be one of: {", ".join(CONTENT_TYPES)}')
+        return CONTENT_TYPES[content_type]
+
+    def _lines(self, req):
+        # decode the body one line at a time as it's read. read in chunks
+        # since falcon's bounded_stream.readline() stops after one line.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+        for chunk in iter(lambda: req.bounded_stream.read(READ_SIZE), b''):
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            pending = lines.pop() # the last line may not be complete
+            for line in lines:
+                yield line + '\n'
+
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
+    def on_post(self, req, resp):
+        data_format = self._get_format(req)
+        importer = TableImporter(self._db.engine, self._data_object,
+                                 batch_size=self._batch_size,
+                                 max_errors=self._max_errors)
+
+        try:
+            summary = importer.run(self._lines(req), data_format)
+        except ContentFormatException as cfe:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                description=cfe.message)
+        except UnicodeDecodeError:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                description='Content must be UTF-8 encoded')
+        except InvalidDatabaseOperation as e:
+            raise falcon.HTTPBadRequest(title='Database Error',
+                description=e.message)
+
+        resp.data = dumps(summary)
+        resp.status = falcon.HTTP_200
@@ -0,0 +1,117 @@
+import json
+
+import falcon
+
+from potion_shop.database.inventory import InventoryOperator
+from potion_shop.database.models import PotionInventory
+from potion_shop.database.serializer import dumps, serializer_for
+from potion_shop.utils.exceptions import ContentFormatException
+from potion_shop.utils.exceptions import InvalidDatabaseOperation
+from potion_shop.utils.exceptions import ItemNotFound
+from potion_shop.utils.exceptions import OutOfStock
+from potion_shop.utils.exceptions import TooManyPending
+
+'''
+A resource to purchase potions from the inventory
+(see database/inventory.py)
+
+POST a list of the inventory items to purchase:
+    [{'id': 1, 'quantity': 2}, {'id': 4, 'quantity': 1}]
+The amount of every item is decremented in one transaction.
+Responds with the updated inventory items, or:
+    * 404 if any item doesn't exist
+    * 409 if any item doesn't have enough left
+in which case nothing is purchased.
+'''
+class PurchaseResource:
+    # tables the purchases change (see ResponseCacheMiddleware)
+    cache_tables = (PotionInventory.__tablename__,)
+
+    def __init__(self, engine):
+        self._db = engine
+
+    def on_post(self, req, resp):
+        try:
+            order = json.loads(req.context.body)
+        except (json.JSONDecodeError, AttributeError):
+            raise falcon.HTTPBadRequest(title='Invalid JSON',
+                                        description='Please provide valid JSON.')
+
+        inventory = InventoryOperator(self._db.session)
+        try:
+            purchased = inventory.purchase(order)
+        except ContentFormatException as cfe:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                description=cfe.message)
+        except ItemNotFound as inf:
+            raise falcon.HTTPNotFound(description=inf.message)
+        except OutOfStock as oos:
+            raise falcon.HTTPConflict(title='Out of Stock',
+                description=oos.message)
+        except InvalidDatabaseOperation as e:
+            raise falcon.HTTPBadRequest(title='Database Error',
+                description=e.message)
+
+        serializer = serializer_for(PotionInventory)
+        resp.data = dumps({'results': [serializer.mapping_to_json_dict(row) for row in purchased]})
+        resp.status = falcon.HTTP_200
+
+
+'''
+A resource to adjust the stock of many inventory items at once
+(restocks, corrections, ...). Adjustments don't check the stock:
+use the PurchaseResource to sell potions.
+
+POST a list of the deltas to add to each item's amount:
+    [{'id': 1, 'delta': 20}, {'id': 4, 'delta': -1}]
+
+If an adjuster is given (write-behind mode, see database/write_behind.py)
+the deltas are only added to the worker's pending deltas, and the
+response is "202 Accepted" (or "503 Service Unavailable" while too many
+deltas are pending). Otherwise they're applied immediately, and
+the response lists the number of items updated (and the ids not found).
+
+GET lists the pending deltas of the worker that handles the request.
+'''
+class StockAdjustmentResource:
+    def __init__(self, engine, adjuster=None):
+        self._db = engine
+        self._adjuster = adjuster
+
+    def on_get(self, req, resp):
+        pending = self._adjuster.pending() if self._adjuster else {}
+        resp.data = dumps({'pending': pending})
+        resp.status = falcon.HTTP_200
+
+    def on_post(self, req, resp):
+        try:
+            adjustments = json.loads(req.context.body)
+        except (json.JSONDecodeError, AttributeError):
+            raise falcon.HTTPBadRequest(title='Invalid JSON',
+                                        description='Please provide valid JSON.')
+
+        inventory = InventoryOperator(self._db.session)
+        try:
+            deltas = inventory.get_deltas(adjustments)
+            if self._adjuster:
+                self._adjuster.adjust(deltas)
+                resp.data = dumps({'pending': len(deltas)})
+                resp.status = falcon.HTTP_202
+                return
+
+            updated = set(inventory.adjust(deltas))
+        except ContentFormatException as cfe:
+            raise falcon.HTTPBadRequest(title='Invalid Content',
+                description=cfe.message)
+        except InvalidDatabaseOperation as e:
+            raise falcon.HTTPBadRequest(title='Database Error',
+                description=e.message)
+        except TooManyPending as e:
+            raise falcon.HTTPServiceUnavailable(title='Too Many Pending Adjustments',
+                description=e.message, retry_after=1)
+
+        resp.data = dumps({
+            'updated': len(updated),
+            'not_found': [id for id, delta in deltas.items() if delta and id not in updated]
+        })
+        resp.status = falcon.HTTP_200
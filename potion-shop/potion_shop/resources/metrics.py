@@ -0,0 +1,17 @@
+from potion_shop.database.serializer import dumps
+
+'''
+A read-only resource that reports the runtime counters of the
+worker that handles the request. Each gunicorn worker keeps its
+own counters, so requests may get different values.
+
+providers is a dictionary of {name: function}, where each function
+returns a dictionary of counters. the response is in the format:
+    {name: provider_counters}
+'''
+class MetricsResource:
+    def __init__(self, providers:dict):
+        self._providers = providers
+
+    def on_get(self, req, resp):
+        resp.data = dumps({name: provider() for name, provider in self._providers.items()})
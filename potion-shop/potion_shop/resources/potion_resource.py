@@ -1,53 +1,88 @@
-import json
 import falcon
 
 from potion_shop.database.models import Potions
 from potion_shop.database.models import PotionTypes
 from potion_shop.database.models import PotionPotency
-from potion_shop.database.operators import DBOperator
+from potion_shop.database.serializer import dumps
+from potion_shop.utils.exceptions import ItemNotFound
 
 class PotionResource:
+    # number of joined rows fetched from the DB cursor at a time
+    # when describing all potions
+    _BATCH_SIZE = 1000
+
+    # tables the responses are read from (see ResponseCacheMiddleware)
+    cache_tables = (
+        Potions.__tablename__,
+        PotionTypes.__tablename__,
+        PotionPotency.__tablename__
+    )
+
     def __init__(self, engine):
         self._db = engine
 
     def _send_response(self, resp, obj=None, status=falcon.HTTP_200):
         if obj:
-            resp.body = json.dumps(obj, default=str)
+            resp.data = dumps(obj)
         resp.status = status
 
-    def _get_potion_description(self, potion_id):
-        potion, potion_type, potency = self._db.session.query(Potions,PotionTypes,PotionPotency) \
-                .filter(Potions.id == potion_id) \
-                .filter(Potions.potency_id == PotionPotency.id) \
-                .filter(Potions.type_id == PotionTypes.id) \
-                .first()
+    def _read(self, req, read):
+        # on a read replica, unless the request must read its own writes
+        return self._db.read(read, primary=req.context.get('read_primary', False),
+                             context=req.context)
+
+    def _description_query(self, session):
+        '''
+        A single join over Potions/PotionTypes/PotionPotency that only
+        selects the columns needed to build a description, ordered by
+        the potion id. Rows are plain tuples (no ORM objects are built).
+        '''
+        return session.query(
+                    Potions.id,
+                    PotionTypes.color,
+                    PotionTypes.related_stat,
+                    PotionPotency.restores,
+                    PotionPotency.prefix) \
+                .join(PotionTypes, Potions.type_id == PotionTypes.id) \
+                .join(PotionPotency, Potions.potency_id == PotionPotency.id) \
+                .order_by(Potions.id)
 
+    @staticmethod
+    def _describe(row):
         # format the prefix for the potion description nicely
-        prefix = potency.prefix
+        prefix = row.prefix
         if not prefix:
             prefix = ''
-        elif not potency.prefix.endswith('-') and not potency.prefix.endswith(' '):
+        elif not prefix.endswith('-') and not prefix.endswith(' '):
             prefix += ' ' # add a trailing space
 
-        return f'The {potion_type.color} {prefix.title()}Potion restores {potency.restores * 100:.0f}% of the drinker\'s {potion_type.related_stat.title()}.'
+        return f'The {row.color} {prefix.title()}Potion restores {row.restores * 100:.0f}% of the drinker\'s {row.related_stat.title()}.'
+
+    def _get_potion_description(self, session, potion_id):
+        row = self._description_query(session) \
+                .filter(Potions.id == potion_id) \
+                .first()
+
+        if row is None:
+            raise ItemNotFound(message='Unable to find resource with given ID')
+
+        return self._describe(row)
 
     def on_get(self, req, resp):
-        descriptions = []
-        potions_op = DBOperator(self._db.session, Potions)
-        if potions_op.is_empty():
-            self._send_response(resp, descriptions)
+        # one query for every potion, streamed from the cursor in batches
+        # instead of looking up each potion's type & potency separately
+        def describe_all(session):
+            rows = self._description_query(session).yield_per(self._BATCH_SIZE)
+            return [self._describe(row) for row in rows]
 
-        # ids should be sequential, but any could be deleted
-        # so need to get the actual ids for all potions here.
-        potion_ids = [p.id for p in potions_op.get_all()]
-        for obj_id in potion_ids:
-            descriptions.append(self._get_potion_description(obj_id))
+        descriptions = self._read(req, describe_all)
 
         self._send_response(resp, descriptions)
 
     def on_get_id(self, req, resp, obj_id):
         try:
-            description = self._get_potion_description(obj_id)
+            description = self._read(req,
+                lambda session: self._get_potion_description(session, obj_id))
             self._send_response(resp, description)
-        except TypeError:
-            raise falcon.HTTPNotFound(description='Unable to find resource with given ID')
+        except ItemNotFound as inf:
+            raise falcon.HTTPNotFound(description=inf.message)
@@ -0,0 +1,42 @@
+'''
+An iterable to use as falcon's resp.stream for large query results.
+
+Rows are read from an open (server-side cursor) result in batches and
+encoded into a JSON array as the response is sent, so the full result
+is never held in memory at once. The response has the same layout as
+a regular list response:
+    {"results": [ query_results ]}
+
+The WSGI server calls close() when the response is finished (or the
+client disconnects), which releases the result's DB connection.
+'''
+from potion_shop.database.serializer import dumps
+
+class JSONResultStream:
+    def __init__(self, result, serializer, batch_size:int = 1000):
+        self._result = result
+        self._serializer = serializer
+        self._batch_size = batch_size
+
+    def __iter__(self):
+        try:
+            yield b'{"results": ['
+
+            separator = b''
+            while True:
+                rows = self._result.fetchmany(self._batch_size)
+                if not rows:
+                    break
+
+                # encode the whole batch at once, without the list's [ ]
+                chunk = dumps([self._serializer.row_to_json_dict(row) for row in rows])
+                yield separator + chunk[1:-1]
+                separator = b', '
+
+            yield b']}'
+        finally:
+            self.close()
+
+    def close(self):
+        # closing the result also closes the connection it was run on
+        self._result.close()
@@ -0,0 +1,50 @@
+import threading
+
+'''
+Serves the Swagger UI page & its static files with falcon_swagger_ui.
+
+falcon_swagger_ui (and jinja2, which renders the page) take longer to
+import than the rest of the API's startup, and are only needed when
+someone opens the UI. So the package is imported, and its resources are
+created, on the first request to the UI instead of when the application
+starts.
+
+Args:
+    swagger_uri:    route of the UI page (its files are under it)
+    api_url:        URL of the API specification shown by the UI
+    config:         [optional] Swagger UI settings (see register_swaggerui_app)
+'''
+class SwaggerUI:
+    def __init__(self, swagger_uri:str, api_url:str, config:dict = None):
+        self._swagger_uri = swagger_uri
+        self._api_url = api_url
+        self._config = config
+        self._page = None
+        self._files = None
+        self._lock = threading.Lock()
+
+    def register(self, app):
+        app.add_sink(self._on_get_file, r'%s/(?P<filepath>.*)\Z' % self._swagger_uri)
+        app.add_route(self._swagger_uri, self)
+
+    # register_swaggerui_app adds the resources to an app: they're
+    # collected here instead of the real app (already routed above)
+    def add_sink(self, sink, prefix):
+        self._files = sink
+
+    def add_route(self, uri_template, resource):
+        self._page = resource
+
+    def _load(self):
+        with self._lock:
+            if self._page is None:
+                from falcon_swagger_ui import register_swaggerui_app
+                register_swaggerui_app(self, self._swagger_uri, self._api_url, config=self._config)
+
+    def on_get(self, req, resp):
+        self._load()
+        self._page.on_get(req, resp)
+
+    def _on_get_file(self, req, resp, filepath):
+        self._load()
+        self._files(req, resp, filepath)
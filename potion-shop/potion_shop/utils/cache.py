@@ -0,0 +1,89 @@
+'''
+An in-memory (per-process) cache of encoded response bodies.
+
+Entries are evicted when the cache is full (least recently used first)
+and expire after a TTL. Each entry remembers the versions of the tables
+it was read from (see database/versions.py): once any of those tables
+changes, the entry is out of date and is treated as a miss. Since the
+versions are bumped by DBOperator writes and shared by all gunicorn
+workers, a write handled by one worker invalidates the matching entries
+in every worker.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+from potion_shop.database.versions import table_versions
+
+class ResponseCache:
+    def __init__(self, max_entries:int = 1024, ttl:float = 30, versions=table_versions):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._versions = versions
+
+        # key -> (expires_at, tables, table versions, content_type, data)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def versions(self, tables:tuple) -> tuple:
+        '''
+        current versions of the tables. read these BEFORE querying
+        the tables and pass them to set(), so that a change made
+        during the query can't be cached as up to date.
+        '''
+        return self._versions.get_all(tables)
+
+    def get(self, key) -> (str, bytes) or None:
+        ''' returns (content_type, data) or None if not cached '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, tables, versions, content_type, data = entry
+            if expires_at < time.monotonic() or versions != self._versions.get_all(tables):
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content_type, data
+
+    def set(self, key, tables:tuple, versions:tuple, content_type:str, data:bytes):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, tables, versions, content_type, data)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table:str):
+        '''
+        drops this worker's entries read from the table. (entries in
+        other workers are invalidated by the version bump of the write)
+        '''
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if table in entry[1]]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'ttl': self._ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,63 @@
+'''
+Cooperative (gevent) serving mode.
+
+With the sync worker, each gunicorn worker handles one request at a time
+and sits idle while it waits for the database. With the gevent worker
+('worker_class: gevent' in the 'gunicorn' config), each request runs in a
+greenlet: while one request waits for a query, the worker runs others,
+up to 'worker_connections' requests at a time.
+
+For that, the standard library must be patched before anything else is
+imported (sockets, threads, thread-locals & locks become cooperative),
+and psycopg2 must wait for the database through gevent instead of
+blocking the whole worker. patch() does both, and must be called before
+the application is imported (see __main__.py).
+
+Things to know in this mode:
+    - thread-locals are per greenlet, so every request still gets its
+      own scoped session & statement timeout
+    - the number of queries running at once is still limited by the
+      pool (pool_size + max_overflow), so a worker handling many
+      requests at a time needs a larger pool
+    - COPY isn't supported by cooperative psycopg2 connections, so
+      bulk imports load their batches with INSERT instead (see
+      database/importer.py)
+
+Requires gevent, which is only installed for this mode.
+'''
+
+def patch():
+    ''' makes the standard library & psycopg2 cooperative (gevent) '''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import psycopg2.extensions
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+
+def is_patched() -> bool:
+    ''' True if psycopg2 waits for the database cooperatively '''
+    try:
+        import psycopg2.extensions
+    except ImportError: # pragma: no cover
+        return False
+    return psycopg2.extensions.get_wait_callback() is not None
+
+def gevent_wait_callback(connection, timeout=None):
+    '''
+    waits for a psycopg2 connection in a gevent-friendly way
+    (see psycopg2.extensions.set_wait_callback)
+    '''
+    import psycopg2
+    import psycopg2.extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f'Bad result from poll: {state}')
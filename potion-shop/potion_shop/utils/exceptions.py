@@ -21,3 +21,18 @@ class InvalidDatabaseOperation(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(message)
+
+class OutOfStock(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+class TooManyPending(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+class InvalidConfiguration(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
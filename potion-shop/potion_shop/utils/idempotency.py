@@ -0,0 +1,131 @@
+'''
+An in-memory (per-process) store of the responses to requests sent
+with an Idempotency-Key header (see middleware/idempotency.py).
+
+Each gunicorn worker has its own store, so a retry answered by another
+worker would run the request again: it can only be used with a single
+worker ('store: memory' in the 'idempotency' config). The default store
+is shared by the workers in the database (see database/idempotency.py).
+
+Each key is claimed by the first request that uses it. Until that
+request finishes, the key is "in flight": requests with the same key
+wait for it (instead of running the request again), and then get the
+stored response. Completed entries expire after a TTL and are evicted
+when the store is full (least recently used first). In-flight keys are
+never evicted.
+
+The store also remembers a fingerprint of the request (ex: a hash of
+its body) so that a key can't be reused for a different request.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+class IdempotencyConflict(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+class _InFlight:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+
+class IdempotencyStore:
+    def __init__(self, max_entries:int = 10000, ttl:float = 86400, wait_timeout:float = 30):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._wait_timeout = wait_timeout
+
+        # key -> _InFlight, or (expires_at, fingerprint, status, content_type, data)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.replays = 0
+        self.waits = 0
+        self.evictions = 0
+
+    def claim(self, key, fingerprint) -> tuple or None:
+        '''
+        returns the stored (status, content_type, data) for the key, or
+        None if the key was claimed for this request (which must then call
+        finish() or release()). waits if a request with the key is in flight.
+
+        raises IdempotencyConflict if the key was used with a different
+        request, or if the request with the key is still in flight after
+        waiting wait_timeout seconds.
+        '''
+        waited = False
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if isinstance(entry, tuple) and entry[0] < time.monotonic():
+                    del self._entries[key] # expired
+                    entry = None
+
+                if entry is None:
+                    self._entries[key] = _InFlight(fingerprint)
+                    return None
+
+                if (entry.fingerprint if isinstance(entry, _InFlight) else entry[1]) != fingerprint:
+                    raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+
+                if isinstance(entry, tuple):
+                    self._entries.move_to_end(key)
+                    self.replays += 1
+                    return entry[2:]
+
+                if not waited:
+                    self.waits += 1
+                waited = True
+
+            # wait for the in-flight request outside of the lock. if it
+            # fails (released) the key can be claimed again by this one
+            if not entry.done.wait(self._wait_timeout):
+                raise IdempotencyConflict('A request with this Idempotency-Key is still in progress')
+
+    def finish(self, key, status:str, content_type:str, data:bytes):
+        ''' stores the response of the request that claimed the key '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if not isinstance(entry, _InFlight):
+                return
+
+            self._entries[key] = (time.monotonic() + self._ttl, entry.fingerprint, status, content_type, data)
+            self._entries.move_to_end(key)
+            self._evict()
+        entry.done.set()
+
+    def release(self, key):
+        ''' forgets a claimed key (the request failed and may be retried) '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if not isinstance(entry, _InFlight):
+                return
+            del self._entries[key]
+        entry.done.set()
+
+    def _evict(self):
+        # oldest completed entries first, in-flight entries are kept
+        if len(self._entries) <= self._max_entries:
+            return
+        for key in list(self._entries):
+            if len(self._entries) <= self._max_entries:
+                break
+            if isinstance(self._entries[key], tuple):
+                del self._entries[key]
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = sum(1 for entry in self._entries.values() if isinstance(entry, _InFlight))
+            return {
+                'store': 'memory',
+                'entries': len(self._entries),
+                'in_flight': in_flight,
+                'max_entries': self._max_entries,
+                'ttl': self._ttl,
+                'replays': self.replays,
+                'waits': self.waits,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,116 @@
+'''
+Sampling of failed request logs (see middleware/log_error.py), so a burst
+of errors (ex: a bot hammering a 404 or 401) doesn't write a log for
+every request.
+
+Each failed request is sampled by its method, route & status. The rate of
+a status is looked up by its code ('404'), then by its class ('4xx'),
+first in the route's own rates (by route template, ex:
+'/v1/inventory/{obj_id:int}') and then in the default rates. Statuses
+without a rate are always logged (rate 1).
+
+For a sampled status (rate below 1), the first failure of each window is
+logged, and the later ones only with a probability of rate. The failures
+that aren't logged are counted, and the count is added to the next log
+of the same method, route & status ("n similar errors not logged"), so
+a burst becomes a few counted logs per window.
+
+Requests that failed before being routed (ex: 401s, or 404s for unknown
+paths) have no route template, and are only sampled by their status.
+They can have any method, so methods other than METHODS are sampled
+together (as OTHER_METHOD).
+
+Once per window, the windows that ended a whole window ago (no failure
+of their kind since) are dropped. Their failures that weren't logged
+are only counted in stats() ('skipped_not_reported').
+'''
+import random
+import threading
+import time
+
+# methods sampled on their own
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+OTHER_METHOD = 'OTHER'
+
+class LogSampler:
+    def __init__(self, rates:dict = None, routes:dict = None, window_seconds:float = 60,
+                 random=random.random):
+        self._rates = {str(status).lower(): float(rate) for status, rate in (rates or {}).items()}
+        self._routes = {
+            route: {str(status).lower(): float(rate) for status, rate in route_rates.items()}
+            for route, route_rates in (routes or {}).items()
+        }
+        self._window = window_seconds
+        self._random = random
+
+        # (method, route, status) -> [window end, failures not logged]
+        self._windows = {}
+        self._next_prune = time.monotonic() + window_seconds
+        # failures not logged (yet) in self._windows, & in dropped windows
+        self._pending = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+        self.logged = 0
+        self.skipped = 0
+
+    def rate(self, status:int, route:str = None) -> float:
+        ''' the fraction of failures logged for the status of the route '''
+        code, status_class = str(status), f'{str(status)[0]}xx'
+        for rates in (self._routes.get(route) or {}, self._rates):
+            for key in (code, status_class):
+                if key in rates:
+                    return rates[key]
+        return 1.0
+
+    def sample(self, method:str, route:str, status:int) -> int or None:
+        '''
+        returns None if the failure shouldn't be logged. otherwise returns
+        the number of similar failures that weren't logged before it
+        '''
+        rate = self.rate(status, route)
+        if rate >= 1:
+            self.logged += 1
+            return 0
+
+        key = (method if method in METHODS else OTHER_METHOD, route, status)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+
+            window = self._windows.get(key)
+            if window is None or window[0] <= now:
+                # the first failure of a new window
+                skipped = window[1] if window else 0
+                self._windows[key] = [now + self._window, 0]
+            elif self._random() < rate:
+                skipped = window[1]
+                window[1] = 0
+            else:
+                window[1] += 1
+                self._pending += 1
+                self.skipped += 1
+                return None
+            self._pending -= skipped
+            self.logged += 1
+            return skipped
+
+    def _prune(self, now:float):
+        ''' drops the windows that ended a whole window ago (called with the lock held) '''
+        stale = [key for key, window in self._windows.items() if window[0] + self._window <= now]
+        for key in stale:
+            skipped = self._windows.pop(key)[1]
+            self._pending -= skipped
+            self._dropped += skipped
+        self._next_prune = now + self._window
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'logged': self.logged,
+                'skipped': self.skipped,
+                'skipped_not_reported': self._pending + self._dropped,
+                'windows': len(self._windows),
+                'window_seconds': self._window
+            }
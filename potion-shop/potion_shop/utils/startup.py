@@ -0,0 +1,35 @@
+'''
+Times the phases of starting the application (ex: connecting to the
+database, setting up logging, adding the routes) to find out what slows
+down the startup of new workers.
+
+The times are printed once the application is ready, and reported under
+'startup' at /v1/metrics.
+'''
+import time
+
+class StartupTimer:
+    def __init__(self):
+        # phase name -> milliseconds, in the order the phases ran
+        self._phases = {}
+        self._last = time.perf_counter()
+
+    def lap(self, name:str):
+        ''' records the time since the last lap (or since the timer was created) as the named phase '''
+        now = time.perf_counter()
+        self.record(name, now - self._last)
+        self._last = now
+
+    def record(self, name:str, seconds:float):
+        ''' adds a phase timed elsewhere (ex: before the application was created) '''
+        self._phases[name] = round(seconds * 1000, 2)
+
+    def total_ms(self) -> float:
+        return round(sum(self._phases.values()), 2)
+
+    def report(self) -> str:
+        phases = ', '.join(f'{name}: {ms} ms' for name, ms in self._phases.items())
+        return f'{self.total_ms()} ms ({phases})'
+
+    def stats(self) -> dict:
+        return {'total_ms': self.total_ms(), 'phases_ms': dict(self._phases)}
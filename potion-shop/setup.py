@@ -14,5 +14,9 @@ setup(
         'PyJWT==1.7.1',
         'PyYAML==5.1.2',
         'sqlalchemy==1.3.12'
-    ]
+    ],
+    extras_require={
+        # cooperative serving mode (gunicorn 'worker_class: gevent')
+        'gevent': ['gevent==20.9.0']
+    }
 )
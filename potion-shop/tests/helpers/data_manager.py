@@ -1,5 +1,6 @@
 from potion_shop.database.db_utils import DatabaseManager
 from potion_shop.database.flavors import PostgresServer
+from potion_shop.database.idempotency import IdempotencyKey
 from potion_shop.database.logging.models import Log
 from potion_shop.database.models import Potions
 from potion_shop.database.models import PotionTypes
@@ -34,11 +35,11 @@ Order matters because of foreign keys!
         DELETE FROM potion_types;
         DELETE FROM potion_potency;
 
-runtime_logs can be deleted at any time
+runtime_logs & idempotency_keys can be deleted at any time
 '''
 def delete_all():
     session = get_db_session()
-    delete_order = [PotionInventory, Potions, PotionTypes, PotionPotency, Log]
+    delete_order = [PotionInventory, Potions, PotionTypes, PotionPotency, Log, IdempotencyKey]
     for table in delete_order:
         session.execute(f'TRUNCATE TABLE "{table.__table__}" RESTART IDENTITY CASCADE;')
 
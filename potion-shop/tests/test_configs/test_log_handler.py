@@ -0,0 +1,95 @@
+import logging
+import time
+
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import get_db_session
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.logging.manager import SQLAlchemyHandler, flush_logs
+from potion_shop.database.logging.models import Log
+
+class Manager:
+    def __init__(self, session):
+        self.session = session
+        self.engine = session.get_bind()
+
+@pytest.fixture
+def session():
+    flush_logs() # logs of the earlier tests
+    session = get_db_session()
+    session.execute('TRUNCATE TABLE "runtime_logs" RESTART IDENTITY;')
+    yield session
+    session.remove()
+
+def _logger(handler):
+    logger = logging.getLogger('test_log_handler')
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel('INFO')
+    return logger
+
+def _count(session):
+    return session.query(Log).count()
+
+def test_logs_batched(session):
+    # a flush interval longer than the test
+    handler = SQLAlchemyHandler(Manager(session), batch_size=3, interval_ms=60000)
+    logger = _logger(handler)
+    for i in range(2):
+        logger.warning(f'log {i}', extra={'response_status': '404 Not Found'})
+
+    # logging doesn't wait for the database
+    assert _count(session) == 0
+    assert handler.stats()['pending'] == 2
+
+    # a full batch is written right away, at most 3 rows per INSERT
+    for i in range(2, 7):
+        logger.warning(f'log {i}')
+    handler.flush()
+    stats = handler.stats()
+    assert (stats['queued'], stats['written'], stats['pending']) == (7, 7, 0)
+    assert stats['batches'] >= 3
+    logs = session.query(Log).order_by(Log.log_id).all()
+    assert [log.msg for log in logs] == [f'log {i}' for i in range(7)]
+    assert logs[0].response_status == '404 Not Found'
+    handler.close()
+
+def test_full_queue_drops(session):
+    handler = SQLAlchemyHandler(Manager(session), queue_size=2, interval_ms=60000)
+    logger = _logger(handler)
+    for i in range(5):
+        logger.error(f'log {i}')
+
+    stats = handler.stats()
+    assert (stats['queued'], stats['dropped']) == (2, 3)
+    handler.close()
+    assert [log.msg for log in session.query(Log).order_by(Log.log_id)] == ['log 0', 'log 1']
+
+def test_written_in_background(session):
+    handler = SQLAlchemyHandler(Manager(session), interval_ms=20)
+    _logger(handler).error('background')
+
+    deadline = time.monotonic() + 5
+    while handler.stats()['written'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _count(session) == 1
+    handler.close()
+
+    # logs after close are dropped
+    _logger(handler).error('closed')
+    assert handler.stats()['dropped'] == 1
+
+def test_stop_flushes_logs(session, make_client):
+    cfg = get_config()
+    cfg.logging = dict(cfg.logging, interval_ms=60000)
+    api = PotionApplication(cfg)
+    client = make_client(api)
+    client.get('/v1/potions/99', as_response=True)
+    assert api.metrics['logging']()['pending'] == 2 # startup & request error
+
+    api.stop()
+    assert api.metrics['logging']()['written'] == 2
+    assert session.query(Log).filter(Log.response_status == '404 Not Found').count() == 1
@@ -7,8 +7,9 @@ from tests.helpers.data_manager import delete_all
 from potion_shop.application import PotionApplication
 from potion_shop.database.db_utils import DatabaseManager
 from potion_shop.database.flavors import PostgresServer
+from potion_shop.database.logging.manager import flush_logs
 from potion_shop.database.logging.models import Log
-from potion_shop.database.operators import DBOperator, query_to_dict
+from potion_shop.database.operators import DBOperator
 
 def _get_logger(config):
     # get db session from config
@@ -23,6 +24,8 @@ def _get_logger(config):
     session = manager.session
 
     # make sure we're starting with empty logging table
+    # (logs are written in the background: write the earlier tests' first)
+    flush_logs()
     session.execute('TRUNCATE TABLE "runtime_logs" RESTART IDENTITY;')
     logger = DBOperator(session, Log)
     assert logger.is_empty()
@@ -36,9 +39,8 @@ def _error_logged_to_db(make_client, api, logger):
     resp = client.get('/', as_response=True)
     assert resp.status_code == 404
 
-    all_logs = query_to_dict(logger.get_all())
-    if type(all_logs) != list:
-        all_logs = [all_logs]
+    flush_logs()
+    all_logs = [log.to_dict() for log in logger.get_all()]
 
     found = False
     for i in range(len(all_logs)):
@@ -79,12 +81,13 @@ def test_log_level_info(make_client):
     assert api.logging_level == 'INFO'
 
     # since level is 'info', should show startup INFO log
+    flush_logs()
     assert not logger.is_empty()
-    all_logs = query_to_dict(logger.get_all())
+    all_logs = [log.to_dict() for log in logger.get_all()]
 
-    assert type(all_logs) == dict
-    assert all_logs['msg'] == 'STARTUP: Logging configured successfully'
-    assert all_logs['level'] == 'INFO'
+    assert len(all_logs) == 1
+    assert all_logs[0]['msg'] == 'STARTUP: Logging configured successfully'
+    assert all_logs[0]['level'] == 'INFO'
 
     _error_logged_to_db(make_client, api, logger)
     delete_all()
@@ -0,0 +1,89 @@
+import pytest
+
+from sqlalchemy.pool import NullPool, QueuePool
+
+from tests.helpers.temp_application import client, get_config
+from potion_shop.application import PotionApplication
+from potion_shop.database.pool import PoolMonitor, pool_options
+from potion_shop.utils.exceptions import DatabaseConnectionError
+
+def test_pool_options():
+    options = pool_options({
+        'use': 'postgres',
+        'pool_size': '3',
+        'max_overflow': 2,
+        'pool_timeout': 5,
+        'pool_recycle': 60,
+        'pool_pre_ping': True
+    })
+    assert options == {
+        'poolclass': QueuePool,
+        'pool_size': 3,
+        'max_overflow': 2,
+        'pool_timeout': 5.0,
+        'pool_recycle': 60,
+        'pool_pre_ping': True
+    }
+
+    # SQLAlchemy's defaults are kept if not set
+    assert pool_options({}) == {'poolclass': QueuePool}
+    assert pool_options({'pool_class': 'null', 'pool_pre_ping': True}) == \
+        {'poolclass': NullPool, 'pool_pre_ping': True}
+
+@pytest.mark.parametrize('database', [
+    {'pool_class': 'threadlocal'},
+    {'pool_class': 'null', 'pool_size': 5},
+    {'pool_size': 'five'}
+])
+def test_invalid_pool_options(database):
+    with pytest.raises(DatabaseConnectionError):
+        pool_options(database)
+
+def test_pool_configured():
+    cfg = get_config()
+    cfg.database = dict(cfg.database, pool_size=2, max_overflow=1, pool_timeout=0.1)
+    api = PotionApplication(cfg)
+
+    pool = api.manager.engine.pool
+    assert isinstance(pool, QueuePool)
+    assert pool.size() == 2
+
+    connections = [api.manager.engine.connect() for i in range(3)]
+    stats = api.metrics['pool']()
+    assert stats['checked_out'] == 3
+    assert stats['overflow'] == 1
+    assert stats['max_connections'] == 3
+
+    # all connections are checked out: waits pool_timeout & fails
+    with pytest.raises(Exception):
+        api.manager.engine.connect()
+    for connection in connections:
+        connection.close()
+
+    stats = api.metrics['pool']()
+    assert stats['checked_out'] == 0
+    assert stats['timeouts'] == 1
+    assert stats['checkouts'] >= 3
+    assert stats['wait_histogram']['<=500ms'] >= 1
+    api.manager.engine.dispose()
+
+def test_pool_metrics(client):
+    client.get('/v1/potions')
+    stats = client.get('/v1/metrics')['pool']
+    assert stats['pool_class'] == 'QueuePool'
+    assert stats['size'] == 5
+    assert stats['connects'] >= 1
+    assert stats['checkouts'] >= 1
+    assert sum(stats['wait_histogram'].values()) == stats['checkouts'] + stats['timeouts']
+
+def test_wait_histogram():
+    monitor = PoolMonitor()
+    for seconds in [0.0005, 0.003, 0.003, 2, 10]:
+        monitor.record_wait(seconds)
+
+    histogram = monitor.histogram()
+    assert histogram['<=1ms'] == 1
+    assert histogram['<=5ms'] == 2
+    assert histogram['<=5000ms'] == 1
+    assert histogram['>5000ms'] == 1
+    assert sum(histogram.values()) == 5
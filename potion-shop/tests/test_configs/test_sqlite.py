@@ -0,0 +1,217 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.flavors import SqliteServer, in_memory
+from potion_shop.database.logging.manager import flush_logs
+from potion_shop.database.logging.models import Log
+from potion_shop.utils.exceptions import DatabaseConnectionError
+
+valid_token = {'Authorization': create_token(token)}
+CSV = dict(valid_token, **{'Content-Type': 'text/csv'})
+
+POTION_TYPE = '/v1/potions/types'
+POTENCY     = '/v1/potions/potency'
+POTIONS     = '/v1/potions'
+INVENTORY   = '/v1/inventory'
+
+def sqlite_api(path):
+    cfg = get_config()
+    cfg.database = dict(cfg.database, use='sqlite', path=path)
+    return PotionApplication(cfg)
+
+@pytest.fixture(params=['memory', 'file'])
+def api(request, tmp_path):
+    path = SqliteServer.MEMORY if request.param == 'memory' else str(tmp_path / 'potion_shop.db')
+    api = sqlite_api(path)
+    yield api
+    api.stop()
+
+def populate(client):
+    client.post(POTION_TYPE, headers=valid_token, json=[
+        {'related_stat': 'Health', 'color': 'red'},
+        {'related_stat': 'Mana', 'color': 'blue'}
+    ])
+    client.post(POTENCY, headers=valid_token, json=[
+        {'restores': 0.25, 'prefix': None},
+        {'restores': 1.00, 'prefix': 'Full'}
+    ])
+    client.post(POTIONS, headers=valid_token, json=[
+        {'type_id': type_id, 'potency_id': potency_id}
+        for type_id in (1, 2) for potency_id in (1, 2)
+    ])
+    client.post(INVENTORY, headers=valid_token, json=[
+        {'potion_id': i + 1, 'price': 15, 'amount': 10} for i in range(4)
+    ])
+
+def test_sqlite_connection_string():
+    assert SqliteServer().connection_string == 'sqlite://'
+    assert SqliteServer('./potion_shop.db').connection_string == 'sqlite:///./potion_shop.db'
+
+def test_sqlite_memory_pool():
+    database = {'pool_class': 'queue', 'pool_size': 5, 'pool_recycle': 1800, 'pool_pre_ping': True}
+    # one connection, never recycled
+    assert SqliteServer().pool(database) == {'pool_class': 'serialized', 'pool_pre_ping': True}
+    assert SqliteServer('./potion_shop.db').pool(database) == database
+
+def test_sqlite_settings(api):
+    session = api.manager.session
+    assert session.execute('PRAGMA foreign_keys').scalar() == 1
+    expected = 'memory' if in_memory(api.manager.engine) else 'wal'
+    assert session.execute('PRAGMA journal_mode').scalar() == expected
+    session.remove()
+
+def test_sqlite_worker_start(api, make_client):
+    client = make_client(api)
+    populate(client)
+    # a new worker keeps the data (even of an in-memory database)
+    api.start()
+    assert len(client.get(INVENTORY)['results']) == 4
+
+def test_sqlite_crud(api, make_client):
+    client = make_client(api)
+    populate(client)
+
+    assert len(client.get(f'{INVENTORY}?limit=2')['results']) == 2
+    assert client.get(f'{POTION_TYPE}?color=blue')['results'] == [
+        {'id': 2, 'related_stat': 'Mana', 'color': 'blue'}
+    ]
+    client.put(f'{INVENTORY}/1', headers=valid_token, json={'price': 20})
+    assert client.get(f'{INVENTORY}/1')['results'][0]['price'] == 20
+
+    result = client.patch(INVENTORY, headers=valid_token, json=[
+        {'id': 2, 'changes': {'amount': 3}},
+        {'id': 99, 'changes': {'amount': 3}}
+    ])
+    assert result == {'updated': 1, 'not_found': [99]}
+
+    client.delete(f'{INVENTORY}/4', headers=valid_token)
+    response = client.get(f'{INVENTORY}/4', as_response=True)
+    assert response.status_code == 404
+
+    # foreign keys are enforced
+    response = client.post(INVENTORY, headers=valid_token, as_response=True,
+                           json={'potion_id': 99, 'price': 1, 'amount': 1})
+    assert response.status_code == 400
+
+def test_sqlite_purchase_and_describe(api, make_client):
+    client = make_client(api)
+    populate(client)
+
+    purchased = client.post(f'{INVENTORY}/purchase', headers=valid_token,
+                            json=[{'id': 1, 'quantity': 4}])['results']
+    assert [(item['id'], item['amount']) for item in purchased] == [(1, 6)]
+    response = client.post(f'{INVENTORY}/purchase', headers=valid_token, as_response=True,
+                           json=[{'id': 1, 'quantity': 7}])
+    assert response.status_code == 409
+
+    assert client.get('/v1/potions/describe/4') == 'The blue Full Potion restores 100% of the drinker\'s Mana.'
+
+def test_sqlite_import(api, make_client):
+    client = make_client(api)
+    populate(client)
+
+    rows = ['potion_id,price,amount,on_sale'] + [f'{i % 4 + 1},20,5,true' for i in range(7)] + ['99,1,1,true']
+    summary = client.post(f'{INVENTORY}/import', headers=CSV, body='\n'.join(rows))
+    assert summary['inserted'] == 7
+    assert summary['errors'] == [{'line': 9, 'error': 'potion_id does not exist in potions'}]
+
+    # unique values already in the table, or repeated, are rejected
+    rows = ['related_stat,color', 'Stamina,green', 'Mana,red', 'Stamina,green']
+    summary = client.post(f'{POTION_TYPE}/import', headers=CSV, body='\n'.join(rows))
+    assert summary['inserted'] == 1
+    assert [error['line'] for error in summary['errors']] == [3, 4]
+    assert len(client.get(f'{INVENTORY}?limit=100')['results']) == 11
+
+def test_sqlite_logs(api, make_client):
+    client = make_client(api)
+    client.get(f'{POTIONS}/99', as_response=True)
+    flush_logs()
+
+    session = api.manager.session
+    log = session.query(Log).filter(Log.response_status.like('404%')).one()
+    assert log.request_route == f'GET : {POTIONS}/99'
+    assert isinstance(log.request_headers, dict)
+    assert log.response_body['title'] == '404 Not Found'
+    session.remove()
+
+def test_sqlite_memory_concurrent(make_client):
+    api = sqlite_api(SqliteServer.MEMORY)
+    client = make_client(api)
+
+    # requests of a gthread/gevent worker share the in-memory connection
+    def requests(i):
+        statuses = []
+        for j in range(20):
+            statuses.append(client.post(POTION_TYPE, headers=valid_token, as_response=True,
+                                        json={'related_stat': f'Stat {i}-{j}', 'color': f'color {i}-{j}'}).status_code)
+            statuses.append(client.get(f'{POTIONS}/99', as_response=True).status_code)
+        return statuses
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(requests, range(8)))
+
+    assert results == [[201, 404] * 20] * 8
+    assert len(client.get(f'{POTION_TYPE}?limit=1000')['results']) == 160
+    flush_logs()
+    session = api.manager.session
+    assert session.query(Log).filter(Log.response_status.like('404%')).count() == 160
+    session.remove()
+    api.stop()
+
+def test_sqlite_memory_one_thread_at_a_time():
+    api = sqlite_api(SqliteServer.MEMORY)
+    engine = api.manager.engine
+    events = []
+
+    def use_connection():
+        engine.connect().close()
+        events.append('other thread')
+
+    thread = threading.Thread(target=use_connection)
+    with engine.connect():
+        thread.start()
+        # the other thread waits until the connection is returned
+        thread.join(0.2)
+        events.append('returned')
+    thread.join(5)
+    assert events == ['returned', 'other thread']
+    api.stop()
+
+def test_sqlite_memory_nested_checkout():
+    api = sqlite_api(SqliteServer.MEMORY)
+    engine = api.manager.engine
+    events = []
+
+    def read_types():
+        with engine.connect() as connection:
+            events.append(connection.execute("SELECT color FROM potion_types").fetchall())
+
+    thread = threading.Thread(target=read_types)
+    with engine.connect() as outer:
+        transaction = outer.begin()
+        outer.execute("INSERT INTO potion_types (related_stat, color) VALUES ('Health', 'red')")
+        # ex: the log writer, inside a request's transaction
+        with engine.begin() as nested:
+            assert nested.connection.connection is outer.connection.connection
+            nested.execute("SELECT 1")
+
+        # returning the nested checkout doesn't let the other thread in
+        thread.start()
+        thread.join(0.2)
+        assert events == []
+        transaction.commit()
+    thread.join(5)
+    assert events == [[('red',)]]
+    api.stop()
+
+def test_sqlite_without_replicas():
+    cfg = get_config()
+    cfg.database = dict(cfg.database, use='sqlite', replicas=[{'server': 'replica'}])
+    with pytest.raises(DatabaseConnectionError):
+        PotionApplication(cfg)
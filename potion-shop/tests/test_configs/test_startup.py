@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from tests.helpers.temp_application import client, get_config
+
+from potion_shop.application import PotionApplication
+
+ROOT = Path(__file__).resolve().parents[3]
+
+# run in a new process: the tests have already imported everything
+LAZY_IMPORTS = '''
+import sys
+from falcon import testing
+from tests.helpers.temp_application import get_config
+from potion_shop.application import PotionApplication
+
+client = testing.TestClient(PotionApplication(get_config()))
+client.simulate_get('/v1/potions')
+print('IMPORTED', 'jwt' in sys.modules, 'falcon_swagger_ui' in sys.modules)
+assert client.simulate_get('/swagger').status_code == 200
+assert client.simulate_get('/swagger/swagger-ui.css').status_code == 200
+client.simulate_post('/v1/potions', headers={'Authorization': 'Bearer x'})
+print('IMPORTED', 'jwt' in sys.modules, 'falcon_swagger_ui' in sys.modules)
+'''
+
+def _run(*args):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True,
+                          timeout=60, env={'PYTHONPATH': ':'.join(sys.path)})
+
+def test_startup_metrics(client):
+    startup = client.get('/v1/metrics')['startup']
+    assert list(startup['phases_ms']) == ['database', 'logging', 'middleware', 'routes']
+    assert startup['total_ms'] == round(sum(startup['phases_ms'].values()), 2)
+
+def test_worker_start_timed():
+    api = PotionApplication(get_config())
+    api.start()
+    assert 'worker_warm_up' in api.startup.stats()['phases_ms']
+    api.stop()
+
+def test_skip_schema_check(monkeypatch):
+    def create_schema(engine):
+        raise AssertionError('the schema was checked')
+    monkeypatch.setattr('potion_shop.database.db_utils.create_schema', create_schema)
+
+    cfg = get_config()
+    cfg.database = dict(cfg.database, schema_check=False)
+    api = PotionApplication(cfg)
+    api.stop()
+
+def test_lazy_imports():
+    result = _run('-c', LAZY_IMPORTS)
+    assert result.returncode == 0, result.stderr
+    # swagger UI & jwt are only imported once they're used
+    imported = [line for line in result.stdout.splitlines() if line.startswith('IMPORTED')]
+    assert imported == ['IMPORTED False False', 'IMPORTED True True']
+
+def test_migrate_once():
+    result = _run('-m', 'potion_shop', '--migrate')
+    assert result.returncode == 0, result.stderr
+    assert 'Connected!' in result.stdout
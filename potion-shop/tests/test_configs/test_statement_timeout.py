@@ -0,0 +1,63 @@
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import get_config
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.serializer import dumps
+
+'''
+test-only resources that run queries on the application's session
+'''
+class TimeoutResource:
+    def __init__(self, manager):
+        self._db = manager
+
+    def on_get(self, req, resp, obj_id=None):
+        timeout = self._db.session.execute('SHOW statement_timeout').scalar()
+        resp.data = dumps({'timeout': timeout})
+
+class SleepResource:
+    def __init__(self, manager):
+        self._db = manager
+
+    def on_get(self, req, resp):
+        self._db.session.execute('SELECT pg_sleep(1)')
+
+@pytest.fixture
+def api():
+    cfg = get_config()
+    cfg.database = dict(cfg.database, statement_timeout_ms=20000, route_statement_timeouts_ms={
+        '/v1/test/timeout/{obj_id:int}': 50,
+        '/v1/test/sleep': 50
+    })
+    api = PotionApplication(cfg)
+    api.add_route('/v1/test/timeout', TimeoutResource(api.manager))
+    api.add_route('/v1/test/timeout/{obj_id:int}', TimeoutResource(api.manager))
+    api.add_route('/v1/test/sleep', SleepResource(api.manager))
+    return api
+
+def test_route_timeouts(api, make_client):
+    client = make_client(api)
+    assert client.get('/v1/test/timeout') == {'timeout': '20s'}
+    assert client.get('/v1/test/timeout/1') == {'timeout': '50ms'}
+    # the pooled connection is set back to the default
+    assert client.get('/v1/test/timeout') == {'timeout': '20s'}
+
+def test_slow_query_canceled(api, make_client):
+    client = make_client(api)
+    resp = client.get('/v1/test/sleep', as_response=True)
+    assert resp.status_code == 503
+    assert resp.json['title'] == 'Query Timeout'
+
+    # the connection can be used again
+    assert client.get('/v1/test/timeout') == {'timeout': '20s'}
+    assert api.manager.pool_monitor.stats()['checked_out'] == 0
+
+def test_session_released(api, make_client):
+    client = make_client(api)
+    client.get('/v1/potions')
+    client.get('/v1/test/timeout')
+    # no session (identity map or connection) is kept between requests
+    assert not api.manager.session.registry.has()
+    assert api.manager.pool_monitor.stats()['checked_out'] == 0
@@ -0,0 +1,71 @@
+import os
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.query_cache import query_cache
+
+def test_start_warms_worker():
+    cfg = get_config()
+    cfg.database = dict(cfg.database, pool_warm_connections=3)
+    api = PotionApplication(cfg)
+
+    connects = api.manager.pool_monitor.stats()['connects']
+    # as gunicorn does: the master closes its connections, then the worker starts
+    api.before_fork()
+    api.start()
+    stats = api.manager.pool_monitor.stats()
+    # new connections, kept open in the pool
+    assert stats['connects'] >= connects + 3
+    assert stats['checked_in'] >= 3
+    assert stats['checked_out'] == 0
+    # the first page & get by id of each table are compiled
+    assert query_cache.stats()['shapes'] >= 8
+    api.stop()
+
+def test_worker_discards_inherited_connections(monkeypatch):
+    api = PotionApplication(get_config())
+    engine = api.manager.engine
+    api.before_fork()
+    with engine.connect() as connection:
+        inherited = connection.connection.connection
+
+    # the forked worker (another process) checks out the master's connection
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'getpid', lambda: -1)
+        with engine.connect() as connection:
+            assert connection.connection.connection is not inherited
+            assert connection.scalar('SELECT 1') == 1
+    assert api.manager.fork_guard.stats() == {'inherited': 1}
+
+    # which is left open for the master
+    assert not inherited.closed
+    cursor = inherited.cursor()
+    cursor.execute('SELECT 1')
+    assert cursor.fetchone() == (1,)
+    api.stop()
+
+def test_start_without_db(monkeypatch):
+    api = PotionApplication(get_config())
+    def warm(connections):
+        raise ConnectionError('the DB went away')
+    monkeypatch.setattr(api.manager, 'warm', warm)
+    api.start() # logs the error instead of killing the worker
+
+def test_stop_flushes_adjustments():
+    prepopulate()
+    cfg = get_config()
+    # a flush interval longer than the test
+    cfg.write_behind = dict(cfg.write_behind, enabled=True, interval_ms=60000)
+    api = PotionApplication(cfg)
+    api.start()
+
+    api.stock_adjuster.adjust({1: 5, 2: -1})
+    assert api.stock_adjuster.stats()['pending_deltas'] == 2
+    api.stop()
+    assert api.stock_adjuster.stats()['pending_deltas'] == 0
+    assert api.stock_adjuster.stats()['rows_updated'] == 2
+    assert api.manager.pool_monitor.stats()['checked_in'] == 0
+    delete_all()
@@ -191,3 +191,134 @@ def test_crud(client):
     value_equals(POTION_TYPE, EMPTY)
     value_equals(POTENCY, EMPTY)
     value_equals(INVENTORY, EMPTY)
+
+def test_post_bulk(client):
+    delete_all()
+    potion_types = [{'related_stat': f'Stat {i}', 'color': f'color {i}'} for i in range(2500)]
+
+    # inserted in several batches, all returned in order with their new ids
+    response = client.post(POTION_TYPE, headers=valid_token, json=potion_types)
+    assert len(response['results']) == len(potion_types)
+    for i, result in enumerate(response['results']):
+        assert result == dict(potion_types[i], id=i+1)
+
+    resp = client.get(f'{POTION_TYPE}?stream=true')
+    assert len(resp['results']) == len(potion_types)
+    delete_all()
+
+def test_post_bulk_validated_first(client):
+    delete_all()
+    # the invalid last item is found before anything is inserted
+    response = client.post(POTION_TYPE, headers=valid_token, json=[
+        {'related_stat': 'Health',  'color':'red'},
+        {'related_stat': 'Mana',    'color':'blue'},
+        {'related_stat': 'Stamina', 'color':3}
+    ], as_response=True)
+    assert response.status_code == 400
+    assert response.json['description'] == 'Item 2: color must be of type str'
+
+    # a DB error in any item inserts none of them
+    response = client.post(POTION_TYPE, headers=valid_token, json=[
+        {'related_stat': 'Health',  'color':'red'},
+        {'related_stat': 'Mana',    'color':'red'}
+    ], as_response=True)
+    assert response.status_code == 400
+
+    assert client.get(POTION_TYPE)['results'] == EMPTY
+
+def test_patch_many(client):
+    prepopulate()
+    updates = [{'id': i, 'changes': {'price': 20 + i}} for i in range(1, 6)]
+    updates += [
+        {'id': 6, 'changes': {'amount': 0, 'on_sale': True}},
+        {'id': 7, 'changes': {'on_sale': True, 'amount': 1}},
+        {'id': 99, 'changes': {'price': 1}}
+    ]
+    result = client.patch(INVENTORY, headers=valid_token, json=updates)
+    assert result == {'updated': 7, 'not_found': [99]}
+
+    inventory = client.get(INVENTORY)['results']
+    assert [inv['price'] for inv in inventory] == [21, 22, 23, 24, 25, 15, 15, 15, 15]
+    assert [inv['amount'] for inv in inventory] == [10] * 5 + [0, 1] + [10] * 2
+    assert [inv['on_sale'] for inv in inventory] == [False] * 5 + [True] * 2 + [False] * 2
+
+    # NULL values are updated too
+    client.patch(POTENCY, headers=valid_token, json=[{'id': 2, 'changes': {'prefix': None}}])
+    assert client.get(f'{POTENCY}/2')['results'][0]['prefix'] is None
+
+    # no rows are changed if any update fails
+    response = client.patch(POTIONS, headers=valid_token, json=[
+        {'id': 1, 'changes': {'type_id': 2}},
+        {'id': 2, 'changes': {'type_id': 9000}}
+    ], as_response=True)
+    assert response.status_code == 400
+    assert client.get(f'{POTIONS}/1')['results'][0]['type_id'] == 1
+    delete_all()
+
+def test_patch_filter(client):
+    prepopulate()
+    result = client.patch(INVENTORY, headers=valid_token, json={
+        'filter': {'price': 15, 'on_sale': False},
+        'changes': {'price': 12, 'on_sale': True}
+    })
+    assert result == {'updated': 9}
+
+    result = client.patch(INVENTORY, headers=valid_token, json={
+        'filter': {'potion_id': 3},
+        'changes': {'amount': 0}
+    })
+    assert result == {'updated': 1}
+
+    inventory = client.get(INVENTORY)['results']
+    assert all(inv['price'] == 12 and inv['on_sale'] for inv in inventory)
+    assert [inv['amount'] for inv in inventory] == [10, 10, 0] + [10] * 6
+    delete_all()
+
+def test_post_on_conflict(client):
+    prepopulate()
+    catalog = [
+        {'related_stat': 'Vigor',   'color': 'red'},   # existing color
+        {'related_stat': 'Speed',   'color': 'yellow'},
+        {'related_stat': 'Stamina', 'color': 'green'}, # unchanged
+        {'related_stat': 'Luck',    'color': 'yellow'} # last one is kept
+    ]
+    result = client.post(f'{POTION_TYPE}?on_conflict=update', headers=valid_token, json=catalog)
+    # existing rows keep their ids (conflicting rows still use up
+    # an id from the sequence, so new ids may skip some values)
+    assert [r['id'] for r in result['results']] == [1, result['results'][1]['id'], 3]
+    assert result['results'][1]['id'] > 3
+    assert [(r['related_stat'], r['color']) for r in result['results']] == [
+        ('Vigor', 'red'), ('Luck', 'yellow'), ('Stamina', 'green')
+    ]
+
+    # ignored rows aren't returned
+    result = client.post(f'{POTENCY}?on_conflict=ignore', headers=valid_token, json=[
+        {'restores': 0.25, 'prefix': 'Low'},
+        {'restores': 0.75, 'prefix': 'Mega-'}
+    ])
+    assert [(r['restores'], r['prefix']) for r in result['results']] == [(0.75, 'Mega-')]
+
+    resp = client.post(f'{POTENCY}?on_conflict=ignore', headers=valid_token,
+                       json={'restores': 0.25, 'prefix': 'Low'}, as_response=True)
+    assert resp.status_code == 200
+    assert resp.json['results'] == EMPTY
+
+    potencies = client.get(POTENCY)['results']
+    assert [p['prefix'] for p in potencies] == [None, 'Hi-', 'Full', 'Mega-']
+    types = client.get(POTION_TYPE)['results']
+    assert [t['related_stat'] for t in types] == ['Vigor', 'Mana', 'Stamina', 'Luck']
+    delete_all()
+
+def test_post_on_conflict_invalid(client):
+    prepopulate()
+    resp = client.post(f'{POTION_TYPE}?on_conflict=replace', headers=valid_token,
+                       json={'related_stat': 'Vigor', 'color': 'red'}, as_response=True)
+    assert resp.status_code == 400
+    assert resp.json['description'] == "Invalid value for 'on_conflict' parameter."
+
+    # potions have no unique column
+    resp = client.post(f'{POTIONS}?on_conflict=update', headers=valid_token,
+                       json={'potency_id': 1, 'type_id': 1}, as_response=True)
+    assert resp.status_code == 400
+    assert resp.json['description'] == 'potions has no unique column to resolve conflicts on'
+    delete_all()
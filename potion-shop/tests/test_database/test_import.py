@@ -0,0 +1,91 @@
+import json
+
+from tests.helpers.temp_application import client
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+# token only required on non-GET requests
+valid_token = {'Authorization': create_token(token)}
+CSV    = dict(valid_token, **{'Content-Type': 'text/csv'})
+NDJSON = dict(valid_token, **{'Content-Type': 'application/x-ndjson'})
+
+POTION_TYPE  = '/v1/potions/types'
+INVENTORY    = '/v1/inventory'
+
+def test_import_csv(client):
+    prepopulate()
+    rows = ['potion_id,price,amount,on_sale']
+    rows += [f'{i % 9 + 1},{10 + i},{i},{"true" if i % 2 else "n"}' for i in range(9)]
+    rows += [
+        '99,10,1,false',   # potion doesn't exist
+        '1,cheap,1,false', # price isn't an int
+        '1,10,,false'      # amount is required
+    ]
+
+    # config_pytest.yml imports 5 rows per batch
+    summary = client.post(f'{INVENTORY}/import', headers=CSV, body='\n'.join(rows))
+    assert summary['rows'] == 12
+    assert summary['inserted'] == 9
+    assert summary['rejected'] == 3
+    assert [batch['rows'] for batch in summary['batches']] == [5, 5, 2]
+    assert [batch['inserted'] for batch in summary['batches']] == [5, 4, 0]
+    assert summary['errors'] == [
+        {'line': 11, 'error': 'potion_id does not exist in potions'},
+        {'line': 12, 'error': 'price must be of type int'},
+        {'line': 13, 'error': 'amount is required'}
+    ]
+
+    imported = client.get(f'{INVENTORY}?limit=100')['results'][9:]
+    assert imported == [
+        {'id': 10 + i, 'potion_id': i % 9 + 1, 'price': 10 + i, 'amount': i, 'on_sale': bool(i % 2)}
+        for i in range(9)
+    ]
+    delete_all()
+
+def test_import_ndjson(client):
+    prepopulate()
+    rows = [
+        {'related_stat': 'Speed', 'color': 'yellow'},
+        {'related_stat': 'Luck',  'color': 'red'},    # already in the table
+        {'related_stat': 'Magic', 'color': 'purple'},
+        {'related_stat': 'Mana',  'color': 'yellow'}, # repeated in the import
+        {'related_stat': 'Magic', 'color': 3}
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows) + '\n\nnot json\n'
+
+    summary = client.post(f'{POTION_TYPE}/import', headers=NDJSON, body=body)
+    assert summary['rows'] == 6
+    assert summary['inserted'] == 2
+    assert summary['errors'] == [
+        {'line': 2, 'error': 'color already exists'},
+        {'line': 4, 'error': 'color is repeated in the import'},
+        {'line': 5, 'error': 'color must be of type str'},
+        {'line': 7, 'error': 'Invalid JSON'}
+    ]
+
+    colors = [t['color'] for t in client.get(POTION_TYPE)['results']]
+    assert colors == ['red', 'blue', 'green', 'yellow', 'purple']
+    delete_all()
+
+def test_import_invalid(client):
+    delete_all()
+    # requires a token
+    resp = client.post(f'{INVENTORY}/import', headers={'Content-Type': 'text/csv'},
+                       body='potion_id,price,amount,on_sale\n', as_response=True)
+    assert resp.status_code == 401
+
+    resp = client.post(f'{INVENTORY}/import', headers=valid_token,
+                       json=[{'potion_id': 1}], as_response=True)
+    assert resp.status_code == 415
+
+    resp = client.post(f'{INVENTORY}/import', headers=CSV,
+                       body='potion_id,cost\n1,10\n', as_response=True)
+    assert resp.status_code == 400
+    assert resp.json['description'] == "Invalid CSV header. Unsupported or repeated columns: {'cost'}"
+
+    # an empty body imports nothing
+    summary = client.post(f'{INVENTORY}/import', headers=CSV, body='')
+    assert summary['rows'] == 0
+    assert summary['batches'] == []
+    delete_all()
@@ -0,0 +1,62 @@
+from tests.helpers.data_manager import get_db_session
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+
+from potion_shop.database.migrations import migrate
+from potion_shop.database.models import Potions
+from potion_shop.database.models import PotionTypes
+from potion_shop.database.operators import DBOperator, SEARCH_PREFIX
+
+INDEXES = [
+    'ix_potion_inventory_potion_id',
+    'ix_potion_potency_prefix_lower',
+    'ix_potion_types_color_lower',
+    'ix_potion_types_related_stat_lower',
+    'ix_potions_potency_id',
+    'ix_potions_type_id'
+]
+
+def _index_names(session):
+    return {row[0] for row in session.execute(
+        'SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()')}
+
+def _plan(session, query):
+    sql = query.statement.compile(dialect=session.get_bind().dialect, compile_kwargs={'literal_binds': True})
+    with session.begin():
+        # the test tables are tiny, so scanning them would always be cheaper
+        session.execute('SET LOCAL enable_seqscan = off')
+        return '\n'.join(row[0] for row in session.execute(f'EXPLAIN {sql}'))
+
+def test_indexes_created():
+    session = get_db_session()
+    assert set(INDEXES) <= _index_names(session)
+    # nothing left to add
+    assert migrate(session.get_bind()) == []
+
+def test_migrate_existing_database():
+    session = get_db_session()
+    # a database created before the indexes were added
+    session.execute('DROP INDEX ix_potions_type_id')
+    session.execute('DROP INDEX ix_potion_types_color_lower')
+    assert migrate(session.get_bind()) == ['ix_potion_types_color_lower', 'ix_potions_type_id']
+    assert set(INDEXES) <= _index_names(session)
+    assert migrate(session.get_bind()) == []
+
+def test_prefix_search_uses_index():
+    prepopulate()
+    session = get_db_session()
+    table = DBOperator(session, PotionTypes)
+    search, value = table._search('color', 'Re')
+    assert search == SEARCH_PREFIX
+    query = session.query(PotionTypes).filter(table._search_criterion('color', search, value))
+    assert 'ix_potion_types_color_lower' in _plan(session, query)
+    session.remove()
+    delete_all()
+
+def test_foreign_key_search_uses_index():
+    prepopulate()
+    session = get_db_session()
+    query = session.query(Potions).filter(Potions.type_id == 2)
+    assert 'ix_potions_type_id' in _plan(session, query)
+    session.remove()
+    delete_all()
@@ -135,3 +135,28 @@ def test_potion_type_duplicate_color(client):
     assert response.status_code == 400
 
     delete_all()
+
+@pytest.mark.parametrize('body,description', [
+    ({'id': 1, 'changes': {'price': 1}}, "Content must be a list of updates or a dict with 'filter' and 'changes'"),
+    ([{'id': 1, 'price': 1}], "Item 0: must be in the format {'id': ..., 'changes': {...}}"),
+    ([{'id': '1', 'changes': {'price': 1}}], 'Item 0: id must be of type int'),
+    ([{'id': 1, 'changes': {'price': 1}}, {'id': 1, 'changes': {'amount': 1}}], 'Item 1: id 1 is repeated'),
+    ([{'id': 1, 'changes': {}}], 'Item 0: changes must be a dict of columns to update'),
+    ([{'id': 1, 'changes': {'id': 2}}], 'Item 0: Unable to update column: id'),
+    ([{'id': 1, 'changes': {'in_stock': 2}}], 'Item 0: Unable to update column: in_stock'),
+    ([{'id': 1, 'changes': {'price': 'free'}}], 'Item 0: price must be of type int'),
+    ([{'id': 1, 'changes': {'amount': None}}], 'Item 0: amount is required'),
+    ({'filter': {}, 'changes': {'price': 1}}, 'filter must be a dict of columns to match'),
+    ({'filter': {'in_stock': True}, 'changes': {'price': 1}}, 'Table does not contain column: in_stock'),
+    ({'filter': {'on_sale': 'no'}, 'changes': {'price': 1}}, 'filter: on_sale must be of type bool')
+])
+def test_patch_invalid(client, body, description):
+    prepopulate()
+    response = client.patch('/v1/inventory', headers=valid_token, json=body, as_response=True)
+    assert response.status_code == 400
+    assert response.json['description'] == description
+
+    # nothing was changed
+    inventory = client.get('/v1/inventory')['results']
+    assert all(inv['price'] == 15 and inv['amount'] == 10 for inv in inventory)
+    delete_all()
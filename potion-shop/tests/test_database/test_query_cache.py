@@ -0,0 +1,91 @@
+from tests.helpers.temp_application import client
+from tests.helpers.data_manager import get_db_session
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+
+from potion_shop.database.models import PotionInventory
+from potion_shop.database.models import PotionTypes
+from potion_shop.database.operators import DBOperator
+from potion_shop.database.query_cache import QueryCache
+
+INVENTORY    = '/v1/inventory'
+POTION_TYPE  = '/v1/potions/types'
+
+def _cache_stats(client):
+    return client.get('/v1/metrics')['query_cache']
+
+def test_same_shape_hits(client):
+    prepopulate()
+    client.get(f'{INVENTORY}?potion_id=1&on_sale=false')
+    before = _cache_stats(client)
+
+    # same columns & comparisons, different values: no new query shape
+    assert client.get(f'{INVENTORY}?potion_id=2&on_sale=false')['results'][0]['potion_id'] == 2
+    assert client.get(f'{INVENTORY}?on_sale=f&potion_id=3')['results'][0]['potion_id'] == 3
+    after = _cache_stats(client)
+    assert after['hits'] == before['hits'] + 2
+    assert after['shapes'] == before['shapes']
+
+    # a different combination of columns is another shape
+    client.get(f'{INVENTORY}?potion_id=2&amount=10')
+    assert _cache_stats(client)['shapes'] == after['shapes'] + 1
+
+    # get by id
+    client.get(f'{INVENTORY}/1')
+    before = _cache_stats(client)
+    assert client.get(f'{INVENTORY}/2')['results'][0]['id'] == 2
+    assert _cache_stats(client)['hits'] == before['hits'] + 1
+    delete_all()
+
+def test_baked_matches_query():
+    prepopulate()
+    session = get_db_session()
+    table = DBOperator(session, PotionTypes)
+
+    for search in [{}, {'color': 'R'}, {'color': 'b', 'id': 2}, {'related_stat': 'x'}]:
+        query = table.get_all()
+        for column, value in search.items():
+            query = table.get_by_column(column, value, query)
+        expected = [(row.id, row.color) for row in table.get_page(query, 2)[0]]
+
+        rows, next_id = table.get_page_by(search, 2)
+        assert [(row.id, row.color) for row in rows] == expected
+        rows, next_id = table.get_page_by(search, 2, fields=['color'])
+        assert [row[0] for row in rows] == [color for id, color in expected]
+
+    inventory = DBOperator(session, PotionInventory)
+    rows, next_id = inventory.get_page_by({'on_sale': 'maybe'}, 10)
+    assert rows == [] and next_id is None
+    rows, next_id = inventory.get_page_by({'on_sale': 'false'}, 5, after=2)
+    assert [row.id for row in rows] == [3, 4, 5, 6, 7]
+    assert next_id == 7
+    delete_all()
+
+def test_query_cache():
+    cache = QueryCache()
+    built = []
+    def build(bakery):
+        built.append(bakery)
+        return object()
+
+    first = cache.get(('a',), build)
+    assert cache.get(('a',), build) is first
+    cache.get(('b',), build)
+    assert len(built) == 2
+    assert cache.stats() == {'shapes': 2, 'max_shapes': 1000, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+def test_query_cache_lru():
+    cache = QueryCache(size=2)
+    build = lambda bakery: object()
+    first = cache.get(('a',), build)
+    cache.get(('b',), build)
+    cache.get(('a',), build) # 'b' is now the least recently used
+    cache.get(('c',), build)
+
+    stats = cache.stats()
+    assert (stats['shapes'], stats['evictions']) == (2, 1)
+    assert cache.get(('a',), build) is first
+    # 'b' was dropped, and is built again
+    misses = stats['misses']
+    cache.get(('b',), build)
+    assert cache.stats()['misses'] == misses + 1
@@ -0,0 +1,140 @@
+import pytest
+from pytest_falcon_client import make_client
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.application import PotionApplication
+from potion_shop.middleware.read_routing import WRITE_COOKIE
+
+valid_token = {'Authorization': create_token(token)}
+
+POTIONS    = '/v1/potions'
+DESCRIBE   = '/v1/potions/describe'
+INVENTORY  = '/v1/inventory'
+
+# the test database is its own "replica", reached through another host name
+LIVE_REPLICA = {'server': '127.0.0.1'}
+DEAD_REPLICA = {'server': '127.0.0.1', 'port': 1}
+
+def _replica_api(replicas, **config):
+    cfg = get_config()
+    cfg.database = dict(cfg.database, replicas=replicas, replica_eject_seconds=60)
+    for section, values in config.items():
+        setattr(cfg, section, dict(getattr(cfg, section), **values))
+    return PotionApplication(cfg)
+
+def _replica_client(make_client, replicas):
+    return make_client(_replica_api(replicas))
+
+def _reads(client):
+    return [replica['reads'] for replica in client.get('/v1/metrics')['replicas']]
+
+def test_reads_from_replica(make_client):
+    prepopulate()
+    client = _replica_client(make_client, [LIVE_REPLICA])
+
+    assert len(client.get(POTIONS)['results']) == 9
+    assert client.get(f'{POTIONS}/1')['results'][0]['id'] == 1
+    assert len(client.get(DESCRIBE)) == 9
+    client.get(f'{DESCRIBE}/1')
+    client.get(f'{INVENTORY}?stream=true')
+    assert _reads(client) == [5]
+
+    # writes are never sent to a replica
+    client.put(f'{INVENTORY}/1', headers=valid_token, json={'amount': 3})
+    assert _reads(client) == [5]
+    delete_all()
+
+def test_round_robin(make_client):
+    prepopulate()
+    client = _replica_client(make_client, [LIVE_REPLICA, {'server': 'localhost'}])
+    for i in range(6):
+        client.get(POTIONS)
+    assert _reads(client) == [3, 3]
+    delete_all()
+
+def test_read_your_writes(make_client):
+    prepopulate()
+    client = _replica_client(make_client, [LIVE_REPLICA])
+
+    resp = client.put(f'{INVENTORY}/1', headers=valid_token, json={'amount': 3}, as_response=True)
+    assert resp.status_code == 204
+    cookie = resp.cookies[WRITE_COOKIE]
+
+    # reads with a recent write cookie (or the header) stay on the primary
+    item = client.get(f'{INVENTORY}/1', headers={'Cookie': f'{WRITE_COOKIE}={cookie.value}'})
+    assert item['results'][0]['amount'] == 3
+    client.get(DESCRIBE, headers={'X-Read-Primary': 'true'})
+    assert _reads(client) == [0]
+
+    # an old write cookie doesn't
+    client.get(f'{INVENTORY}/1', headers={'Cookie': f'{WRITE_COOKIE}=1000.0'})
+    assert _reads(client) == [1]
+
+    # failed writes don't set the cookie
+    resp = client.put(f'{INVENTORY}/99', headers=valid_token, json={'amount': 3}, as_response=True)
+    assert resp.status_code == 404
+    assert WRITE_COOKIE not in resp.cookies
+    delete_all()
+
+def test_replica_ejected(make_client):
+    prepopulate()
+    client = _replica_client(make_client, [DEAD_REPLICA, LIVE_REPLICA])
+
+    # the read that fails on the dead replica is run on the primary
+    for i in range(4):
+        assert len(client.get(POTIONS)['results']) == 9
+
+    dead, live = client.get('/v1/metrics')['replicas']
+    assert dead['healthy'] is False
+    assert dead['ejections'] == 1
+    assert dead['reads'] == 0
+    assert live['healthy'] is True
+    assert live['reads'] == 3
+
+    # invalid search values are not connection errors
+    resp = client.get(f'{INVENTORY}?amount=lots', as_response=True)
+    assert resp.status_code == 400
+    assert client.get('/v1/metrics')['replicas'][1]['healthy'] is True
+    delete_all()
+
+def test_lagging_replica(make_client):
+    prepopulate()
+    api = _replica_api([LIVE_REPLICA], cache={'enabled': True, 'ttl': 60})
+    client = make_client(api)
+    replica = api.manager.replicas.choose().manager
+
+    # the replica reads from a snapshot taken before the write below
+    connection = replica.engine.connect()
+    snapshot = connection.begin()
+    connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+    connection.execute('SELECT 1')
+    session = replica.session
+    replica.session = scoped_session(sessionmaker(bind=connection, autocommit=True))
+
+    client.put(f'{INVENTORY}/1', headers=valid_token, json={'amount': 3})
+    stale = client.get(f'{INVENTORY}/1', as_response=True)
+    assert stale.json['results'][0]['amount'] != 3
+    # a stale body is neither tagged nor cached
+    assert 'ETag' not in stale.headers
+    assert 'X-Cache' not in stale.headers
+    assert _reads(client) == [1]
+
+    # once the replica catches up, the current rows are read (not a cached stale body)
+    snapshot.rollback()
+    connection.close()
+    replica.session = session
+    fresh = client.get(f'{INVENTORY}/1', as_response=True)
+    assert fresh.json['results'][0]['amount'] == 3
+    assert 'ETag' not in fresh.headers
+
+    # reads from the primary are tagged
+    primary = client.get(f'{INVENTORY}/1', headers={'X-Read-Primary': 'true'}, as_response=True)
+    resp = client.get(f'{INVENTORY}/1', headers={'If-None-Match': primary.headers['ETag']},
+                      as_response=True)
+    assert resp.status_code == 304
+    delete_all()
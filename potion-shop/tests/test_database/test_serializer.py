@@ -0,0 +1,44 @@
+import json
+import pytest
+
+from potion_shop.database.logging.models import Log
+from potion_shop.database.models import PotionInventory
+from potion_shop.database.models import PotionTypes
+from potion_shop.database.serializer import dumps, serializer_for
+
+def _inventory():
+    item = PotionInventory(potion_id=3, price=15, amount=10, on_sale=True)
+    item.id = 7
+    return item
+
+def test_to_dict():
+    item = _inventory()
+    expected = {'id': 7, 'potion_id': 3, 'price': 15, 'amount': 10, 'on_sale': True}
+    assert item.to_dict() == expected
+    assert serializer_for(PotionInventory).to_json_dict(item) == expected
+
+def test_serializer_cached():
+    assert serializer_for(PotionTypes) is serializer_for(PotionTypes)
+    assert serializer_for(PotionTypes, ('id',)) is serializer_for(PotionTypes, ('id',))
+    assert serializer_for(PotionTypes) is not serializer_for(PotionTypes, ('id',))
+
+def test_datetime_converted():
+    log = Log(msg='test', request_headers={'HOST': 'localhost'})
+    as_json = serializer_for(Log).to_json_dict(log)
+
+    # same format as json.dumps(..., default=str)
+    assert as_json['created_at'] == str(log.created_at)
+    assert as_json['request_headers'] == {'HOST': 'localhost'}
+    assert log.to_dict()['created_at'] == log.created_at
+
+@pytest.mark.parametrize('keys', [('amount',), ('id', 'amount'), ('on_sale', 'price', 'id')])
+def test_row_to_json_dict(keys):
+    item = _inventory()
+    row = tuple(getattr(item, key) for key in keys)
+    assert serializer_for(PotionInventory, keys).row_to_json_dict(row) == {key: getattr(item, key) for key in keys}
+
+def test_dumps_bytes():
+    item = _inventory()
+    encoded = dumps({'results': [item.to_dict()]})
+    assert isinstance(encoded, bytes)
+    assert encoded == json.dumps({'results': [item.to_dict()]}, default=str).encode('utf-8')
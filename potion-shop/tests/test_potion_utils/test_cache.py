@@ -0,0 +1,88 @@
+import time
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.versions import TableVersions
+from potion_shop.utils.cache import ResponseCache
+
+valid_token = {'Authorization': create_token(token)}
+
+def _cache(**kwargs):
+    versions = TableVersions(['table_a', 'table_b'])
+    return ResponseCache(versions=versions, **kwargs), versions
+
+def test_cache_hit_and_miss():
+    cache, versions = _cache()
+    assert cache.get('key') == None
+
+    cache.set('key', ('table_a',), cache.versions(('table_a',)), 'application/json', b'[]')
+    assert cache.get('key') == ('application/json', b'[]')
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_cache_lru_eviction():
+    cache, versions = _cache(max_entries=2)
+    for key in ['a', 'b']:
+        cache.set(key, ('table_a',), cache.versions(('table_a',)), 'application/json', key.encode())
+
+    cache.get('a') # 'b' is now the least recently used
+    cache.set('c', ('table_a',), cache.versions(('table_a',)), 'application/json', b'c')
+
+    assert cache.get('b') == None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+
+def test_cache_ttl():
+    cache, versions = _cache(ttl=0.05)
+    cache.set('key', ('table_a',), cache.versions(('table_a',)), 'application/json', b'[]')
+    time.sleep(0.1)
+    assert cache.get('key') == None
+
+def test_cache_invalidate():
+    cache, versions = _cache()
+    cache.set('a', ('table_a',), cache.versions(('table_a',)), 'application/json', b'a')
+    cache.set('b', ('table_b',), cache.versions(('table_b',)), 'application/json', b'b')
+
+    cache.invalidate('table_a')
+    assert cache.get('a') == None
+    assert cache.get('b') is not None
+
+def test_cache_stale_version():
+    # a table change made by another worker only bumps the shared version
+    cache, versions = _cache()
+    stale = cache.versions(('table_a', 'table_b'))
+    versions.bump('table_b')
+
+    cache.set('key', ('table_a', 'table_b'), stale, 'application/json', b'[]')
+    assert cache.get('key') == None
+
+def test_cached_api(make_client):
+    cfg = get_config()
+    cfg.cache = {'enabled': True, 'max_entries': 10, 'ttl': 30}
+    client = make_client(PotionApplication(cfg))
+    prepopulate()
+
+    resp = client.get('/v1/potions/types', as_response=True)
+    assert resp.headers['X-Cache'] == 'MISS'
+    resp = client.get('/v1/potions/types', as_response=True)
+    assert resp.headers['X-Cache'] == 'HIT'
+    assert len(resp.json['results']) == 3
+
+    # writes through the API invalidate the table's responses
+    client.put('/v1/potions/types/1', headers=valid_token, json={'color':'purple'})
+    resp = client.get('/v1/potions/types', as_response=True)
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['results'][0]['color'] == 'purple'
+
+    metrics = client.get('/v1/metrics')
+    assert metrics['response_cache']['hits'] >= 1
+    assert metrics['response_cache']['invalidations'] >= 1
+
+    delete_all()
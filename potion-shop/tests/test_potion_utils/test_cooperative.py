@@ -0,0 +1,68 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import psycopg2.extensions
+import psycopg2.extras
+import pytest
+
+from tests.helpers.temp_application import client
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.utils.cooperative import is_patched
+
+CSV = {'Authorization': create_token(token), 'Content-Type': 'text/csv'}
+
+INVENTORY = '/v1/inventory'
+
+# run in a new process: the patches can't be undone
+CONCURRENT_QUERIES = '''
+import time
+from potion_shop.utils.cooperative import patch, is_patched
+patch()
+
+import gevent
+from tests.helpers.data_manager import get_db_session
+
+assert is_patched()
+session = get_db_session()
+session.execute('SELECT 1')
+
+def sleep():
+    # each greenlet has its own (thread-local) session & connection
+    session.execute('SELECT pg_sleep(0.5)')
+    session.remove()
+
+start = time.perf_counter()
+gevent.joinall([gevent.spawn(sleep) for i in range(4)], raise_error=True)
+print(round(time.perf_counter() - start, 3))
+'''
+
+def test_concurrent_queries():
+    pytest.importorskip('gevent')
+    root = Path(__file__).resolve().parents[3]
+    result = subprocess.run([sys.executable, '-c', CONCURRENT_QUERIES], cwd=root,
+                            capture_output=True, text=True, timeout=60,
+                            env={'PYTHONPATH': ':'.join(sys.path)})
+    assert result.returncode == 0, result.stderr
+    # the queries waited for the database at the same time
+    assert float(result.stdout.split()[-1]) < 1.5
+
+def test_import_without_copy(client):
+    prepopulate()
+    assert not is_patched()
+    # cooperative connections can't COPY: batches are inserted instead
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+    try:
+        assert is_patched()
+        rows = ['potion_id,price,amount,on_sale'] + [f'{i + 1},20,5,true' for i in range(7)] + ['99,1,1,true']
+        summary = client.post(f'{INVENTORY}/import', headers=CSV, body='\n'.join(rows))
+    finally:
+        psycopg2.extensions.set_wait_callback(None)
+
+    assert summary['inserted'] == 7
+    assert summary['errors'] == [{'line': 9, 'error': 'potion_id does not exist in potions'}]
+    assert len(client.get(INVENTORY)['results']) == 16
+    delete_all()
@@ -0,0 +1,41 @@
+import pytest
+
+from tests.helpers.temp_application import client
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+valid_token = {'Authorization': create_token(token)}
+
+@pytest.mark.parametrize('url', ['/v1/inventory', '/v1/inventory/1', '/v1/potions/describe'])
+def test_if_none_match(client, url):
+    prepopulate()
+    resp = client.get(url, as_response=True)
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    resp = client.get(url, headers={'If-None-Match': etag}, as_response=True)
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == etag
+    assert resp.text == ''
+
+    resp = client.get(url, headers={'If-None-Match': '"not-the-etag"'}, as_response=True)
+    assert resp.status_code == 200
+    delete_all()
+
+def test_etag_changes_on_write(client):
+    prepopulate()
+    etag = client.get('/v1/inventory', as_response=True).headers['ETag']
+    # other tables are not affected
+    types_etag = client.get('/v1/potions/types', as_response=True).headers['ETag']
+
+    client.put('/v1/inventory/1', headers=valid_token, json={'amount': 0}, expected_statuses=[204])
+
+    resp = client.get('/v1/inventory', headers={'If-None-Match': etag}, as_response=True)
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.json['results'][0]['amount'] == 0
+
+    resp = client.get('/v1/potions/types', headers={'If-None-Match': types_etag}, as_response=True)
+    assert resp.status_code == 304
+    delete_all()
@@ -0,0 +1,238 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import client
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import delete_all
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import get_db_session
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.idempotency import DatabaseIdempotencyStore
+from potion_shop.utils.exceptions import InvalidConfiguration
+from potion_shop.utils.idempotency import IdempotencyConflict
+from potion_shop.utils.idempotency import IdempotencyStore
+
+valid_token = {'Authorization': create_token(token)}
+
+POTION_TYPE = '/v1/potions/types'
+INVENTORY   = '/v1/inventory'
+
+def _headers(key):
+    return dict(valid_token, **{'Idempotency-Key': key})
+
+class Manager:
+    def __init__(self, session):
+        self.engine = session.get_bind()
+
+@pytest.fixture
+def manager():
+    delete_all()
+    session = get_db_session()
+    yield Manager(session)
+    session.remove()
+
+def test_store_claim_and_replay():
+    store = IdempotencyStore()
+    assert store.claim('key', 'body') is None
+    store.finish('key', '201 Created', 'application/json', b'{}')
+
+    assert store.claim('key', 'body') == ('201 Created', 'application/json', b'{}')
+    with pytest.raises(IdempotencyConflict):
+        store.claim('key', 'another body')
+    assert store.stats()['replays'] == 1
+
+def test_store_release():
+    store = IdempotencyStore()
+    assert store.claim('key', 'body') is None
+    store.release('key')
+    # a failed request can be retried
+    assert store.claim('key', 'body') is None
+
+def test_store_eviction_and_ttl():
+    store = IdempotencyStore(max_entries=2, ttl=0.1)
+    for key in ['a', 'b', 'c']:
+        store.claim(key, 'body')
+        store.finish(key, '200 OK', 'application/json', key.encode())
+
+    assert store.stats()['evictions'] == 1
+    assert store.claim('a', 'body') is None # evicted
+    assert store.claim('c', 'body') == ('200 OK', 'application/json', b'c')
+
+    time.sleep(0.15)
+    assert store.claim('c', 'body') is None # expired
+
+def test_store_waits_for_in_flight():
+    store = IdempotencyStore(wait_timeout=5)
+    store.claim('key', 'body')
+
+    def finish():
+        time.sleep(0.1)
+        store.finish('key', '201 Created', 'application/json', b'done')
+    threading.Thread(target=finish).start()
+
+    assert store.claim('key', 'body') == ('201 Created', 'application/json', b'done')
+    assert store.stats()['waits'] == 1
+
+    store = IdempotencyStore(wait_timeout=0.1)
+    store.claim('key', 'body')
+    with pytest.raises(IdempotencyConflict):
+        store.claim('key', 'body')
+
+def test_post_replayed(client):
+    delete_all()
+    body = [{'related_stat': 'Health', 'color': 'red'}]
+    first = client.post(POTION_TYPE, headers=_headers('create-red'), json=body, as_response=True)
+    assert first.status_code == 201
+
+    retry = client.post(POTION_TYPE, headers=_headers('create-red'), json=body, as_response=True)
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == first.json
+    assert len(client.get(POTION_TYPE)['results']) == 1
+
+    # errors are replayed too
+    body = [{'related_stat': 'Mana', 'color': 'red'}]
+    for _ in range(2):
+        resp = client.post(POTION_TYPE, headers=_headers('duplicate-red'), json=body, as_response=True)
+        assert resp.status_code == 400
+
+    # the key can't be reused for another request
+    resp = client.post(POTION_TYPE, headers=_headers('create-red'), json=body, as_response=True)
+    assert resp.status_code == 422
+
+    # the same key on another route is a different key
+    resp = client.post('/v1/potions/potency', headers=_headers('create-red'),
+                       json={'restores': 0.5}, as_response=True)
+    assert resp.status_code == 201
+    delete_all()
+
+def test_import_replayed(client):
+    prepopulate()
+    csv = dict(_headers('import'), **{'Content-Type': 'text/csv'})
+    first = 'potion_id,price,amount,on_sale\n1,10,1,false\n'
+    second = 'potion_id,price,amount,on_sale\n2,20,2,true\n3,30,3,true\n'
+
+    resp = client.post(f'{INVENTORY}/import', headers=csv, body=first, as_response=True)
+    assert resp.status_code == 200
+    assert resp.json['inserted'] == 1
+
+    # the import's body is hashed too, even though StreamHandler doesn't read it
+    retry = client.post(f'{INVENTORY}/import', headers=csv, body=first, as_response=True)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == resp.json
+
+    resp = client.post(f'{INVENTORY}/import', headers=csv, body=second, as_response=True)
+    assert resp.status_code == 422
+    assert len(client.get(f'{INVENTORY}?limit=100')['results']) == 10
+
+    # a new key imports the second file
+    csv['Idempotency-Key'] = 'import-2'
+    resp = client.post(f'{INVENTORY}/import', headers=csv, body=second, as_response=True)
+    assert resp.json['inserted'] == 2
+    delete_all()
+
+def test_key_scoped_to_client(client):
+    delete_all()
+    other = {'Authorization': create_token(dict(token, sub='0987654321')), 'Idempotency-Key': 'create'}
+    for headers, color in [(_headers('create'), 'red'), (other, 'blue')]:
+        body = [{'related_stat': 'Health', 'color': color}]
+        resp = client.post(POTION_TYPE, headers=headers, json=body, as_response=True)
+        assert resp.status_code == 201
+        assert 'Idempotent-Replayed' not in resp.headers
+
+    assert len(client.get(POTION_TYPE)['results']) == 2
+    delete_all()
+
+def test_post_concurrent_retries(client):
+    delete_all()
+    body = [{'related_stat': f'Stat {i}', 'color': f'color {i}'} for i in range(500)]
+
+    def post(_):
+        return client.post(POTION_TYPE, headers=_headers('bulk'), json=body, as_response=True).status_code
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        statuses = list(pool.map(post, range(5)))
+
+    # one request inserted the rows, the others waited & got its response
+    assert statuses == [201] * 5
+    assert len(client.get(f'{POTION_TYPE}?limit=1000')['results']) == 500
+    delete_all()
+
+def test_database_store_shared(manager):
+    # two workers' stores
+    first, second = DatabaseIdempotencyStore(manager), DatabaseIdempotencyStore(manager)
+    key = ('POST', POTION_TYPE, 'key')
+    assert first.claim(key, 'body') is None
+    first.finish(key, '201 Created', 'application/json', b'{}')
+
+    assert second.claim(key, 'body') == ('201 Created', 'application/json', b'{}')
+    with pytest.raises(IdempotencyConflict):
+        second.claim(key, 'another body')
+    assert second.stats()['replays'] == 1
+
+    # a failed request can be retried by any worker
+    assert first.claim('failed', 'body') is None
+    first.release('failed')
+    assert second.claim('failed', 'body') is None
+
+def test_database_store_waits_for_other_worker(manager):
+    first = DatabaseIdempotencyStore(manager)
+    second = DatabaseIdempotencyStore(manager, wait_timeout=5)
+    first.claim('key', 'body')
+
+    def finish():
+        time.sleep(0.2)
+        first.finish('key', '201 Created', 'application/json', b'done')
+    threading.Thread(target=finish).start()
+
+    assert second.claim('key', 'body') == ('201 Created', 'application/json', b'done')
+    assert second.stats()['waits'] == 1
+
+    third = DatabaseIdempotencyStore(manager, wait_timeout=0.1)
+    third.claim('in flight', 'body')
+    with pytest.raises(IdempotencyConflict):
+        third.claim('in flight', 'body')
+
+def test_database_store_expiry(manager):
+    store = DatabaseIdempotencyStore(manager, ttl=0.1, wait_timeout=0.1, lease=0.1)
+    store.claim('done', 'body')
+    store.finish('done', '200 OK', 'application/json', b'done')
+    # the claim of a request that never finished (ex: its worker died)
+    store.claim('abandoned', 'body')
+
+    time.sleep(0.15)
+    assert store.claim('done', 'body') is None
+    assert store.claim('abandoned', 'another body') is None
+    store.release('done')
+    store.release('abandoned')
+
+    store.claim('expired', 'body')
+    time.sleep(0.15)
+    assert store.purge() == 1
+
+def test_post_replayed_by_other_worker(make_client):
+    delete_all()
+    workers = [make_client(PotionApplication(get_config())) for _ in range(2)]
+    body = [{'related_stat': 'Health', 'color': 'red'}]
+
+    first = workers[0].post(POTION_TYPE, headers=_headers('create-red'), json=body, as_response=True)
+    retry = workers[1].post(POTION_TYPE, headers=_headers('create-red'), json=body, as_response=True)
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(workers[1].get(POTION_TYPE)['results']) == 1
+    delete_all()
+
+def test_memory_store_single_worker():
+    cfg = get_config()
+    cfg.idempotency = dict(cfg.idempotency, store='memory')
+    assert isinstance(PotionApplication(cfg).idempotency, IdempotencyStore)
+
+    cfg.gunicorn = dict(cfg.gunicorn, workers=2)
+    with pytest.raises(InvalidConfiguration):
+        PotionApplication(cfg)
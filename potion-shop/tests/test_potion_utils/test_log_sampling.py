@@ -0,0 +1,99 @@
+import time
+
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import get_db_session
+
+from potion_shop.application import PotionApplication
+from potion_shop.database.logging.manager import flush_logs
+from potion_shop.database.logging.models import Log
+from potion_shop.utils.log_sampling import LogSampler
+
+INVENTORY = '/v1/inventory'
+
+def test_rates():
+    sampler = LogSampler(
+        rates={'5xx': 1, 401: 0.01, '4XX': 0.5},
+        routes={'/v1/inventory': {'404': 0.1}}
+    )
+    assert sampler.rate(503) == 1
+    assert sampler.rate(401) == 0.01
+    assert sampler.rate(404) == 0.5
+    assert sampler.rate(404, '/v1/inventory') == 0.1
+    # the route only overrides the statuses it lists
+    assert sampler.rate(401, '/v1/inventory') == 0.01
+    # not listed: always logged
+    assert sampler.rate(302) == 1
+
+def test_always_logged():
+    sampler = LogSampler(rates={'5xx': 1, '4xx': 0})
+    assert [sampler.sample('GET', '/v1/potions', 500) for _ in range(3)] == [0, 0, 0]
+    assert sampler.stats()['logged'] == 3
+
+def test_repeats_counted():
+    rolls = iter([0.5, 0.9, 0.05, 0.5])
+    sampler = LogSampler(rates={'404': 0.1}, window_seconds=0.2, random=lambda: next(rolls))
+    # the first error of the window is logged
+    assert sampler.sample('GET', None, 404) == 0
+    # then a tenth of them, with the number skipped before
+    assert [sampler.sample('GET', None, 404) for _ in range(3)] == [None, None, 2]
+    assert sampler.sample('GET', None, 404) is None
+    # other routes, methods & statuses are sampled on their own
+    assert sampler.sample('POST', None, 404) == 0
+    assert sampler.sample('GET', '/v1/potions', 404) == 0
+
+    # the next window starts with a log
+    time.sleep(0.25)
+    assert sampler.sample('GET', None, 404) == 1
+    assert sampler.stats()['skipped'] == 3
+
+def test_windows_pruned():
+    sampler = LogSampler(rates={'4xx': 0}, window_seconds=0.1)
+    # unrouted requests can have any method: the unknown ones are sampled together
+    for method in ['GET', 'BREW', 'STIR', 'X' * 100]:
+        for _ in range(2):
+            sampler.sample(method, None, 405)
+    stats = sampler.stats()
+    assert (stats['windows'], stats['logged'], stats['skipped_not_reported']) == (2, 2, 6)
+
+    # a window is kept for one more window, to report its skipped count
+    time.sleep(0.15)
+    assert sampler.sample('GET', None, 405) == 1
+    assert sampler.stats()['windows'] == 2
+
+    # then dropped, with its count only in the stats
+    time.sleep(0.25)
+    assert sampler.sample('POST', None, 405) == 0
+    stats = sampler.stats()
+    assert (stats['windows'], stats['skipped_not_reported']) == (1, 5)
+
+def test_error_storm_logged_once(make_client):
+    flush_logs()
+    session = get_db_session()
+    session.execute('TRUNCATE TABLE "runtime_logs" RESTART IDENTITY;')
+
+    cfg = get_config()
+    cfg.logging = dict(cfg.logging, sampling={'window_seconds': 0.5, 'rates': {'4xx': 0}})
+    api = PotionApplication(cfg)
+    client = make_client(api)
+
+    for _ in range(20):
+        assert client.post(INVENTORY, json={}, as_response=True).status_code == 401
+        assert client.get(f'{INVENTORY}/99', as_response=True).status_code == 404
+    time.sleep(0.6)
+    client.get(f'{INVENTORY}/99', as_response=True)
+    flush_logs()
+
+    errors = session.query(Log).filter(Log.level == 'ERROR').order_by(Log.log_id).all()
+    assert [(log.response_status, log.msg) for log in errors] == [
+        ('401 Unauthorized', 'Request Error'),
+        ('404 Not Found', 'Request Error'),
+        ('404 Not Found', 'Request Error (19 similar errors not logged)')
+    ]
+    # client errors don't store a traceback
+    assert errors[0].trace is None
+    stats = client.get('/v1/metrics')['log_sampling']
+    assert (stats['logged'], stats['skipped']) == (3, 38)
+    session.remove()
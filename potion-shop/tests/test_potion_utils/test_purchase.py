@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.helpers.temp_application import client
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+valid_token = {'Authorization': create_token(token)}
+
+PURCHASE  = '/v1/inventory/purchase'
+INVENTORY = '/v1/inventory'
+
+def test_purchase(client):
+    prepopulate()
+    # the same item can be listed more than once
+    order = [{'id': 3, 'quantity': 2}, {'id': 1, 'quantity': 10}, {'id': 3, 'quantity': 1}]
+    purchased = client.post(PURCHASE, headers=valid_token, json=order)['results']
+    assert [(item['id'], item['amount']) for item in purchased] == [(1, 0), (3, 7)]
+
+    amounts = [item['amount'] for item in client.get(INVENTORY)['results']]
+    assert amounts == [0, 10, 7] + [10] * 6
+    delete_all()
+
+@pytest.mark.parametrize('order,status,description', [
+    ([{'id': 2, 'quantity': 1}, {'id': 1, 'quantity': 11}], 409,
+        'Out of stock: inventory item 1 has 10 left, 11 requested'),
+    ([{'id': 1, 'quantity': 6}, {'id': 1, 'quantity': 6}], 409,
+        'Out of stock: inventory item 1 has 10 left, 12 requested'),
+    ([{'id': 1, 'quantity': 1}, {'id': 99, 'quantity': 1}], 404,
+        'Unable to find inventory item: 99'),
+    ([{'id': 1, 'quantity': 0}], 400, 'Item 0: quantity must be a positive int'),
+    ([{'id': '1', 'quantity': 1}], 400, 'Item 0: id must be of type int'),
+    ([{'id': 1}], 400, "Item 0: must be in the format {'id': ..., 'quantity': ...}"),
+    ({'id': 1, 'quantity': 1}, 400, 'Order must be a list of items to purchase')
+])
+def test_purchase_fails(client, order, status, description):
+    prepopulate()
+    response = client.post(PURCHASE, headers=valid_token, json=order, as_response=True)
+    assert response.status_code == status
+    assert response.json['description'] == description
+
+    # nothing was purchased
+    amounts = [item['amount'] for item in client.get(INVENTORY)['results']]
+    assert amounts == [10] * 9
+    delete_all()
+
+def test_purchase_requires_token(client):
+    response = client.post(PURCHASE, json=[{'id': 1, 'quantity': 1}], as_response=True)
+    assert response.status_code == 401
+
+def test_purchase_concurrent(client):
+    prepopulate()
+    # orders with the same items in a different order can't deadlock
+    orders = [
+        [{'id': 1, 'quantity': 1}, {'id': 2, 'quantity': 1}],
+        [{'id': 2, 'quantity': 1}, {'id': 1, 'quantity': 1}]
+    ] * 15
+
+    def purchase(order):
+        return client.post(PURCHASE, headers=valid_token, json=order, as_response=True).status_code
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        statuses = list(pool.map(purchase, orders))
+
+    # only the 10 in stock were sold
+    assert statuses.count(200) == 10
+    assert statuses.count(409) == 20
+    amounts = [item['amount'] for item in client.get(INVENTORY)['results']]
+    assert amounts == [0, 0] + [10] * 7
+    delete_all()
@@ -5,7 +5,7 @@ from tests.helpers.data_manager import prepopulate
 from tests.helpers.data_manager import delete_all
 from tests.helpers.data_manager import get_db_session
 
-from potion_shop.database.operators import DBOperator, query_to_dict
+from potion_shop.database.operators import DBOperator
 from potion_shop.database.models import PotionTypes
 from potion_shop.utils.exceptions import ItemNotFound, ContentFormatException
 
@@ -43,7 +43,7 @@ def test_search_invalid_key(client):
 ])
 def test_search_for_unknown_column(client, method):
     with pytest.raises(ItemNotFound):
-        exact_match = query_to_dict(method('notacolumn', 'test'))
+        method('notacolumn', 'test')
 
 def test_bad_add():
     with pytest.raises(ContentFormatException):
@@ -115,3 +115,83 @@ def test_search_multiple_keys(client):
     assert inventory1['results'] == inventory2['results']
 
     delete_all()
+
+@pytest.mark.parametrize('limit',[1, 2, 4, 9])
+def test_search_cursor_pages(client, limit):
+    prepopulate()
+    all_potions = client.get(f'{POTIONS}?limit=9')['results']
+
+    # follow the 'next' cursor until the last page
+    paged = []
+    resp = client.get(f'{POTIONS}?limit={limit}')
+    paged.extend(resp['results'])
+    while resp['next']:
+        assert len(resp['results']) == limit
+        resp = client.get(f'{POTIONS}?limit={limit}&cursor={resp["next"]}')
+        paged.extend(resp['results'])
+
+    assert paged == all_potions
+    delete_all()
+
+def test_search_cursor_with_filter(client):
+    prepopulate()
+    # prepopulate creates 3 potions for each type_id
+    resp = client.get(f'{POTIONS}?type_id=2&limit=2')
+    assert len(resp['results']) == 2
+    resp = client.get(f'{POTIONS}?type_id=2&limit=2&cursor={resp["next"]}')
+    assert len(resp['results']) == 1
+    assert resp['results'][0]['type_id'] == 2
+    assert resp['next'] == None
+    delete_all()
+
+def test_search_invalid_cursor(client):
+    prepopulate()
+    resp = client.get(f'{POTIONS}?cursor=notacursor', as_response=True)
+    assert resp.status_code == 400
+    assert resp.json['description'] == "Invalid value for 'cursor' parameter."
+
+    # cursor from a different table
+    next_cursor = client.get(f'{INVENTORY}?limit=1')['next']
+    resp = client.get(f'{POTIONS}?cursor={next_cursor}', as_response=True)
+    assert resp.status_code == 400
+    delete_all()
+
+@pytest.mark.parametrize('search', ['', '&price=15', '&limit=4', '&on_sale=n&limit=0'])
+def test_search_stream(client, search):
+    prepopulate()
+    # one page with every (filtered) row, unless the search sets the limit
+    paged_search = search[1:] if 'limit' in search else f'limit=9{search}'
+    paged = client.get(f'{INVENTORY}?{paged_search}')
+    streamed = client.get(f'{INVENTORY}?stream=true{search}')
+
+    assert streamed['results'] == paged['results']
+    assert 'next' not in streamed
+    delete_all()
+
+@pytest.mark.parametrize('fields', ['id,amount', 'amount', 'on_sale,price,potion_id', 'AMOUNT, id'])
+def test_search_fields(client, fields):
+    prepopulate()
+    selected = [f.strip().lower() for f in fields.split(',')]
+    all_inventory = client.get(f'{INVENTORY}?limit=9')['results']
+
+    projected = client.get(f'{INVENTORY}?limit=9&fields={fields}')
+    assert projected['results'] == [{f: inv[f] for f in selected} for inv in all_inventory]
+
+    streamed = client.get(f'{INVENTORY}?stream=true&fields={fields}')
+    assert streamed['results'] == projected['results']
+    delete_all()
+
+def test_search_fields_paged(client):
+    prepopulate()
+    # cursor still works if the primary key isn't one of the fields
+    resp = client.get(f'{INVENTORY}?limit=5&fields=amount')
+    assert len(resp['results']) == 5
+    resp = client.get(f'{INVENTORY}?limit=5&fields=amount&cursor={resp["next"]}')
+    assert len(resp['results']) == 4
+    assert resp['next'] == None
+    delete_all()
+
+def test_search_invalid_fields(client):
+    resp = client.get(f'{INVENTORY}?fields=id,notacolumn', as_response=True)
+    assert resp.status_code == 400
+    assert resp.json['description'] == "Unsupported fields: {'notacolumn'}"
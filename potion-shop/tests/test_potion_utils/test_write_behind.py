@@ -0,0 +1,147 @@
+import time
+
+import pytest
+from pytest_falcon_client import make_client
+
+from tests.helpers.temp_application import client
+from tests.helpers.temp_application import get_config
+from tests.helpers.data_manager import prepopulate
+from tests.helpers.data_manager import delete_all
+from tests.helpers.auth_token import create_token, token
+
+from potion_shop.application import PotionApplication
+
+valid_token = {'Authorization': create_token(token)}
+
+ADJUST    = '/v1/inventory/adjust'
+INVENTORY = '/v1/inventory'
+
+def _amounts(client):
+    return [item['amount'] for item in client.get(INVENTORY)['results']]
+
+def test_adjust(client):
+    prepopulate()
+    # without write-behind, adjustments are applied immediately
+    result = client.post(ADJUST, headers=valid_token, json=[
+        {'id': 1, 'delta': 5}, {'id': 2, 'delta': -3}, {'id': 1, 'delta': 1}, {'id': 99, 'delta': 1}
+    ])
+    assert result == {'updated': 2, 'not_found': [99]}
+    assert _amounts(client) == [16, 7] + [10] * 7
+    assert client.get(ADJUST) == {'pending': {}}
+    delete_all()
+
+@pytest.mark.parametrize('body,description', [
+    ({'id': 1, 'delta': 1}, 'Content must be a list of stock adjustments'),
+    ([{'id': 1, 'delta': 1.5}], 'Item 0: delta must be of type int'),
+    ([{'id': 1, 'amount': 1}], "Item 0: must be in the format {'id': ..., 'delta': ...}"),
+    ([{'id': 2**63, 'delta': 1}], 'Item 0: id must be a 64-bit int'),
+    ([{'id': 1, 'delta': 2**40}], 'Item 0: delta must be between -2147483648 and 2147483647'),
+    # the total of an item must fit too
+    ([{'id': 1, 'delta': 2**30}, {'id': 1, 'delta': 2**30}],
+     'Item 1: delta must be between -2147483648 and 2147483647')
+])
+def test_adjust_invalid(client, body, description):
+    response = client.post(ADJUST, headers=valid_token, json=body, as_response=True)
+    assert response.status_code == 400
+    assert response.json['description'] == description
+
+def test_write_behind(make_client):
+    cfg = get_config()
+    # long interval: the test flushes the deltas itself
+    cfg.write_behind = {'enabled': True, 'interval_ms': 60000, 'max_deltas': 1000}
+    api = PotionApplication(cfg)
+    client = make_client(api)
+    prepopulate()
+
+    for _ in range(50):
+        response = client.post(ADJUST, headers=valid_token, json=[{'id': 1, 'delta': -1}, {'id': 2, 'delta': 2}],
+                               as_response=True)
+        assert response.status_code == 202
+
+    # nothing is written until the deltas are flushed
+    assert client.get(ADJUST) == {'pending': {'1': -50, '2': 100}}
+    assert _amounts(client) == [10] * 9
+
+    assert api.stock_adjuster.flush() == 2
+    assert client.get(ADJUST) == {'pending': {}}
+    assert _amounts(client) == [-40, 110] + [10] * 7
+
+    metrics = client.get('/v1/metrics')['write_behind']
+    assert metrics['flushes'] == 1
+    assert metrics['flushed_deltas'] == 100
+    assert metrics['rows_updated'] == 2
+
+    # pending deltas are flushed on shutdown
+    client.post(ADJUST, headers=valid_token, json=[{'id': 3, 'delta': 5}])
+    api.stock_adjuster.close()
+    assert _amounts(client)[2] == 15
+    delete_all()
+
+def test_write_behind_max_deltas(make_client):
+    cfg = get_config()
+    cfg.write_behind = {'enabled': True, 'interval_ms': 60000, 'max_deltas': 10, 'max_pending': 1000}
+    api = PotionApplication(cfg)
+    client = make_client(api)
+    prepopulate()
+
+    # once max_deltas are pending, the flush thread is woken up
+    for _ in range(10):
+        client.post(ADJUST, headers=valid_token, json=[{'id': 4, 'delta': 1}])
+    for _ in range(100):
+        if not client.get(ADJUST)['pending']:
+            break
+        time.sleep(0.05)
+    assert _amounts(client)[3] == 20
+
+    api.stock_adjuster.close()
+    delete_all()
+
+def test_write_behind_max_pending(make_client):
+    cfg = get_config()
+    cfg.write_behind = {'enabled': True, 'interval_ms': 60000, 'max_deltas': 1000, 'max_pending': 5}
+    api = PotionApplication(cfg)
+    client = make_client(api)
+    prepopulate()
+
+    # once max_pending deltas are pending, new adjustments are rejected (not flushed by the request)
+    for _ in range(5):
+        client.post(ADJUST, headers=valid_token, json=[{'id': 4, 'delta': 1}])
+    response = client.post(ADJUST, headers=valid_token, json=[{'id': 4, 'delta': 1}], as_response=True)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/v1/metrics')['write_behind']['rejected'] == 1
+
+    # the rejection wakes the flush thread, and adjustments are
+    # accepted again once the deltas are written
+    for _ in range(100):
+        if not client.get(ADJUST)['pending']:
+            break
+        time.sleep(0.05)
+    response = client.post(ADJUST, headers=valid_token, json=[{'id': 4, 'delta': 1}], as_response=True)
+    assert response.status_code == 202
+
+    api.stock_adjuster.close()
+    assert _amounts(client)[3] == 16
+    delete_all()
+
+def test_write_behind_bad_delta(make_client):
+    cfg = get_config()
+    cfg.write_behind = {'enabled': True, 'interval_ms': 60000, 'max_deltas': 1000}
+    api = PotionApplication(cfg)
+    client = make_client(api)
+    prepopulate()
+
+    # valid deltas that take item 1's amount out of the INTEGER range
+    for _ in range(2):
+        client.post(ADJUST, headers=valid_token, json=[{'id': 1, 'delta': 2**31 - 10}, {'id': 2, 'delta': 5}])
+    client.post(ADJUST, headers=valid_token, json=[{'id': 3, 'delta': -5}])
+
+    # only the bad item is dropped, the others are written
+    assert api.stock_adjuster.flush() == 2
+    assert client.get(ADJUST) == {'pending': {}}
+    assert _amounts(client)[:3] == [10, 20, 5]
+    metrics = client.get('/v1/metrics')['write_behind']
+    assert (metrics['failed'], metrics['dropped'], metrics['errors']) == (1, 0, 0)
+
+    api.stock_adjuster.close()
+    delete_all()